@@ -0,0 +1,84 @@
+"""
+Benchmark for payout.calculate_user_sums_and_averages.
+
+Compares the percent matrix used by the payout script against the original
+approach of testing every nominator against every user's address list.
+
+Usage: python3 benchmarks/payout_averaging.py [users] [nominators] [snapshots]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.blockchain.payout import calculate_user_sums_and_averages
+
+def make_address(rng):
+    return ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz123456789') for _ in range(48))
+
+def make_data(user_count, nominator_count, snapshot_count, seed=0):
+    rng = random.Random(seed)
+    addresses = [make_address(rng) for _ in range(nominator_count)]
+
+    # Spread a third of the nominator addresses over the users, up to three each
+    users = {}
+    owned = rng.sample(addresses, min(nominator_count // 3, user_count * 3))
+    for i, address in enumerate(owned):
+        users.setdefault(f'user{i % user_count}', []).append(address)
+
+    snapshots = []
+    for i in range(snapshot_count):
+        percents = [(address, rng.random() / nominator_count) for address in addresses]
+        snapshots.append({'block': 1000 + 300 * i, 'nominators_percent': percents})
+    return users, snapshots
+
+def nested_loop_averages(user_addresses, parsed_log_data, start_block, end_block):
+    """
+    The original averaging loop, kept as the baseline, weighting snapshots by blocks like the
+    payout script: each snapshot covers the blocks of [start_block, end_block] from its own up
+    to the next one's, so the one before start_block covers the start of the range.
+    """
+    entries = sorted(parsed_log_data, key=lambda entry: entry['block'])
+    user_sums = {user: 0.0 for user in user_addresses}
+    block_count = 0
+    for i, entry in enumerate(entries):
+        next_block = entries[i + 1]['block'] if i + 1 < len(entries) else end_block + 1
+        weight = min(next_block, end_block + 1) - max(entry['block'], start_block)
+        if weight <= 0:
+            continue
+        block_count += weight
+        for nominator in entry['nominators_percent']:
+            for user, addresses in user_addresses.items():
+                if nominator[0] in addresses:
+                    user_sums[user] += nominator[1] * weight
+
+    return {user: ((user_sums[user] / block_count) if block_count > 0 else 0) for user in user_sums}
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    user_count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    nominator_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    snapshot_count = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    users, snapshots = make_data(user_count, nominator_count, snapshot_count)
+    # The range starts between two snapshots, so the one before it covers its first blocks
+    start_block, end_block = snapshots[0]['block'] + 150, snapshots[-1]['block']
+
+    expected, nested_seconds = time_call(nested_loop_averages, users, snapshots, start_block, end_block)
+    result, matrix_seconds = time_call(calculate_user_sums_and_averages, users, snapshots, start_block, end_block)
+
+    for user, average in expected.items():
+        assert abs(result[user] - average) < 1e-12, f"Mismatch for {user}"
+
+    print(f"{len(users)} users, {nominator_count} nominators, {snapshot_count} snapshots")
+    print(f"Nested loop:    {nested_seconds:.3f}s")
+    print(f"Percent matrix: {matrix_seconds:.3f}s")
+    print(f"Speedup:        {nested_seconds / matrix_seconds:.1f}x")
+
+if __name__ == "__main__":
+    main()
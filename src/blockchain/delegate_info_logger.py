@@ -1,36 +1,37 @@
+import asyncio
+import bisect
 import os
+import queue
 import sys
 import time
-import json
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import bittensor as bt
 
 # Navigate two levels up to the src directory
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.logger import setup_logger
+from data_management.snapshot_data import (build_snapshot_record, encode_snapshot, append_snapshot, iter_snapshots,
+                                            merge_snapshots, get_store_path, load_latest_snapshot, load_index)
+from data_management.snapshot_gaps import (record_missed, record_retry_failed, record_filled, load_gaps, get_due_blocks,
+                                           get_missing_blocks, resolve_filled_gaps, MAX_RETRY_ATTEMPTS)
+from data_management.snapshot_accumulators import update_accumulators
 
 # Set up custom logging
 log_file_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'logs', 'delegate_info.log')
+snapshot_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'logs', 'delegate_snapshots.jsonl')
 logger = setup_logger('delegate_info_logger', log_file_path)
 
 # Print the current working directory for debugging
 print("Current working directory:", os.getcwd())
 
-# Initialize subtensor connection
-config = bt.subtensor.config()
-network = "ws://127.0.0.1:9944"
-
-try:
-    sub = bt.subtensor(config=config, network=network)
-    logger.info("Connected to Subtensor.")
-except Exception as e:
-    logger.error(f"Failed to connect to the Subtensor: {e}")
-    exit(1)
+# Subtensor connection, opened by main()
+sub = None
 
 # Function to fetch the price from the given URL
 def fetch_price(url):
     try:
-        response = requests.get(url)
+        response = requests.get(url, timeout=30)
         response.raise_for_status()
         data = response.json()
         price = data[0]['price']
@@ -39,44 +40,160 @@ def fetch_price(url):
         logger.error(f"Failed to fetch price from {url}: {e}")
         return None
 
+def build_delegate_info_dict(delegate_info):
+    # Find the delegate_stake by searching for the nominator that matches the owner_ss58 address
+    delegate_stake = next((float(nominator[1]) for nominator in delegate_info.nominators if nominator[0] == delegate_info.owner_ss58), 0)
+
+    # Calculate the remaining stake after removing the delegate stake
+    remaining_stake = float(delegate_info.total_stake) - delegate_stake
+
+    # Calculate the percentage stake for each nominator
+    nominators_percent = [
+        (nominator[0], (float(nominator[1]) / remaining_stake) if remaining_stake > 0 else 0)
+        for nominator in delegate_info.nominators
+    ]
+
+    # Structure delegate_info into a dictionary, including 'nominators_percent', 'delegate_take', and 'price'.
+    return {
+        'hotkey_ss58': delegate_info.hotkey_ss58,
+        'total_stake': float(delegate_info.total_stake),
+        'nominators': [(nominator[0], float(nominator[1])) for nominator in delegate_info.nominators],
+        'nominators_percent': nominators_percent,
+        'owner_ss58': delegate_info.owner_ss58,
+        'delegate_stake': delegate_stake,
+        'take': float(delegate_info.take),
+        'validator_permits': delegate_info.validator_permits,
+        'registrations': delegate_info.registrations,
+        'return_per_1000': float(delegate_info.return_per_1000),
+        'total_daily_return': float(delegate_info.total_daily_return)
+    }
+
 # Define the function get_delegate_info
-def get_delegate_by_hotkey(hotkey_ss58_address, block=None):
+def get_delegate_by_hotkey(hotkey_ss58_address, block=None, price=None, store_path=snapshot_path, timestamp=None):
+    """
+    Snapshot a hotkey at a block. A failed target block is queued in the store's gap journal for retrying.
+
+    :param timestamp: The block's on-chain time, read from the chain when not given, so
+        snapshots of blocks the logger is catching up on aren't stamped with the current time.
+    """
     try:
+        if block is None:
+            block = sub.get_current_block()
         delegate_info = sub.get_delegate_by_hotkey(hotkey_ss58_address, block=block)
         if delegate_info is not None:
-            # Find the delegate_stake by searching for the nominator that matches the owner_ss58 address
-            delegate_stake = next((float(nominator[1]) for nominator in delegate_info.nominators if nominator[0] == delegate_info.owner_ss58), 0)
-
-            # Calculate the remaining stake after removing the delegate stake
-            remaining_stake = float(delegate_info.total_stake) - delegate_stake
-
-            # Calculate the percentage stake for each nominator
-            nominators_percent = [
-                (nominator[0], (float(nominator[1]) / remaining_stake) if remaining_stake > 0 else 0)
-                for nominator in delegate_info.nominators
-            ]
-
-            # Structure delegate_info into a dictionary, including 'nominators_percent', 'delegate_take', and 'price'.
-            delegate_info_dict = {
-                'hotkey_ss58': delegate_info.hotkey_ss58,
-                'total_stake': float(delegate_info.total_stake),
-                'nominators': [(nominator[0], float(nominator[1])) for nominator in delegate_info.nominators],
-                'nominators_percent': nominators_percent,
-                'owner_ss58': delegate_info.owner_ss58,
-                'delegate_stake': delegate_stake,
-                'take': float(delegate_info.take),
-                'validator_permits': delegate_info.validator_permits,
-                'registrations': delegate_info.registrations,
-                'return_per_1000': float(delegate_info.return_per_1000),
-                'total_daily_return': float(delegate_info.total_daily_return)
-            }
-            
-            timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
-            logger.info(f"Timestamp: {timestamp}, Block: {block if block is not None else 'latest'}, Delegate info for {hotkey_ss58_address}: {json.dumps(delegate_info_dict, ensure_ascii=False)}")
+            delegate_info_dict = build_delegate_info_dict(delegate_info)
+            if timestamp is None:
+                timestamp = get_block_timestamp(sub, block)
+            append_snapshot(build_snapshot_record(timestamp, block, delegate_info_dict, price), store_path)
+            logger.info(f"Timestamp: {timestamp}, Block: {block}, Snapshot of {len(delegate_info_dict['nominators'])} nominators for {hotkey_ss58_address} written to {store_path}")
         else:
-            logger.info(f"No delegate info found for {hotkey_ss58_address} at block {block if block is not None else 'latest'}.")
+            logger.info(f"No delegate info found for {hotkey_ss58_address} at block {block}.")
     except Exception as e:
         logger.error(f"Failed to get the delegate info for {hotkey_ss58_address}: {e}")
+        if block is not None:
+            record_missed(store_path, [block], str(e))
+
+def get_block_timestamp(subtensor, block):
+    """Return the on-chain timestamp of a block, formatted like live snapshot timestamps."""
+    block_hash = subtensor.substrate.get_block_hash(block)
+    moment = subtensor.substrate.query('Timestamp', 'Now', block_hash=block_hash)
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(int(moment.value) / 1000))
+
+def fetch_historical_snapshot(connections, hotkey_ss58_address, block, attempts=3):
+    """
+    Fetches the snapshot record of a past block using a connection borrowed from the pool.
+
+    :param connections: queue.Queue of bt.subtensor connections.
+    :return: The snapshot record, or None if the delegate didn't exist or every attempt failed.
+    """
+    subtensor = connections.get()
+    try:
+        for attempt in range(1, attempts + 1):
+            try:
+                delegate_info = subtensor.get_delegate_by_hotkey(hotkey_ss58_address, block=block)
+                if delegate_info is None:
+                    logger.info(f"No delegate info found for {hotkey_ss58_address} at block {block}.")
+                    return None
+                # Historical prices aren't available, so backfilled records carry no price
+                return build_snapshot_record(get_block_timestamp(subtensor, block), block, build_delegate_info_dict(delegate_info))
+            except Exception as e:
+                logger.error(f"Failed to backfill block {block} (attempt {attempt}/{attempts}): {e}")
+        return None
+    finally:
+        connections.put(subtensor)
+
+def get_backfill_blocks(start_block, end_block, stride, existing_blocks):
+    """
+    Lists the blocks on the stride grid within [start_block, end_block] that need a snapshot.
+
+    A grid block is skipped when the store already has a snapshot less than half a stride
+    away from it, so gaps are filled without doubling up around existing snapshots.
+
+    :param existing_blocks: Sorted list of blocks already in the store.
+    """
+    first_block = -(-start_block // stride) * stride
+    blocks = []
+    for block in range(first_block, end_block + 1, stride):
+        index = bisect.bisect_left(existing_blocks, block - stride / 2)
+        if index < len(existing_blocks) and existing_blocks[index] < block + stride / 2:
+            continue
+        blocks.append(block)
+    return blocks
+
+def open_connections(network, connection_count):
+    """Open a pool of subtensor connections for concurrent historical queries."""
+    connections = queue.Queue()
+    for _ in range(connection_count):
+        connections.put(bt.subtensor(config=bt.subtensor.config(), network=network))
+    return connections
+
+def backfill(hotkey_ss58_address, connections, start_block, end_block, stride=300, store_path=snapshot_path):
+    """
+    Snapshots past blocks that are missing from the store.
+
+    Blocks are fetched concurrently, one worker per connection in the pool (use an archive
+    node for blocks older than the node's pruning window). Fetched records are collected in
+    block order in a temporary file and merged into the store in one pass, so the store
+    stays ordered by block. Missed blocks queued by the logger that are now filled are
+    marked as such in the gap journal.
+
+    :param connections: Connection pool from open_connections.
+    :return: The number of snapshots added.
+    """
+    # The index holds the block of every snapshot in block order, so nothing is decoded. Blocks
+    # it is missing would only be fetched again and dropped by the merge.
+    existing_blocks = load_index(store_path)['block'].tolist()
+    blocks = get_backfill_blocks(start_block, end_block, stride, existing_blocks)
+    if not blocks:
+        logger.info(f"No gaps to backfill for {hotkey_ss58_address} between blocks {start_block} and {end_block}.")
+        return 0
+    connection_count = connections.qsize()
+    logger.info(f"Backfilling {len(blocks)} snapshots for {hotkey_ss58_address} between blocks {blocks[0]} and {blocks[-1]} over {connection_count} connections.")
+
+    temp_path = store_path + '.backfill'
+    missing = []
+    try:
+        with ThreadPoolExecutor(max_workers=connection_count) as executor, open(temp_path, 'w', encoding='utf-8') as file:
+            # map yields in block order however the fetches complete
+            records = executor.map(lambda block: fetch_historical_snapshot(connections, hotkey_ss58_address, block), blocks)
+            for block, record in zip(blocks, records):
+                if record is None:
+                    missing.append(block)
+                    continue
+                file.write(encode_snapshot(record))
+
+        added = merge_snapshots(store_path, iter_snapshots(temp_path))
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    logger.info(f"Backfilled {added} snapshots into {store_path}.")
+    filled = resolve_filled_gaps(store_path, stride)
+    if filled:
+        logger.info(f"Backfill filled {len(filled)} blocks the logger had missed.")
+    if missing:
+        logger.error(f"Could not backfill {len(missing)} blocks: {missing}")
+    return added
 
 def get_current_block_number():
     try:
@@ -86,33 +203,198 @@ def get_current_block_number():
         logger.error(f"Failed to get the current block number: {e}")
         return None
 
-def listen_to_chain_and_report(hotkey_ss58_address, report_every_n_blocks=300):
-    last_reported_block = None
-    price_url = 'https://taostats.io/data.json'
+# Snapshots are taken at block multiples of this interval
+REPORT_EVERY_N_BLOCKS = 300
+PRICE_URL = 'https://taostats.io/data.json'
+PRICE_REFRESH_SECONDS = 60
+# A cached price older than this is not attached to snapshots
+PRICE_MAX_AGE_SECONDS = 600
+
+async def watch_block_headers(network, block_queue):
+    """
+    Pushes the number of every new block header onto block_queue.
+
+    The subscription runs on its own connection in a worker thread, so it never shares a
+    websocket with snapshot queries. It is re-established after any failure, on a new
+    connection; the failed one is closed.
+    """
+    loop = asyncio.get_running_loop()
+
+    def handle_header(header, update_nr, subscription_id):
+        loop.call_soon_threadsafe(block_queue.put_nowait, int(header['header']['number']))
 
     while True:
-        current_block = get_current_block_number()
-        price = fetch_price(price_url)
-        if current_block is not None and price is not None:
-            if last_reported_block is None or current_block >= last_reported_block + report_every_n_blocks:
-                logger.info(f"Reporting for block number: {current_block}, Price: {price}")
-                get_delegate_by_hotkey(hotkey_ss58_address, current_block)
-                last_reported_block = current_block
-        else:
-            time.sleep(60)
+        subscriber = None
+        try:
+            subscriber = bt.subtensor(config=bt.subtensor.config(), network=network)
+            await asyncio.to_thread(subscriber.substrate.subscribe_block_headers, handle_header)
+        except Exception as e:
+            logger.error(f"Block header subscription failed, resubscribing: {e}")
+        finally:
+            if subscriber is not None:
+                try:
+                    subscriber.substrate.close()
+                except Exception as e:
+                    logger.error(f"Failed to close the block header connection: {e}")
+        await asyncio.sleep(10)
+
+async def refresh_price(price_cache, url=PRICE_URL, interval=PRICE_REFRESH_SECONDS):
+    """Keeps price_cache['price'] and price_cache['updated'] current, independently of snapshots."""
+    while True:
+        price = await asyncio.to_thread(fetch_price, url)
+        if price is not None:
+            price_cache['price'] = price
+            price_cache['updated'] = time.monotonic()
+        await asyncio.sleep(interval)
+
+def get_cached_price(price_cache, max_age=PRICE_MAX_AGE_SECONDS):
+    """Return the cached price, or None if it has never been fetched or is stale."""
+    if price_cache['price'] is None or time.monotonic() - price_cache['updated'] > max_age:
+        return None
+    return price_cache['price']
+
+def get_store_paths(hotkeys):
+    """
+    Map each hotkey to its snapshot store. The default store, which readers use unless given a
+    hotkey, stays with the hotkey logged to it, or goes to the first hotkey while it is empty
+    (unless that hotkey already has a store of its own); every other hotkey gets a store of its
+    own (see get_store_path).
+    """
+    store_paths = {hotkey: get_store_path(snapshot_path, hotkey) for hotkey in hotkeys}
+    if load_latest_snapshot(snapshot_path) is None and load_latest_snapshot(store_paths[hotkeys[0]]) is None:
+        store_paths[hotkeys[0]] = snapshot_path
+    return store_paths
+
+# At most this many missed blocks are retried per store on each pass, so a long outage
+# doesn't hold up new snapshots
+RETRY_BATCH_SIZE = 12
+
+def record_downtime_gaps(store_paths, first_block, report_every_n_blocks=REPORT_EVERY_N_BLOCKS):
+    """Queue the target blocks passed between each store's latest snapshot and first_block, e.g. while the logger was stopped."""
+    for store_path in store_paths.values():
+        latest_snapshot = load_latest_snapshot(store_path)
+        if latest_snapshot is None:
+            continue
+        pending = load_gaps(store_path)
+        missed = [
+            block for block in get_missing_blocks(store_path, latest_snapshot['block'] + 1, first_block - 1, report_every_n_blocks)
+            if pending.get(block, {}).get('state') != 'pending'
+        ]
+        if missed:
+            logger.info(f"{len(missed)} target blocks were missed since block {latest_snapshot['block']}; queued for retry.")
+            record_missed(store_path, missed, 'Logger was not running')
+
+def retry_missed_blocks(store_paths, batch_size=RETRY_BATCH_SIZE):
+    """
+    Retries queued missed blocks whose backoff has elapsed, against historical chain state.
+
+    Recovered snapshots have no price (historical prices aren't available) and are merged into
+    the store in block order. Blocks that keep failing are abandoned after MAX_RETRY_ATTEMPTS
+    retries and left for a backfill.
+    """
+    for hotkey_ss58_address, store_path in store_paths.items():
+        gaps = load_gaps(store_path)
+        records = []
+        for block in get_due_blocks(gaps)[:batch_size]:
+            attempts = gaps[block]['attempts'] + 1
+            try:
+                delegate_info = sub.get_delegate_by_hotkey(hotkey_ss58_address, block=block)
+                if delegate_info is None:
+                    # Nothing to snapshot at this block, so there is nothing to retry
+                    record_retry_failed(store_path, block, 'No delegate info at this block', MAX_RETRY_ATTEMPTS)
+                    continue
+                records.append(build_snapshot_record(get_block_timestamp(sub, block), block, build_delegate_info_dict(delegate_info)))
+            except Exception as e:
+                logger.error(f"Retry {attempts}/{MAX_RETRY_ATTEMPTS} of missed block {block} for {hotkey_ss58_address} failed: {e}")
+                record_retry_failed(store_path, block, str(e), attempts)
+
+        if records:
+            merge_snapshots(store_path, records)
+            record_filled(store_path, [record['block'] for record in records])
+            logger.info(f"Recovered {len(records)} missed snapshots for {hotkey_ss58_address}: {[record['block'] for record in records]}")
+
+def update_store_accumulators(store_paths):
+    """Extends every store's running accumulators (see snapshot_accumulators) with its new snapshots."""
+    for hotkey_ss58_address, store_path in store_paths.items():
+        try:
+            update_accumulators(store_path)
+        except Exception as e:
+            logger.error(f"Failed to update the snapshot accumulators for {hotkey_ss58_address}: {e}")
+
+def snapshot_hotkeys(store_paths, block, price):
+    """Snapshot every hotkey at the same block over the shared connection."""
+    # The block's time is read once for all hotkeys; if that fails, each snapshot tries again
+    try:
+        timestamp = get_block_timestamp(sub, block)
+    except Exception as e:
+        logger.error(f"Failed to get the timestamp of block {block}: {e}")
+        timestamp = None
+    for hotkey_ss58_address, store_path in store_paths.items():
+        get_delegate_by_hotkey(hotkey_ss58_address, block, price, store_path, timestamp)
+
+async def report_blocks(store_paths, block_queue, price_cache, report_every_n_blocks=REPORT_EVERY_N_BLOCKS):
+    """
+    Snapshots every hotkey at every block that is a multiple of report_every_n_blocks.
+
+    :param store_paths: Dictionary of hotkey -> snapshot store path, from get_store_paths.
+
+    When headers are missed (e.g. while resubscribing), every multiple passed in the
+    meantime is still snapshotted, at its own block. Multiples passed while the logger was
+    stopped, and snapshots that failed, are queued and retried (see retry_missed_blocks).
+    Retries and the stores' running accumulators run after the snapshots of each new target
+    block, not on every header.
+    """
+    next_block = None
+    while True:
+        block = await block_queue.get()
+        if next_block is None:
+            next_block = -(-block // report_every_n_blocks) * report_every_n_blocks
+            await asyncio.to_thread(record_downtime_gaps, store_paths, next_block, report_every_n_blocks)
+        if next_block > block:
             continue
-        time.sleep(10)
+        while next_block <= block:
+            price = get_cached_price(price_cache)
+            logger.info(f"Reporting for block number: {next_block}, Price: {price}")
+            await asyncio.to_thread(snapshot_hotkeys, store_paths, next_block, price)
+            next_block += report_every_n_blocks
+        # Retries share the connection, so they run between snapshots rather than alongside them
+        await asyncio.to_thread(retry_missed_blocks, store_paths)
+        # Payouts read range averages from the accumulators, so they follow every change to the store
+        await asyncio.to_thread(update_store_accumulators, store_paths)
 
+async def listen_to_chain_and_report(store_paths, network, report_every_n_blocks=REPORT_EVERY_N_BLOCKS):
+    block_queue = asyncio.Queue()
+    price_cache = {'price': None, 'updated': 0}
+    await asyncio.gather(
+        watch_block_headers(network, block_queue),
+        refresh_price(price_cache),
+        report_blocks(store_paths, block_queue, price_cache, report_every_n_blocks),
+    )
 
 def main():
+    global sub
+
     # Ensure enough arguments are provided (script name, hotkey address, and network)
     if len(sys.argv) < 3:
         logger.error("Insufficient arguments provided. Exiting.")
         return
 
-    # Extract the hotkey address and network address from the command-line arguments
-    hotkey_ss58_address = sys.argv[1]
+    # Extract the hotkey addresses (comma separated) and network address from the command-line arguments
+    hotkeys = [hotkey.strip() for hotkey in sys.argv[1].split(',') if hotkey.strip()]
     network = sys.argv[2]
+    store_paths = get_store_paths(hotkeys)
+
+    # Backfill mode: <hotkey> <network> backfill <start_block> <end_block> [stride] [connections]
+    if len(sys.argv) > 3 and sys.argv[3] == 'backfill':
+        if len(sys.argv) < 6:
+            logger.error("Backfill needs a start and end block. Exiting.")
+            return
+        stride = int(sys.argv[6]) if len(sys.argv) > 6 else 300
+        connection_count = int(sys.argv[7]) if len(sys.argv) > 7 else 4
+        connections = open_connections(network, connection_count)
+        for hotkey_ss58_address, store_path in store_paths.items():
+            backfill(hotkey_ss58_address, connections, int(sys.argv[4]), int(sys.argv[5]), stride, store_path)
+        return
 
     # Initialize subtensor connection
     try:
@@ -129,10 +411,10 @@ def main():
         logger.error("Cannot obtain the current block number, terminating.")
         return
 
-    logger.info("Script is starting logging immediately.")
+    logger.info(f"Script is starting; snapshots are taken every {REPORT_EVERY_N_BLOCKS} blocks.")
 
     # Continue with the main logic of the script
-    listen_to_chain_and_report(hotkey_ss58_address)
+    asyncio.run(listen_to_chain_and_report(store_paths, network))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,204 @@
+import hashlib
+import json
+
+# Fee model of the mock chain: every extrinsic costs a base fee plus a fee per transfer it
+# carries, so a single transfer costs the 144 rao the payout scripts used to assume
+BASE_FEE_RAO = 100
+TRANSFER_CALL_FEE_RAO = 44
+
+class MockReceipt:
+    """Mimics the parts of substrateinterface's ExtrinsicReceipt used by the payout scripts."""
+
+    def __init__(self, extrinsic_hash, block_hash=None, block_number=None, is_success=True, error_message=None):
+        self.extrinsic_hash = extrinsic_hash
+        self.block_hash = block_hash
+        self.block_number = block_number
+        self.is_success = is_success
+        self.error_message = error_message
+
+class MockExtrinsic:
+    """A signed extrinsic. Like substrateinterface's GenericExtrinsic it exposes extrinsic_hash."""
+
+    def __init__(self, call, signer, nonce, extrinsic_hash):
+        self.call = call
+        self.signer = signer
+        self.nonce = nonce
+        self.extrinsic_hash = extrinsic_hash
+
+class MockSubstrate:
+    """
+    In-memory substrate node that applies Balances transfers and Utility batches.
+
+    Extrinsics submitted with wait_for_inclusion are included in a block of their own
+    straight away. Extrinsics submitted without waiting stay in a pool until the next
+    block is produced, which happens every time the chain head is queried. Like a real
+    pool, an extrinsic is only included once its nonce is the signer's next nonce.
+
+    :param balances: Optional dictionary of ss58 address -> free balance in rao. When omitted,
+        balances are not checked.
+    :param fail_addresses: Transfers to these addresses fail, as if rejected by the runtime.
+    :param lost_response_addresses: Extrinsics transferring to these addresses are pooled, but
+        their submission raises as if the connection dropped before the node's response.
+    :param drop_addresses: Extrinsics transferring to these addresses are accepted, but evicted
+        from the pool instead of being included, leaving their nonce unused.
+    :param base_fee_rao / transfer_fee_rao: Fee model (see BASE_FEE_RAO). Fees are charged to
+        the signer when balances are checked, whether the call succeeds or not.
+    """
+
+    def __init__(self, balances=None, fail_addresses=(), block_number=0, base_fee_rao=BASE_FEE_RAO,
+                 transfer_fee_rao=TRANSFER_CALL_FEE_RAO, lost_response_addresses=(), drop_addresses=()):
+        self.balances = dict(balances) if balances is not None else None
+        self.fail_addresses = set(fail_addresses)
+        self.lost_response_addresses = set(lost_response_addresses)
+        self.drop_addresses = set(drop_addresses)
+        self.base_fee_rao = base_fee_rao
+        self.transfer_fee_rao = transfer_fee_rao
+        self.block_number = block_number
+        self.nonces = {}
+        self.blocks = {}
+        self.pool = []
+        self.submitted = []
+        self.receipts = {}
+
+    def compose_call(self, call_module, call_function, call_params=None):
+        return {'call_module': call_module, 'call_function': call_function, 'call_params': call_params or {}}
+
+    def get_payment_info(self, call, keypair):
+        """Mimics the fee estimate of substrateinterface (only partialFee is meaningful)."""
+        return {'class': 'normal', 'partialFee': self._get_fee(call), 'weight': 0}
+
+    def get_account_nonce(self, account_address):
+        return self.nonces.get(account_address, 0)
+
+    def rpc_request(self, method, params):
+        """Only system_accountNextIndex: the next nonce, counting the signer's pooled extrinsics."""
+        if method != 'system_accountNextIndex':
+            raise NotImplementedError(method)
+        nonce = self.get_account_nonce(params[0])
+        pooled = {extrinsic.nonce for extrinsic, _ in self.pool if extrinsic.signer == params[0]}
+        while nonce in pooled:
+            nonce += 1
+        return {'jsonrpc': '2.0', 'result': nonce}
+
+    def create_signed_extrinsic(self, call, keypair, nonce=None, **kwargs):
+        signer = keypair.ss58_address
+        if nonce is None:
+            nonce = self.get_account_nonce(signer)
+        payload = json.dumps({'call': call, 'signer': signer, 'nonce': nonce}, sort_keys=True, default=str)
+        return MockExtrinsic(call, signer, nonce, '0x' + hashlib.sha256(payload.encode()).hexdigest())
+
+    def submit_extrinsic(self, extrinsic, wait_for_inclusion=False, wait_for_finalization=False):
+        signer = extrinsic.signer
+        if extrinsic.nonce < self.get_account_nonce(signer):
+            raise Exception("Invalid Transaction: Transaction is outdated")
+        for pooled, _ in self.pool:
+            if pooled.signer == signer and pooled.nonce == extrinsic.nonce:
+                raise Exception("Transaction Already Imported" if pooled.extrinsic_hash == extrinsic.extrinsic_hash else "Priority is too low")
+
+        receipt = MockReceipt(extrinsic.extrinsic_hash)
+        self.submitted.append(extrinsic)
+        self.pool.append((extrinsic, receipt))
+        if wait_for_inclusion or wait_for_finalization:
+            self.produce_block()
+        if self._transfers_to(extrinsic.call, self.lost_response_addresses):
+            raise ConnectionError("Connection closed before the response was received")
+        return receipt
+
+    def produce_block(self):
+        """Include every pooled extrinsic whose nonce is next in line into a new block."""
+        self.block_number += 1
+        block_hash = '0x' + hashlib.sha256(str(self.block_number).encode()).hexdigest()
+        included = []
+
+        remaining = []
+        for extrinsic, receipt in sorted(self.pool, key=lambda pooled: pooled[0].nonce):
+            signer = extrinsic.signer
+            if self._transfers_to(extrinsic.call, self.drop_addresses):
+                continue
+            if extrinsic.nonce != self.get_account_nonce(signer):
+                remaining.append((extrinsic, receipt))
+                continue
+            self.nonces[signer] = extrinsic.nonce + 1
+            error_message = self._apply_call(signer, extrinsic.call)
+            receipt.block_hash = block_hash
+            receipt.block_number = self.block_number
+            receipt.is_success = error_message is None
+            receipt.error_message = error_message
+            self.receipts[extrinsic.extrinsic_hash] = receipt
+            included.append(extrinsic.extrinsic_hash)
+
+        self.pool = remaining
+        self.blocks[self.block_number] = {'hash': block_hash, 'extrinsics': included}
+        return self.blocks[self.block_number]
+
+    def get_block_number(self, block_hash=None):
+        # Querying the head stands in for time passing: one new block per query
+        if block_hash is None:
+            self.produce_block()
+        return self.block_number
+
+    def get_block(self, block_hash=None, block_number=None):
+        block = self.blocks.get(self.block_number if block_number is None else block_number)
+        if block is None:
+            return None
+        return {'header': {'number': block_number, 'hash': block['hash']}, 'extrinsics': list(block['extrinsics'])}
+
+    def get_extrinsic_receipt(self, extrinsic_hash, block_hash=None):
+        """Receipt of an extrinsic that was included in a block."""
+        return self.receipts[extrinsic_hash]
+
+    def drop_pool(self):
+        """Forget every pooled extrinsic, as a node restart would."""
+        self.pool = []
+
+    def _get_transfers(self, call):
+        """The transfers a call makes, or None if it is not a transfer, batch of transfers or remark."""
+        if call['call_module'] == 'Utility' and call['call_function'] in ('batch', 'batch_all'):
+            return [inner['call_params'] for inner in call['call_params']['calls']]
+        if call['call_module'] == 'Balances':
+            return [call['call_params']]
+        if call['call_module'] == 'System' and call['call_function'] == 'remark':
+            return []
+        return None
+
+    def _transfers_to(self, call, addresses):
+        return any(params['dest'] in addresses for params in self._get_transfers(call) or [])
+
+    def _get_fee(self, call):
+        transfers = self._get_transfers(call) or []
+        return self.base_fee_rao + self.transfer_fee_rao * len(transfers)
+
+    def _apply_call(self, signer, call):
+        """Apply a call atomically, after charging its fee. Return None on success or an error message."""
+        transfers = self._get_transfers(call)
+        if transfers is None:
+            return f"Unsupported call {call['call_module']}.{call['call_function']}"
+
+        if self.balances is not None:
+            fee = self._get_fee(call)
+            if self.balances.get(signer, 0) < fee:
+                return 'Payment.InabilityToPayFees'
+            self.balances[signer] -= fee
+
+        for params in transfers:
+            if params['dest'] in self.fail_addresses:
+                return f"Transfer to {params['dest']} rejected"
+
+        total = sum(params['value'] for params in transfers)
+        if self.balances is not None:
+            if self.balances.get(signer, 0) < total:
+                return 'Balances.InsufficientBalance'
+            self.balances[signer] -= total
+            for params in transfers:
+                self.balances[params['dest']] = self.balances.get(params['dest'], 0) + params['value']
+        return None
+
+class MockSubtensor:
+    """Stand-in for bt.subtensor so payouts can be dry-run without touching the chain."""
+
+    def __init__(self, balances=None, fail_addresses=(), block_number=0, lost_response_addresses=(), drop_addresses=()):
+        self.substrate = MockSubstrate(balances, fail_addresses, block_number,
+                                       lost_response_addresses=lost_response_addresses, drop_addresses=drop_addresses)
+
+    def get_current_block(self):
+        return self.substrate.get_block_number(None)
@@ -1,9 +1,17 @@
 import bittensor as bt
-import re
-import json
+import argparse
 import logging
-from decimal import Decimal
 import os
+from ..data_management.snapshot_data import iter_snapshots, load_latest_snapshot, get_covering_block
+from ..data_management.snapshot_gaps import get_coverage, format_coverage
+from ..data_management.snapshot_accumulators import get_range_averages
+from ..data_management.payout_history import get_last_paid_block, get_payout_paths, PayoutPaths, PAYMENT_HISTORY_COLUMNS
+from .stake_matrix import build_percent_matrix, average_address_percents
+from .transfers import batch_transfer, estimate_fee_schedule, DEFAULT_BATCH_SIZE
+from .payout_math import tao_to_rao, format_rao, allocate_rao, deduct_fees, DEFAULT_FEE_SCHEDULE
+from .payout_journal import (start_run, send_transfers, complete_run, abandon_run, load_runs, find_open_run,
+                             transfers_in_state, resolve_in_doubt, PAID_STATES, UNPAID_STATES, IN_DOUBT_STATES)
+from .mock_subtensor import MockSubtensor
 
 logger = logging.getLogger(__name__)
 
@@ -11,184 +19,239 @@ logger = logging.getLogger(__name__)
 current_script_path = os.path.dirname(__file__)
 
 # Construct the relative paths
-delegate_info_log_path = os.path.join(current_script_path, '../../logs/delegate_info(test).log')
+snapshot_path = os.path.join(current_script_path, '../../logs/delegate_snapshots.jsonl')
 payout_log_path = os.path.join(current_script_path, '../../logs/payment_history.log')
+# Nominator payouts are journaled here, like referral payouts in payout_journal.jsonl
+payout_journal_path = os.path.join(current_script_path, '../../logs/nominator_payout_journal.jsonl')
+# Payouts for another hotkey than the one logged to the default store use files of their own, see get_payout_paths
+DEFAULT_PAYOUT_PATHS = PayoutPaths(snapshot_path, payout_log_path, payout_journal_path)
 
 
-# Mock transfer function
-def mock_transfer(wallet, dest, amount, **kwargs):
-    print(f"Mock transfer: {amount} to {dest} from {wallet.name}")
-    return True  # Simulate a successful transfer
-
 def read_last_processed_block(payment_log_path):
-    if not os.path.exists(payment_log_path) or os.path.getsize(payment_log_path) == 0:
-        return None  # Indicates no previous payments
-
-    with open(payment_log_path, 'r') as file:
-        last_line = file.readlines()[-1]
-        last_processed_block = int(last_line.split(',')[1])  # Assuming CSV format: payment_date, last_block, ...
-        return last_processed_block
+    # None indicates no previous payments; only the tail of the history is read
+    return get_last_paid_block(payment_log_path, PAYMENT_HISTORY_COLUMNS)
 
 def update_payment_log(payment_log_path, start_block, end_block, payout_details):
     with open(payment_log_path, 'a') as file:
         for address, payout in payout_details.items():
-            file.write(f"{start_block},{end_block},{address},{payout}\n")  # CSV format
-
-def parse_log_file(file_path, start_block=None):
-    log_pattern = re.compile(
-        r"Timestamp: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}), Block: (\d+), "
-        r"Delegate info for [\w\d]+: ({.*?})", 
-        re.DOTALL
-    )
-
-    with open(file_path, 'r') as file:
-        log_content = file.read()
-
-    matches = log_pattern.findall(log_content)
-
-    parsed_data = []
-    for timestamp, block, delegate_info in matches:
-        block_number = int(block)
-        if start_block is not None and block_number <= start_block:
-            continue  # Skip blocks that have been processed
-
-        try:
-            delegate_info_json = json.loads(delegate_info)
-            nominators_percent = delegate_info_json.get('nominators_percent', [])
-            parsed_data.append({
-                'timestamp': timestamp,
-                'block': block_number,
-                'nominators_percent': nominators_percent
-            })
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing JSON data at block {block}: {e}")
-
-    return parsed_data
-
-def calculate_payouts(parsed_data, payout_pool):
-    address_sums = {}
-    count = 0
-
-    for entry in parsed_data:
-        nominators_percent = entry['nominators_percent']
-        count += 1
-
-        for address, percent in nominators_percent:
-            address_sums[address] = address_sums.get(address, Decimal('0')) + Decimal(str(percent))
-
-    address_averages = {address: sum_val / count for address, sum_val in address_sums.items()}
-    payouts = {address: (average * Decimal(str(payout_pool))).quantize(Decimal('1.000000000')) for address, average in address_averages.items()}
-
-    return payouts
-
-# Initialize subtensor connection
-config = bt.subtensor.config()
-network = "ws://127.0.0.1:9944"  # Update the network address if necessary
-
-try:
-    sub = bt.subtensor(config=config, network=network)
-except Exception as e:
-    print(f"Failed to connect to the Subtensor: {e}")
-    exit(1)
-
-# Prompt for wallet name
-wallet_name = input("Enter your wallet name: ")
-
-# Initialize user's sending wallet
-try:
-    user_wallet = bt.wallet(name=wallet_name)
-except Exception as e:
-    print(f"Failed to initialize wallet: {e}")
-    exit(1)
-
-# Main Script
-# Main Script
-payment_log_path = payout_log_path  # Use the variable defined above
-last_processed_block = read_last_processed_block(payment_log_path)
-
-file_path = delegate_info_log_path  # Use the variable defined above
-parsed_data = parse_log_file(file_path, start_block=last_processed_block)
-
-# Prompt for the payout pool amount
-while True:
-    try:
-        payout_pool = Decimal(input("Enter the total payout pool amount: "))
-        if payout_pool >= 0:
-            break
+            file.write(f"{start_block},{end_block},{address},{format_rao(payout)}\n")  # CSV format
+
+def calculate_payouts(parsed_data, payout_pool_rao, start_block=None, end_block=None):
+    # Each address gets an exact share of the pool in whole rao, by its block-weighted average
+    matrix = build_percent_matrix(parsed_data)
+    address_averages = average_address_percents(matrix, start_block, end_block).tolist()
+    return allocate_rao(dict(zip(matrix.addresses, address_averages)), payout_pool_rao)
+
+def get_payout_range(paths=DEFAULT_PAYOUT_PATHS):
+    """
+    The range the next nominator payout covers.
+
+    :param paths: The PayoutPaths of the store and payment history to pay from.
+
+    :return: (last_processed_block, first_block, last_block). first_block is None if nothing
+        was paid yet (the range starts at the first snapshot) and last_block is None if the
+        store is empty.
+    """
+    last_processed_block = read_last_processed_block(paths.history_path)
+    first_block = last_processed_block + 1 if last_processed_block is not None else None  # Skip blocks that have been processed
+    latest_snapshot = load_latest_snapshot(paths.snapshot_path)
+    return last_processed_block, first_block, latest_snapshot['block'] if latest_snapshot else None
+
+def get_address_payouts(first_block, last_block, payout_pool_rao, file_path=snapshot_path, workers=None):
+    if last_block is None:
+        return {}
+    # The logger's running accumulators give the averages from a few rows, when they have caught up
+    range_averages = get_range_averages(file_path, first_block or 0, last_block)
+    if range_averages is not None:
+        addresses, address_averages = range_averages
+        return allocate_rao({address: average for address, average in zip(addresses, address_averages.tolist()) if average > 0}, payout_pool_rao)
+
+    # Otherwise the range is streamed from the store, starting from the snapshot still in
+    # effect at first_block, which covers the range up to the next one
+    covering_block = get_covering_block(file_path, first_block) if first_block is not None else None
+    parsed_data = iter_snapshots(file_path, start_block=covering_block if covering_block is not None else first_block, end_block=last_block,
+                                 workers=workers)
+    return calculate_payouts(parsed_data, payout_pool_rao, first_block, last_block)
+
+def get_fee_adjusted_transfers(transfer_sub, keypair, payouts, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Deducts the transfer fees from the payouts.
+
+    :return: (transfers, fee_schedule), with transfers a list of (address, address, amount_rao)
+        that skips payouts left non-positive by the fees.
+    """
+    # The fees are priced once by the chain, for batches of the largest payout
+    largest_address = max(payouts, key=payouts.get) if payouts else None
+    fee_schedule = estimate_fee_schedule(transfer_sub, keypair, largest_address, payouts[largest_address], batch_size) if payouts else DEFAULT_FEE_SCHEDULE
+
+    transfers = []
+    for address, adjusted_payout in deduct_fees(payouts, fee_schedule).items():
+        if adjusted_payout <= 0:
+            print(f"Skipping transfer to address {address} due to non-positive payout after fee subtraction.")
+            continue
+        transfers.append((address, address, adjusted_payout))
+    return transfers, fee_schedule
+
+def run_payout(sub, keypair, run, transfers, transfer_mode='batch', batch_size=DEFAULT_BATCH_SIZE, paths=DEFAULT_PAYOUT_PATHS):
+    """
+    Sends transfers of a journaled run, and records the payout once every one of its transfers is included.
+
+    The payment history records the amount transferred to every address, from the last
+    processed block, as before the run.
+
+    :param paths: The PayoutPaths the run is journaled and recorded to.
+    :return: True if the run is complete, False if some of its transfers are not confirmed yet.
+    """
+    results = send_transfers(sub, keypair, run['run_id'], transfers, transfer_mode, batch_size, paths.journal_path)
+    for address, result in results.items():
+        if result['success']:
+            print(f"Successfully transferred to {address}")
         else:
-            print("Please enter a non-negative number.")
-    except (ValueError, decimal.InvalidOperation):
-        print("Invalid input. Please enter a valid number.")
-
-payouts = calculate_payouts(parsed_data, payout_pool)
-
-# Display the payouts
-print("\nCalculated Payouts:")
-for address, payout in payouts.items():
-    print(f"Address: {address}, Payout: {payout}")
-
-# User confirmation
-confirmation = input("\nDo you want to proceed with these transfers? (yes/no): ").lower()
-if confirmation != 'yes':
-    print("Transfer process aborted.")
-    exit(0)
-
-# Normal Transfer loop
-#for address, payout in payouts.items():
- #   adjusted_payout = payout - Decimal('0.000000144')
-  #  if adjusted_payout <= 0:
-   #     print(f"Skipping transfer to address {address} due to non-positive payout after fee subtraction.")
-    #    continue
-#
- #   try:
-  #      success = sub.transfer(
-   #         wallet=user_wallet,
-    #        dest=address,
-     #       amount=adjusted_payout,
-      #      wait_for_inclusion=True,
-       #     wait_for_finalization=False,
-        #    prompt=False
-#        )
-#
- #       if success:
-  #          print(f"Successfully transferred to {address}")
-   #     else:
-    #        print(f"Failed to transfer to {address}")
-#    except Exception as e:
- #       print(f"An error occurred while transferring to {address}: {e}")
-
-# Add a dry run flag
-dry_run = input("Is this a dry run? (yes/no): ").lower() == 'yes'
-
-# Dry Run Transfer loop
-for address, payout in payouts.items():
-    adjusted_payout = payout - Decimal('0.000000144')
-    if adjusted_payout <= 0:
-        print(f"Skipping transfer to address {address} due to non-positive payout after fee subtraction.")
-        continue
+            print(f"Failed to transfer to {address}: {result['error']}")
+
+    # A run with unpaid recipients stays open, and is resumed by the next payout
+    run = load_runs(paths.journal_path)[run['run_id']]
+    paid = transfers_in_state(run, PAID_STATES)
+    if len(paid) < len(run['transfers']):
+        print(f"{len(run['transfers']) - len(paid)} transfers are not confirmed yet. "
+              "Run the payout again to resume; only unpaid recipients will be paid.")
+        return False
+
+    last_processed_block = read_last_processed_block(paths.history_path)
+    update_payment_log(paths.history_path, last_processed_block or 0, run['end_block'],
+                       {address: amount_rao for address, _, amount_rao in paid})
+    complete_run(paths.journal_path, run['run_id'])
+    return True
+
+def resume_open_run(sub, wallet, paths=DEFAULT_PAYOUT_PATHS):
+    """
+    Offers to resume or abandon a run left open by a crash or by failed transfers.
+
+    :param wallet: The paying bt.wallet. Its coldkey is only unlocked to resume a run.
+
+    :return: (run, transfers still to send) to resume, (None, None) to start a new payout, or
+        None to stop, e.g. while transfers of the run may still be waiting in the pool.
+    """
+    run = find_open_run(paths.journal_path)
+    if run is None:
+        return None, None
+
+    paid = transfers_in_state(run, PAID_STATES)
+    in_doubt = transfers_in_state(run, IN_DOUBT_STATES)
+    print(f"Found an unfinished nominator payout for blocks {run['start_block']} to {run['end_block']} "
+          f"(pool {run['payout_pool_total']}): {len(paid)} of {len(run['transfers'])} transfers paid, "
+          f"{len(in_doubt)} awaiting confirmation.")
+    if input("Resume it? (yes/no): ").strip().lower() != 'yes':
+        choice = input("Abandon it and start a new payout? Addresses it already paid will be paid again. (yes/no): ").strip().lower()
+        if choice != 'yes':
+            return None
+        abandon_run(paths.journal_path, run['run_id'])
+        return None, None
+
+    unresolved = resolve_in_doubt(sub, paths.journal_path, run, wallet.coldkey)
+    if unresolved:
+        print(f"{len(unresolved)} transfers may still be waiting in the transaction pool: {', '.join(unresolved)}. "
+              "Run the payout again once they have been included or dropped.")
+        return None
+    return run, transfers_in_state(run, UNPAID_STATES)
+
+def main():
+    parser = argparse.ArgumentParser(description="Calculate and send a nominator payout.")
+    parser.add_argument('--network', default="ws://127.0.0.1:9944", help="Subtensor network address.")
+    parser.add_argument('--hotkey', help="Pay for this hotkey's snapshot store. Defaults to the default store.")
+    parser.add_argument('--workers', type=int, help="Decode snapshots with this many processes when the range is read from the store, for long histories.")
+    args = parser.parse_args()
+    paths = get_payout_paths(DEFAULT_PAYOUT_PATHS, args.hotkey)
+
+    # Initialize subtensor connection
+    config = bt.subtensor.config()
+    network = args.network
 
     try:
-        if dry_run:
-            # Perform mock transfer
-            success = mock_transfer(user_wallet, address, adjusted_payout)
-        else:
-            # Perform actual transfer
-            success = sub.transfer(
-                wallet=user_wallet,
-                dest=address,
-                amount=adjusted_payout,
-                wait_for_inclusion=True,
-                wait_for_finalization=False,
-                prompt=False
-            )
-
-        if success:
-            print(f"{'Mock ' if dry_run else ''}Successfully transferred to {address}")
-        else:
-            print(f"Failed to transfer to {address}")
+        sub = bt.subtensor(config=config, network=network)
     except Exception as e:
-        print(f"An error occurred while transferring to {address}: {e}")
+        print(f"Failed to connect to the Subtensor: {e}")
+        exit(1)
+
+    # Prompt for wallet name
+    wallet_name = input("Enter your wallet name: ")
 
-# Assuming end_block is the last block in parsed_data
-end_block = parsed_data[-1]['block'] if parsed_data else last_processed_block
-update_payment_log(payment_log_path, last_processed_block or 0, end_block, payouts)
\ No newline at end of file
+    # Initialize user's sending wallet
+    try:
+        user_wallet = bt.wallet(name=wallet_name)
+    except Exception as e:
+        print(f"Failed to initialize wallet: {e}")
+        exit(1)
+
+    # A run left open must be finished (or explicitly abandoned) first, otherwise addresses
+    # it already paid would be paid again
+    opened = resume_open_run(sub, user_wallet, paths)
+    if opened is None:
+        return
+    run, transfers = opened
+    if run is not None:
+        run_payout(sub, user_wallet.coldkey, run, transfers, paths=paths)
+        return
+
+    _, first_block, last_block = get_payout_range(paths)
+
+    # Show how completely the store covers the range before paying for it
+    first_snapshot = None
+    if last_block is not None:
+        first_snapshot = next(iter_snapshots(paths.snapshot_path, start_block=first_block), None)
+        if first_snapshot is not None:
+            print(format_coverage(get_coverage(paths.snapshot_path, first_snapshot['block'], last_block), first_snapshot['block'], last_block))
+    if first_snapshot is None:
+        print("There are no snapshots to pay for.")
+        return
+
+    # Prompt for the payout pool amount
+    while True:
+        try:
+            payout_pool_rao = tao_to_rao(input("Enter the total payout pool amount: "))
+            if payout_pool_rao >= 0:
+                break
+            else:
+                print("Please enter a non-negative number.")
+        except ValueError:
+            print("Invalid input. Please enter a valid number.")
+
+    payouts = get_address_payouts(first_block, last_block, payout_pool_rao, paths.snapshot_path, args.workers)
+
+    # Display the payouts
+    print("\nCalculated Payouts:")
+    for address, payout in payouts.items():
+        print(f"Address: {address}, Payout: {format_rao(payout)}")
+
+    # User confirmation
+    confirmation = input("\nDo you want to proceed with these transfers? (yes/no): ").lower()
+    if confirmation != 'yes':
+        print("Transfer process aborted.")
+        exit(0)
+
+    # Add a dry run flag
+    dry_run = input("Is this a dry run? (yes/no): ").lower() == 'yes'
+
+    # Dry runs go through the same batching code against an in-memory chain
+    transfer_sub = MockSubtensor() if dry_run else sub
+    keypair = user_wallet.coldkeypub if dry_run else user_wallet.coldkey
+
+    transfers, _ = get_fee_adjusted_transfers(transfer_sub, keypair, payouts)
+
+    if dry_run:
+        # Nothing is journaled or recorded for a dry run
+        results = batch_transfer(transfer_sub, keypair, transfers)
+        for address, result in results.items():
+            if result['success']:
+                print(f"Mock successfully transferred to {address}")
+            else:
+                print(f"Failed to transfer to {address}: {result['error']}")
+        return
+
+    # Every transfer is journaled as planned before anything is sent
+    run_id = start_run(paths.journal_path, transfers, first_block if first_block is not None else first_snapshot['block'],
+                       last_block, format_rao(payout_pool_rao), sub.get_current_block())
+    run_payout(sub, keypair, load_runs(paths.journal_path)[run_id], transfers, paths=paths)
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,33 @@
 import os
 import time
+import argparse
 import json
-import pandas as pd
 import bittensor as bt
-import re
 import csv
 from ..utils.logger import setup_logger
 from ..data_management.user_data import load_user_data
-from ..utils.logger import setup_logger
+from ..data_management.snapshot_data import iter_snapshots, load_latest_snapshot, get_covering_block
+from ..data_management.snapshot_gaps import get_coverage, format_coverage
+from ..data_management.snapshot_accumulators import get_range_averages
+from ..data_management.payout_history import get_last_paid_block, get_payout_paths, PayoutPaths, PAYOUT_LOG_COLUMNS
+from ..referral_management.referral_graph import load_referral_graph, apply_referral_taxes
+from .stake_matrix import build_percent_matrix, average_user_percents, sum_by_user
+from .transfers import estimate_fee_schedule, DEFAULT_BATCH_SIZE
+from .payout_math import tao_to_rao, format_rao, allocate_rao, deduct_fees, get_total_fee, DEFAULT_FEE_SCHEDULE
+from .payout_journal import (start_run, send_transfers, complete_run, abandon_run, load_runs, find_open_run,
+                             transfers_in_state, resolve_in_doubt, PAID_STATES, UNPAID_STATES, IN_DOUBT_STATES)
 
 
 # Correct paths for script directory and log file
 base_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 log_file_path = os.path.join(base_directory, 'logs', 'payout_logger.log')
-delegate_info_log_path = os.path.join(base_directory, 'logs', 'delegate_info.log')
+snapshot_path = os.path.join(base_directory, 'logs', 'delegate_snapshots.jsonl')
 payout_log_path = os.path.join(base_directory, 'logs', 'payout_log.csv')
+payout_journal_path = os.path.join(base_directory, 'logs', 'payout_journal.jsonl')
 user_data_path = os.path.join(base_directory, 'data', 'user_data.json')
 referral_csv_path = os.path.join(base_directory, 'data', 'referral_layers.csv')
+# Payouts for another hotkey than the one logged to the default store use files of their own, see get_payout_paths
+DEFAULT_PAYOUT_PATHS = PayoutPaths(snapshot_path, payout_log_path, payout_journal_path)
 
 logger = setup_logger('payout_logger', log_file_path)
 
@@ -24,85 +35,22 @@ logger = setup_logger('payout_logger', log_file_path)
 def print_green(text, end='\n'):
     print("\033[92m" + text + "\033[0m", end=end)
 
-def parse_log_file(file_path):
-    log_pattern = re.compile(
-        r"Timestamp: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}), Block: (\d+), "
-        r"Delegate info for [\w\d]+: ({.*?})", 
-        re.DOTALL
-    )
-    
-    with open(file_path, 'r') as file:
-        log_content = file.read()
-    
-    matches = log_pattern.findall(log_content)
-    
-    parsed_data = []
-    for timestamp, block, delegate_info in matches:
-        try:
-            delegate_info_json = json.loads(delegate_info)
-            nominators_percent = delegate_info_json.get('nominators_percent', [])
-            parsed_data.append({
-                'timestamp': timestamp,
-                'block': int(block),
-                'nominators_percent': nominators_percent
-            })
-        except json.JSONDecodeError as e:
-            logger.error(f"Error parsing JSON data at block {block}: {e}")
-    
-    return parsed_data
-
 def calculate_user_sums_and_averages(user_addresses, parsed_log_data, start_block, end_block):
-    user_sums = {user: 0.0 for user in user_addresses}
-    
-    for entry in parsed_log_data:
-        if start_block <= entry['block'] <= end_block:
-            for nominator in entry['nominators_percent']:
-                for user, addresses in user_addresses.items():
-                    if nominator[0] in addresses:
-                        user_sums[user] += nominator[1]
-    
-    block_count = 0
-    for entry in parsed_log_data:
-        if start_block <= entry['block'] <= end_block:
-            block_count += 1
-    user_averages = {
-    user: ((user_sums[user] / block_count) if block_count > 0 else 0)
-        for user in user_sums
-    }
-    
-    return user_averages
-
-def process_referral_structure(referral_data):
-    referral_structure = {}
-    for row in referral_data.itertuples(index=False):
-        layer, referrer, tax, *referees = row
-        tax = float(tax)
-        referees = [r for r in referees if r]
-        if layer not in referral_structure:
-            referral_structure[layer] = {}
-        referral_structure[layer][referrer] = {'Tax': tax, 'Referees': referees}
-    return referral_structure
-
-def calculate_payouts(referral_structure, base_percents, payout_pool_total):
-    for layer in sorted(referral_structure.keys(), reverse=True):
-        for referrer, data in referral_structure[layer].items():
-            if referrer not in base_percents:
-                continue
-            referrer_tax = data['Tax']
-            total_tax_collected = 0
-            for referee in data['Referees']:
-                if referee not in base_percents:
-                    continue
-                tax_amount = base_percents[referee] * referrer_tax
-                base_percents[referee] -= tax_amount
-                total_tax_collected += tax_amount
-            base_percents[referrer] += total_tax_collected
-
-    payouts = {user: round((base_percent * payout_pool_total) - 0.000000144, 9) for user, base_percent in base_percents.items()}
-    return payouts
-
-def log_payout_details(payouts, start_block, end_block, users_data, payout_pool_total):
-    log_file_path = os.path.join(base_directory, 'logs', 'payout_log.csv')  # Use base_directory instead of script_dir
+    # parsed_log_data may be a one-shot stream of snapshots, so it is read once into the matrix.
+    # Snapshots are weighted by the blocks of [start_block, end_block] they cover, so one taken
+    # before start_block accounts for the start of the range and later ones weigh nothing.
+    matrix = build_percent_matrix(entry for entry in parsed_log_data if entry['block'] <= end_block)
+    return average_user_percents(matrix, user_addresses, start_block, end_block)
+
+def allocate_payouts(adjusted_percents, payout_pool_rao, fee_schedule=DEFAULT_FEE_SCHEDULE):
+    # Payouts are whole rao: the pool is split exactly, then the transfer fees are deducted
+    return deduct_fees(allocate_rao(adjusted_percents, payout_pool_rao), fee_schedule)
+
+def calculate_payouts(referral_graph, base_percents, payout_pool_rao, fee_schedule=DEFAULT_FEE_SCHEDULE):
+    adjusted_percents = apply_referral_taxes(referral_graph, base_percents)
+    return allocate_payouts(adjusted_percents, payout_pool_rao, fee_schedule)
+
+def log_payout_details(payouts, start_block, end_block, users_data, payout_pool_total, log_file_path=payout_log_path):
     mode = 'a' if os.path.exists(log_file_path) else 'w'
     
     with open(log_file_path, mode) as file:
@@ -115,90 +63,179 @@ def log_payout_details(payouts, start_block, end_block, users_data, payout_pool_
             writer.writerow([username, address, amount, start_block, end_block, payout_pool_total])
 
 def get_new_start_block(log_file_path):
-    if not os.path.exists(log_file_path):
-        return None
-
+    # Only the last line of the history is read, seeking back from its end
     try:
-        with open(log_file_path, 'r') as file:
-            lines = file.readlines()
-            if not lines:
-                return None
-            last_line = lines[-1]
-            last_end_block = int(last_line.split(',')[-2])
-            return last_end_block + 1
+        last_end_block = get_last_paid_block(log_file_path, PAYOUT_LOG_COLUMNS)
     except Exception as e:
         logger.error(f"Error reading payout log: {e}")
         return None
+    return last_end_block + 1 if last_end_block is not None else None
+
+def get_transfer_options():
+    """Ask how transfers are to be sent. Return (transfer_mode, batch_size)."""
+    transfer_mode = input("Send transfers in batches or concurrently? (batch/concurrent, press Enter for batch): ").strip().lower()
+    if transfer_mode == 'concurrent':
+        return transfer_mode, 1
+
+    batch_size = input(f"Transfers per batch (press Enter for {DEFAULT_BATCH_SIZE}): ").strip()
+    return 'batch', int(batch_size) if batch_size else DEFAULT_BATCH_SIZE
+
+def get_payout_range(paths=DEFAULT_PAYOUT_PATHS):
+    """The range the next payout covers: from after the last paid block up to the latest snapshot."""
+    new_start_block = get_new_start_block(paths.history_path)
+    if new_start_block is None:
+        first_snapshot = next(iter_snapshots(paths.snapshot_path), None)
+        new_start_block = first_snapshot['block'] if first_snapshot else 0
+    latest_snapshot = load_latest_snapshot(paths.snapshot_path)
+    return new_start_block, latest_snapshot['block'] if latest_snapshot else 0
+
+def get_user_averages(users_data, start_block, end_block, file_path=snapshot_path, workers=None):
+    # The logger's running accumulators give the averages from a few rows however long the
+    # range; if they haven't caught up with the store, the range is streamed from the store,
+    # starting from the snapshot still in effect at start_block
+    range_averages = get_range_averages(file_path, start_block, end_block)
+    if range_averages is not None:
+        addresses, address_averages = range_averages
+        return sum_by_user(addresses, address_averages, users_data)
+    covering_block = get_covering_block(file_path, start_block)
+    parsed_log_data = iter_snapshots(file_path, covering_block if covering_block is not None else start_block, end_block, workers)
+    return calculate_user_sums_and_averages(users_data, parsed_log_data, start_block, end_block)
+
+def estimate_payout_fees(sub, keypair, users_data, payout_pool_rao, batch_size):
+    # The fees are priced once for the payout by the chain, with the whole pool standing in
+    # for the largest transfer so the estimate can't fall short
+    representative_address = next((addresses[0] for addresses in users_data.values() if addresses), None)
+    if representative_address is None:
+        return DEFAULT_FEE_SCHEDULE
+    return estimate_fee_schedule(sub, keypair, representative_address, payout_pool_rao, batch_size)
+
+def get_payout_transfers(payouts, users_data):
+    """The (username, address, amount_rao) transfers of a payout, skipping non-positive payouts."""
+    transfers = []
+    for username, payout in payouts.items():
+        if payout <= 0:
+            print(f"Skipping transfer to {username} due to zero amount.")
+            continue
+        transfers.append((username, users_data[username][0], payout))
+    return transfers
+
+def run_payout(sub, keypair, run, transfers, users_data, transfer_mode, batch_size, paths=DEFAULT_PAYOUT_PATHS):
+    """
+    Sends transfers of a journaled run, and logs the run once every one of its transfers is included.
+
+    :param paths: The PayoutPaths the run is journaled and logged to.
+    :return: True if the run is complete, False if some of its transfers are not confirmed yet.
+    """
+    results = send_transfers(sub, keypair, run['run_id'], transfers, transfer_mode, batch_size, paths.journal_path)
+    for username, result in results.items():
+        if result['success']:
+            print_green(f"Successfully transferred to {username}")
+        else:
+            logger.error(f"Failed to transfer to {username}: {result['error']}")
+
+    run = load_runs(paths.journal_path)[run['run_id']]
+    paid = transfers_in_state(run, PAID_STATES)
+    if len(paid) < len(run['transfers']):
+        print(f"{len(run['transfers']) - len(paid)} transfers are not confirmed yet. "
+              "Run the payout again to resume; only unpaid recipients will be paid.")
+        return False
+
+    payouts = {username: format_rao(amount_rao) for username, _, amount_rao in paid}
+    log_payout_details(payouts, run['start_block'], run['end_block'], users_data, run['payout_pool_total'], paths.history_path)
+    complete_run(paths.journal_path, run['run_id'])
+    print_green("Payout details logged successfully.")
+    return True
+
+def get_wallet_keypair():
+    wallet_name = input("Please enter your wallet name to proceed with transactions: ")
+    try:
+        return bt.wallet(name=wallet_name).coldkey
+    except Exception as e:
+        logger.error(f"Failed to initialize wallet: {e}")
+        return None
 
 def main():
+    parser = argparse.ArgumentParser(description="Calculate and send a referral payout.")
+    parser.add_argument('network', nargs='?', default="ws://127.0.0.1:9944", help="Subtensor network address.")
+    parser.add_argument('--hotkey', help="Pay for this hotkey's snapshot store. Defaults to the default store.")
+    parser.add_argument('--workers', type=int, help="Decode snapshots with this many processes when the range is read from the store, for long histories.")
+    args = parser.parse_args()
+    paths = get_payout_paths(DEFAULT_PAYOUT_PATHS, args.hotkey)
+
     # Initialize subtensor connection
     config = bt.subtensor.config()
-    network = "ws://127.0.0.1:9944"  # Replace with your actual network address
+    network = args.network
     try:
         sub = bt.subtensor(config=config, network=network)
     except Exception as e:
         logger.error(f"Failed to connect to the Subtensor: {e}")
         return
 
-    # Rest of your script logic
-    new_start_block = get_new_start_block(payout_log_path)
-    parsed_log_data = parse_log_file(delegate_info_log_path)
-    latest_block = parsed_log_data[-1]['block'] if parsed_log_data else None
-
-    start_block = new_start_block if new_start_block is not None else (parsed_log_data[0]['block'] if parsed_log_data else 0)
-    end_block = latest_block if latest_block is not None else 0
-
     users_data = load_user_data(user_data_path)
-    user_averages = calculate_user_sums_and_averages(users_data, parsed_log_data, start_block, end_block)
-
-    payout_pool_total = float(input("Enter the total payout pool: "))
-
-    referral_data = pd.read_csv(referral_csv_path)
-    referral_structure = process_referral_structure(referral_data)
-
-    payouts = calculate_payouts(referral_structure, user_averages, payout_pool_total)
-
-    print("Calculated Payouts:")
-    for user, payout in payouts.items():
-        print_green(f"{user}: {payout}")
-
-    # Error handling and transactions
-    wallet_name = input("Please enter your wallet name to proceed with transactions: ")
-    try:
-        user_wallet = bt.wallet(name=wallet_name)
-    except Exception as e:
-        logger.error(f"Failed to initialize wallet: {e}")
-        return
-
-    all_transactions_successful = True
-    for username, payout in payouts.items():
-        address = users_data[username][0]
-        if payout == 0:
-            print(f"Skipping transfer to {username} due to zero amount.")
-            continue
 
-        try:
-            success = sub.transfer(
-                wallet=user_wallet,
-                dest=address,
-                amount=payout,
-                wait_for_inclusion=True,
-                wait_for_finalization=False,
-                prompt=False
-            )
-
-            if success:
-                print_green(f"Successfully transferred to {username}")
-            else:
-                all_transactions_successful = False
-                logger.error(f"Failed to transfer to {username}")
-        except Exception as e:
-            all_transactions_successful = False
-            logger.error(f"An error occurred while transferring to {username}: {e}")
-
-    if all_transactions_successful:
-        log_payout_details(payouts, start_block, end_block, users_data, payout_pool_total)
-        print_green("Payout details logged successfully.")
+    # A run left open by a crash or by failed transfers must be finished (or explicitly
+    # abandoned) first, otherwise recipients it already paid would be paid again.
+    run = find_open_run(paths.journal_path)
+    if run is not None:
+        paid = transfers_in_state(run, PAID_STATES)
+        in_doubt = transfers_in_state(run, IN_DOUBT_STATES)
+        print(f"Found an unfinished payout for blocks {run['start_block']} to {run['end_block']} "
+              f"(pool {run['payout_pool_total']}): {len(paid)} of {len(run['transfers'])} transfers paid, "
+              f"{len(in_doubt)} awaiting confirmation.")
+        choice = input("Resume it? (yes/no): ").strip().lower()
+        if choice != 'yes':
+            choice = input("Abandon it and start a new payout? Recipients it already paid will be paid again. (yes/no): ").strip().lower()
+            if choice != 'yes':
+                return
+            abandon_run(paths.journal_path, run['run_id'])
+            run = None
+
+    if run is not None:
+        keypair = get_wallet_keypair()
+        if keypair is None:
+            return
+
+        unresolved = resolve_in_doubt(sub, paths.journal_path, run, keypair)
+        if unresolved:
+            print(f"{len(unresolved)} transfers may still be waiting in the transaction pool: {', '.join(unresolved)}. "
+                  "Run the payout again once they have been included or dropped.")
+            return
+        transfers = transfers_in_state(run, UNPAID_STATES)
+        transfer_mode, batch_size = get_transfer_options()
+    else:
+        start_block, end_block = get_payout_range(paths)
+
+        # Missing snapshots leave the averages to the snapshots that were taken
+        print(format_coverage(get_coverage(paths.snapshot_path, start_block, end_block), start_block, end_block))
+
+        user_averages = get_user_averages(users_data, start_block, end_block, paths.snapshot_path, args.workers)
+
+        payout_pool_rao = tao_to_rao(input("Enter the total payout pool: "))
+        payout_pool_total = format_rao(payout_pool_rao)
+
+        referral_graph = load_referral_graph(referral_csv_path)
+
+        keypair = get_wallet_keypair()
+        if keypair is None:
+            return
+        transfer_mode, batch_size = get_transfer_options()
+
+        fee_schedule = estimate_payout_fees(sub, keypair, users_data, payout_pool_rao, batch_size)
+        payouts = calculate_payouts(referral_graph, user_averages, payout_pool_rao, fee_schedule)
+
+        print("Calculated Payouts:")
+        for user, payout in payouts.items():
+            print_green(f"{user}: {format_rao(payout)}")
+        paid_count = sum(1 for payout in payouts.values() if payout > 0)
+        print(f"Estimated fees for {paid_count} transfers: {format_rao(get_total_fee(fee_schedule, paid_count))}")
+
+        transfers = get_payout_transfers(payouts, users_data)
+
+        # Every transfer is journaled as planned before anything is sent
+        run_id = start_run(paths.journal_path, transfers, start_block, end_block, payout_pool_total, sub.get_current_block())
+        run = load_runs(paths.journal_path)[run_id]
+
+    run_payout(sub, keypair, run, transfers, users_data, transfer_mode, batch_size, paths)
 
 if __name__ == "__main__":
     main()
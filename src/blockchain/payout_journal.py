@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import time
+import uuid
+
+from .transfers import (batch_transfer, concurrent_transfer, _extrinsic_hash, get_extrinsic_receipt, get_next_nonce,
+                        compose_filler_call)
+
+logger = logging.getLogger(__name__)
+
+# Every journal line is one event. A run starts with 'run_started' and one 'planned' event per
+# transfer; each transfer then moves through 'submitted' (signed with a nonce, written before
+# the extrinsic is broadcast) to 'included' or 'failed', and the run ends with 'run_completed'
+# or 'run_abandoned'. The latest event for a transfer is its state.
+PAID_STATES = ('included',)
+UNPAID_STATES = ('planned', 'failed')
+IN_DOUBT_STATES = ('submitted',)
+
+def _timestamp():
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+def _append_events(journal_path, events):
+    """Append events to the journal and fsync before returning."""
+    with open(journal_path, 'a', encoding='utf-8') as file:
+        for event in events:
+            event['timestamp'] = _timestamp()
+            file.write(json.dumps(event, separators=(',', ':')) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+def start_run(journal_path, transfers, start_block, end_block, payout_pool_total, chain_block):
+    """
+    Records a new payout run and plans every transfer in it.
+
+    :param journal_path: Path to the payout journal.
+    :param transfers: List of (key, address, amount_rao) tuples.
+    :param start_block: First snapshot block covered by the payout.
+    :param end_block: Last snapshot block covered by the payout.
+    :param payout_pool_total: The payout pool the amounts were calculated from.
+    :param chain_block: Current chain block. Blocks from here on are searched when resolving
+        transfers left in doubt.
+    :return: The new run id.
+    """
+    run_id = time.strftime('%Y%m%d%H%M%S', time.gmtime()) + '-' + uuid.uuid4().hex[:8]
+    events = [{
+        'run_id': run_id,
+        'event': 'run_started',
+        'start_block': start_block,
+        'end_block': end_block,
+        'payout_pool_total': payout_pool_total,
+        'chain_block': chain_block,
+    }]
+    for key, address, amount_rao in transfers:
+        events.append({'run_id': run_id, 'event': 'planned', 'key': key, 'address': address, 'amount_rao': amount_rao})
+    _append_events(journal_path, events)
+    return run_id
+
+def record_submitted(journal_path, run_id, keys, nonce, extrinsic_hash):
+    """Record that transfers were signed into an extrinsic that is about to be broadcast."""
+    _append_events(journal_path, [
+        {'run_id': run_id, 'event': 'submitted', 'key': key, 'nonce': nonce, 'extrinsic_hash': extrinsic_hash}
+        for key in keys
+    ])
+
+def record_result(journal_path, run_id, key, result):
+    """Record the on-chain outcome of a transfer, as reported by batch_transfer or concurrent_transfer."""
+    _append_events(journal_path, [{
+        'run_id': run_id,
+        'event': 'included' if result['success'] else 'failed',
+        'key': key,
+        'extrinsic_hash': result['extrinsic_hash'],
+        'block_hash': result['block_hash'],
+        'error': result['error'],
+    }])
+
+def send_transfers(sub, keypair, run_id, transfers, transfer_mode, batch_size, journal_path):
+    """Send transfers, journaling each one before it is broadcast and once its outcome is known."""
+    def on_signed(keys, nonce, extrinsic_hash):
+        record_submitted(journal_path, run_id, keys, nonce, extrinsic_hash)
+
+    def on_result(key, result):
+        record_result(journal_path, run_id, key, result)
+
+    if transfer_mode == 'concurrent':
+        # Individual transfers with locally assigned nonces, many landing in each block
+        return concurrent_transfer(sub, keypair, transfers, on_signed=on_signed, on_result=on_result)
+
+    # Transfers are packed into Utility.batch_all extrinsics, one block inclusion per batch
+    return batch_transfer(sub, keypair, transfers, batch_size, on_signed=on_signed, on_result=on_result)
+
+def complete_run(journal_path, run_id):
+    _append_events(journal_path, [{'run_id': run_id, 'event': 'run_completed'}])
+
+def abandon_run(journal_path, run_id):
+    _append_events(journal_path, [{'run_id': run_id, 'event': 'run_abandoned'}])
+
+def load_runs(journal_path):
+    """
+    Replays the journal into the current state of every run.
+
+    :param journal_path: Path to the payout journal.
+    :return: Dictionary of run id -> run, in the order runs were started. A run is a dictionary
+        holding the 'run_started' fields, 'status' ('open', 'completed' or 'abandoned') and
+        'transfers', a dictionary of key -> transfer state with 'address', 'amount_rao',
+        'state', 'nonce', 'extrinsic_hash', 'block_hash' and 'error'.
+    """
+    runs = {}
+    if not os.path.exists(journal_path):
+        return runs
+
+    with open(journal_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be torn, by a crash in the middle of a write
+                logger.error("Skipping incomplete payout journal line")
+                continue
+
+            kind = event['event']
+            if kind == 'run_started':
+                run = {field: value for field, value in event.items() if field != 'event'}
+                run['status'] = 'open'
+                run['transfers'] = {}
+                runs[event['run_id']] = run
+                continue
+
+            run = runs.get(event['run_id'])
+            if run is None:
+                continue
+            if kind == 'run_completed':
+                run['status'] = 'completed'
+            elif kind == 'run_abandoned':
+                run['status'] = 'abandoned'
+            elif kind == 'planned':
+                run['transfers'][event['key']] = {
+                    'address': event['address'],
+                    'amount_rao': event['amount_rao'],
+                    'state': 'planned',
+                    'nonce': None,
+                    'extrinsic_hash': None,
+                    'block_hash': None,
+                    'error': None,
+                }
+            else:
+                transfer = run['transfers'][event['key']]
+                transfer['state'] = kind
+                for field in ('nonce', 'extrinsic_hash', 'block_hash', 'error'):
+                    if field in event:
+                        transfer[field] = event[field]
+    return runs
+
+def find_open_run(journal_path):
+    """Return the most recent run that was neither completed nor abandoned, or None."""
+    open_runs = [run for run in load_runs(journal_path).values() if run['status'] == 'open']
+    return open_runs[-1] if open_runs else None
+
+def transfers_in_state(run, states):
+    """List (key, address, amount_rao) for the run's transfers currently in one of states."""
+    return [
+        (key, transfer['address'], transfer['amount_rao'])
+        for key, transfer in run['transfers'].items()
+        if transfer['state'] in states
+    ]
+
+def resolve_in_doubt(sub, journal_path, run, keypair):
+    """
+    Settles transfers whose extrinsic was submitted but whose outcome was never recorded.
+
+    Blocks since the run started are searched for the extrinsic hashes. A transfer whose
+    extrinsic is found is recorded as included or failed from its receipt. One whose extrinsic
+    is not found but whose nonce the account has already used can never land, so it is
+    recorded as failed and will be paid again. So is one whose nonce the transaction pool
+    doesn't hold (system_accountNextIndex), e.g. because the payout stopped between journaling
+    and broadcasting it. If that unused nonce would hold up transfers of the run with later
+    nonces waiting in the pool, a remark is signed with it, as concurrent_transfer does.
+    Anything else may still be waiting in the transaction pool and is left in doubt.
+
+    :param sub: A bt.subtensor (or MockSubtensor).
+    :param journal_path: Path to the payout journal.
+    :param run: A run as returned by load_runs. Its transfer states are updated in place.
+    :param keypair: Keypair of the payout pool account that signed the transfers, to sign
+        remarks with.
+    :return: List of keys still in doubt.
+    """
+    substrate = sub.substrate
+    ss58_address = keypair.ss58_address
+    in_doubt = {}
+    for key, transfer in run['transfers'].items():
+        if transfer['state'] in IN_DOUBT_STATES:
+            in_doubt.setdefault(transfer['extrinsic_hash'], []).append(key)
+    if not in_doubt:
+        return []
+
+    def settle(key, success, block_hash, error):
+        result = {
+            'success': success,
+            'extrinsic_hash': run['transfers'][key]['extrinsic_hash'],
+            'block_hash': block_hash,
+            'error': error,
+        }
+        record_result(journal_path, run['run_id'], key, result)
+        run['transfers'][key].update(state='included' if success else 'failed', block_hash=block_hash, error=error)
+
+    account_nonce = substrate.get_account_nonce(ss58_address)
+    current_block = sub.get_current_block()
+    for block_number in range(run['chain_block'], current_block + 1):
+        if not in_doubt:
+            break
+        block = substrate.get_block(block_number=block_number)
+        if block is None:
+            continue
+        block_hash = block['header']['hash']
+        for extrinsic in block['extrinsics']:
+            extrinsic_hash = _extrinsic_hash(extrinsic)
+            keys = in_doubt.pop(extrinsic_hash, None)
+            if keys is None:
+                continue
+            receipt = get_extrinsic_receipt(substrate, extrinsic_hash, block_hash)
+            error = None if receipt.is_success else str(receipt.error_message)
+            for key in keys:
+                settle(key, receipt.is_success, block_hash, error)
+
+    pending = {}
+    for keys in in_doubt.values():
+        for key in keys:
+            nonce = run['transfers'][key]['nonce']
+            if nonce < account_nonce:
+                settle(key, False, None, 'Not included; its nonce was used by another extrinsic')
+            else:
+                pending.setdefault(nonce, []).append(key)
+
+    try:
+        next_nonce = get_next_nonce(substrate, ss58_address)
+    except Exception as e:
+        # Unknown, so everything is left in doubt rather than risking paying it twice
+        logger.error(f"Failed to read the pool's next nonce: {e}")
+        next_nonce = None
+
+    # Nonces from next_nonce on aren't in the pool, or wait in it behind the unused next_nonce
+    while next_nonce is not None and any(nonce >= next_nonce for nonce in pending):
+        for key in pending.pop(next_nonce, []):
+            settle(key, False, None, 'Not included; it never reached the transaction pool')
+        if not any(nonce > next_nonce for nonce in pending):
+            break
+        try:
+            filler = substrate.create_signed_extrinsic(call=compose_filler_call(substrate), keypair=keypair, nonce=next_nonce)
+            substrate.submit_extrinsic(filler, wait_for_inclusion=False, wait_for_finalization=False)
+            filled_nonce, next_nonce = next_nonce, get_next_nonce(substrate, ss58_address)
+        except Exception as e:
+            logger.error(f"Filler remark with nonce {next_nonce} not accepted: {e}")
+            break
+        logger.info(f"Signed a filler remark with the unused nonce {filled_nonce}, which held up later transfers")
+        if next_nonce <= filled_nonce:
+            break
+
+    return [key for keys in pending.values() for key in keys]
@@ -0,0 +1,105 @@
+from collections import namedtuple
+
+import numpy as np
+
+from ..data_management.snapshot_codec import RAO_PER_TAO, tao_to_rao
+
+# Deducted from every transfer to cover its fee (0.000000144 tao) when the chain's fees
+# can't be estimated
+TRANSFER_FEE_RAO = 144
+
+# Fees of a payout's extrinsics, estimated from the chain (see transfers.estimate_fee_schedule).
+# Up to batch_size transfers share an extrinsic; single_fee_rao is the fee of an extrinsic
+# with one transfer and batch_fee_rao of one with batch_size transfers. Fees grow linearly
+# with the number of transfers in between, so they are interpolated and rounded up.
+FeeSchedule = namedtuple('FeeSchedule', ['single_fee_rao', 'batch_fee_rao', 'batch_size'])
+
+# TRANSFER_FEE_RAO for every transfer, each in an extrinsic of its own
+DEFAULT_FEE_SCHEDULE = FeeSchedule(TRANSFER_FEE_RAO, TRANSFER_FEE_RAO, 1)
+
+# Percents are fixed to integers of 2**-60 before allocating. The scale is a power of two, so
+# converting a float64 percent is exact, and percents below 8 still fit in an int64.
+PERCENT_SHIFT = 60
+PERCENT_SCALE = 1 << PERCENT_SHIFT
+
+def format_rao(amount_rao):
+    """Format an integer number of rao as a tao string with all 9 decimals, e.g. '1.500000000'."""
+    sign = '-' if amount_rao < 0 else ''
+    whole, fraction = divmod(abs(int(amount_rao)), RAO_PER_TAO)
+    return f"{sign}{whole}.{fraction:09d}"
+
+def percents_to_fixed(percents):
+    """Convert float percents (1.0 == the whole pool) to int64 units of 2**-60."""
+    return np.rint(np.ldexp(np.asarray(percents, dtype=np.float64), PERCENT_SHIFT)).astype(np.int64)
+
+def allocate_rao(percents, pool_rao):
+    """
+    Splits a pool of rao between recipients in proportion to their percents.
+
+    Each recipient gets the floor of their exact share. The rao lost to flooring are then
+    handed out one each to the largest remainders (ties go to the earlier recipient), so the
+    allocations add up to exactly pool_rao * sum(percents) rounded to the nearest rao, i.e. to
+    the whole pool when the percents sum to 1. Only the conversion of the percents to fixed
+    point involves floats; everything after it is integer arithmetic.
+
+    :param percents: Dictionary of recipient -> percent of the pool (1.0 == 100%).
+    :param pool_rao: The pool in rao (int).
+    :return: Dictionary of recipient -> allocated rao (int), in the same order as percents.
+    """
+    recipients = list(percents)
+    weights = percents_to_fixed([percents[recipient] for recipient in recipients]).tolist()
+    if any(weight < 0 for weight in weights):
+        raise ValueError("Percents must not be negative.")
+
+    pool_rao = int(pool_rao)
+    # pool_rao * weight can exceed 64 bits, so shares are computed with Python ints
+    shares = []
+    remainders = []
+    for weight in weights:
+        share, remainder = divmod(pool_rao * weight, PERCENT_SCALE)
+        shares.append(share)
+        remainders.append(remainder)
+
+    total = (pool_rao * sum(weights) + PERCENT_SCALE // 2) >> PERCENT_SHIFT
+    leftover = total - sum(shares)
+    for index in sorted(range(len(shares)), key=lambda index: -remainders[index])[:leftover]:
+        shares[index] += 1
+
+    return dict(zip(recipients, shares))
+
+def get_extrinsic_fee(schedule, transfer_count):
+    """Fee in rao of one extrinsic carrying transfer_count (1 to batch_size) transfers."""
+    if schedule.batch_size <= 1:
+        return schedule.single_fee_rao
+    extra = (transfer_count - 1) * (schedule.batch_fee_rao - schedule.single_fee_rao)
+    return schedule.single_fee_rao + -(-extra // (schedule.batch_size - 1))
+
+def get_total_fee(schedule, transfer_count):
+    """Fee in rao of sending transfer_count transfers in extrinsics of up to batch_size each."""
+    full_batches, rest = divmod(transfer_count, schedule.batch_size)
+    total = full_batches * get_extrinsic_fee(schedule, schedule.batch_size)
+    return total + (get_extrinsic_fee(schedule, rest) if rest else 0)
+
+def deduct_fees(allocations, schedule=DEFAULT_FEE_SCHEDULE):
+    """
+    Deducts the fees of a payout's transfers from its allocations.
+
+    The total fee of the transfers is split equally between the recipients, to the rao (the
+    first recipients pay one rao more when it doesn't divide), so the payouts plus the fees
+    add up to exactly the allocations that are paid. Recipients whose allocation doesn't
+    cover their share aren't paid, which lowers the total fee for the others.
+
+    :param allocations: Dictionary of recipient -> allocated rao, e.g. from allocate_rao.
+    :param schedule: A FeeSchedule.
+    :return: Dictionary of recipient -> payout in rao, in the same order as allocations.
+        Recipients that aren't paid get 0.
+    """
+    paid = [recipient for recipient, amount_rao in allocations.items() if amount_rao > 0]
+    while True:
+        share, extra = divmod(get_total_fee(schedule, len(paid)), len(paid)) if paid else (0, 0)
+        fees = {recipient: share + (1 if position < extra else 0) for position, recipient in enumerate(paid)}
+        covered = [recipient for recipient in paid if allocations[recipient] > fees[recipient]]
+        if len(covered) == len(paid):
+            break
+        paid = covered
+    return {recipient: amount_rao - fees[recipient] if recipient in fees else 0 for recipient, amount_rao in allocations.items()}
@@ -0,0 +1,330 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+import bittensor as bt
+
+from ..data_management.user_data import load_user_data
+from ..data_management.snapshot_data import iter_snapshots, get_hotkey_snapshot_path
+from ..data_management.snapshot_gaps import get_coverage
+from ..data_management.payout_history import get_last_paid_block, get_payout_paths, PAYOUT_LOG_COLUMNS
+from ..referral_management.referral_graph import load_referral_graph
+from .transfers import batch_transfer, concurrent_transfer, DEFAULT_BATCH_SIZE
+from .payout_math import tao_to_rao, format_rao, get_total_fee
+from .payout_journal import start_run, load_runs, find_open_run, resolve_in_doubt, transfers_in_state, UNPAID_STATES
+from .mock_subtensor import MockSubtensor
+from . import payout, nominator_payout
+
+# A payout plan is a JSON file holding everything needed to send a payout: the range and pool
+# it was calculated for, how the transfers are to be sent, the fees they were priced at and the
+# transfers themselves as [key, address, amount_rao] (key is the user name of a referral
+# payout and the address of a nominator payout). previous_end_block is the last paid block
+# when the plan was made; a plan is only executed while it still is, so a range is never paid
+# twice. hotkey selects the snapshot store paid from (None for the default store, see
+# get_payout_paths). Nominator plans also hold the shares (address -> rao before fees), for
+# review. approved_digest is set by 'approve' to the plan's digest, and
+# a plan changed after its approval is refused.
+PLAN_VERSION = 1
+PLAN_KINDS = ('referral', 'nominator')
+DEFAULT_NETWORK = "ws://127.0.0.1:9944"
+
+base_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def get_default_plan_path(kind, hotkey_ss58_address=None):
+    plan_path = os.path.join(base_directory, 'logs', f'{kind}_payout_plan.json')
+    return get_hotkey_snapshot_path(plan_path, hotkey_ss58_address) if hotkey_ss58_address else plan_path
+
+def get_plan_digest(plan):
+    """SHA-256 of the plan's contents, apart from its approval."""
+    contents = {field: value for field, value in plan.items() if field != 'approved_digest'}
+    return hashlib.sha256(json.dumps(contents, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+def save_plan(plan, file_path):
+    # Written to a temporary file first so an interrupted write never leaves half a plan
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(plan, file, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+
+def load_plan(file_path):
+    """
+    :raises ValueError: If the file is not a payout plan of a supported version.
+    """
+    with open(file_path, 'r') as file:
+        plan = json.load(file)
+    if plan.get('version') != PLAN_VERSION or plan.get('kind') not in PLAN_KINDS:
+        raise ValueError(f"{file_path} is not a version {PLAN_VERSION} payout plan.")
+    return plan
+
+def write_plan_csv(plan, file_path):
+    """Write the plan's transfers, one line per recipient with the amount in tao, for review."""
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['key', 'address', 'amount'])
+        for key, address, amount_rao in plan['transfers']:
+            writer.writerow([key, address, format_rao(amount_rao)])
+
+def _new_plan(kind, network, wallet_name, keypair, hotkey_ss58_address, start_block, end_block, previous_end_block,
+              payout_pool_rao, transfer_mode, batch_size, fee_schedule, coverage, transfers):
+    return {
+        'version': PLAN_VERSION,
+        'kind': kind,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'network': network,
+        'wallet': wallet_name,
+        'coldkey': keypair.ss58_address,
+        'hotkey': hotkey_ss58_address,
+        'start_block': start_block,
+        'end_block': end_block,
+        'previous_end_block': previous_end_block,
+        'payout_pool_rao': payout_pool_rao,
+        'payout_pool_total': format_rao(payout_pool_rao),
+        'transfer_mode': transfer_mode,
+        'batch_size': batch_size,
+        'fee_schedule': fee_schedule._asdict(),
+        'estimated_fee_rao': get_total_fee(fee_schedule, len(transfers)),
+        'coverage': coverage['coverage'],
+        'transfers': [list(transfer) for transfer in transfers],
+        'approved_digest': None,
+    }
+
+def _check_not_paid(start_block, previous_end_block):
+    if previous_end_block is not None and start_block <= previous_end_block:
+        raise ValueError(f"Blocks up to {previous_end_block} were already paid; the range must start after it.")
+
+def build_referral_plan(sub, network, wallet_name, keypair, payout_pool_rao, start_block=None, end_block=None,
+                        transfer_mode='batch', batch_size=DEFAULT_BATCH_SIZE, hotkey_ss58_address=None,
+                        workers=None):
+    """
+    Calculates a referral payout as payout.py does, without sending anything.
+
+    :param keypair: Keypair of the paying coldkey; its public key is enough to price the fees.
+    :param start_block / end_block: Range to pay for, by default the range of the next payout.
+    :param hotkey_ss58_address: Hotkey whose snapshot store is paid from, by default the default store.
+    :param workers: Processes to decode the snapshots with when the range is read from the store.
+    :raises ValueError: If the range overlaps a payout that was already made.
+    """
+    paths = get_payout_paths(payout.DEFAULT_PAYOUT_PATHS, hotkey_ss58_address)
+    default_start_block, default_end_block = payout.get_payout_range(paths)
+    start_block = default_start_block if start_block is None else start_block
+    end_block = default_end_block if end_block is None else end_block
+    previous_end_block = get_last_paid_block(paths.history_path, PAYOUT_LOG_COLUMNS)
+    _check_not_paid(start_block, previous_end_block)
+
+    users_data = load_user_data(payout.user_data_path)
+    user_averages = payout.get_user_averages(users_data, start_block, end_block, paths.snapshot_path, workers)
+    referral_graph = load_referral_graph(payout.referral_csv_path)
+    if transfer_mode == 'concurrent':
+        batch_size = 1
+    fee_schedule = payout.estimate_payout_fees(sub, keypair, users_data, payout_pool_rao, batch_size)
+    payouts = payout.calculate_payouts(referral_graph, user_averages, payout_pool_rao, fee_schedule)
+
+    return _new_plan('referral', network, wallet_name, keypair, hotkey_ss58_address, start_block, end_block, previous_end_block,
+                     payout_pool_rao, transfer_mode, batch_size, fee_schedule,
+                     get_coverage(paths.snapshot_path, start_block, end_block),
+                     payout.get_payout_transfers(payouts, users_data))
+
+def build_nominator_plan(sub, network, wallet_name, keypair, payout_pool_rao, start_block=None, end_block=None,
+                         transfer_mode='batch', batch_size=DEFAULT_BATCH_SIZE, hotkey_ss58_address=None,
+                         workers=None):
+    """
+    Calculates a nominator payout as nominator_payout.py does, without sending anything.
+    Parameters as for build_referral_plan.
+    """
+    paths = get_payout_paths(nominator_payout.DEFAULT_PAYOUT_PATHS, hotkey_ss58_address)
+    previous_end_block, first_block, last_block = nominator_payout.get_payout_range(paths)
+    first_block = first_block if start_block is None else start_block
+    last_block = last_block if end_block is None else end_block
+    if first_block is not None:
+        _check_not_paid(first_block, previous_end_block)
+
+    payouts = nominator_payout.get_address_payouts(first_block, last_block, payout_pool_rao, paths.snapshot_path, workers)
+    if transfer_mode == 'concurrent':
+        batch_size = 1
+    transfers, fee_schedule = nominator_payout.get_fee_adjusted_transfers(sub, keypair, payouts, batch_size)
+
+    if first_block is None:
+        first_snapshot = next(iter_snapshots(paths.snapshot_path), None)
+        first_block = first_snapshot['block'] if first_snapshot else 0
+    plan = _new_plan('nominator', network, wallet_name, keypair, hotkey_ss58_address, first_block, last_block, previous_end_block,
+                     payout_pool_rao, transfer_mode, batch_size, fee_schedule,
+                     get_coverage(paths.snapshot_path, first_block, last_block or 0), transfers)
+    plan['shares'] = payouts
+    return plan
+
+def format_plan(plan):
+    lines = [
+        f"{plan['kind'].capitalize()} payout plan created {plan['created']}",
+        f"  Blocks {plan['start_block']} to {plan['end_block']} ({plan['coverage']:.1%} of target blocks snapshotted)",
+        f"  Pool {plan['payout_pool_total']} from wallet {plan['wallet']} ({plan['coldkey']})"
+        + (f" for hotkey {plan['hotkey']}" if plan.get('hotkey') else ""),
+        f"  {len(plan['transfers'])} transfers of {format_rao(sum(amount_rao for _, _, amount_rao in plan['transfers']))}, "
+        f"estimated fees {format_rao(plan['estimated_fee_rao'])}, sent "
+        + ("concurrently" if plan['transfer_mode'] == 'concurrent' else f"in batches of {plan['batch_size']}"),
+        f"  Digest {get_plan_digest(plan)}, " + ("approved" if plan['approved_digest'] == get_plan_digest(plan)
+                                               else "changed since its approval" if plan['approved_digest']
+                                               else "not approved"),
+    ]
+    for key, address, amount_rao in plan['transfers']:
+        lines.append(f"    {key}: {format_rao(amount_rao)}" + (f" to {address}" if key != address else ""))
+    return "\n".join(lines)
+
+def approve_plan(plan):
+    plan['approved_digest'] = get_plan_digest(plan)
+    return plan
+
+def _send(sub, keypair, transfers, transfer_mode, batch_size, on_signed=None, on_result=None):
+    if transfer_mode == 'concurrent':
+        return concurrent_transfer(sub, keypair, transfers, on_signed=on_signed, on_result=on_result)
+    return batch_transfer(sub, keypair, transfers, batch_size, on_signed=on_signed, on_result=on_result)
+
+def _open_plan_run(sub, keypair, plan, journal_path, last_paid_block):
+    """
+    Journals a new run of the plan, or resumes the run of an earlier execution that was
+    interrupted or left transfers unpaid.
+
+    :param last_paid_block: End block of the latest payout in the plan's history.
+    :return: (run, transfers still to send), or None if some transfers of the resumed run may
+        still be waiting in the transaction pool.
+    :raises ValueError: If another run is unfinished, or a payout was made since the plan was created.
+    """
+    # Any unfinished run other than this plan's has to be finished first, otherwise recipients
+    # it already paid would be paid again
+    run = find_open_run(journal_path)
+    if run is not None:
+        planned = sorted((key, transfer['address'], transfer['amount_rao']) for key, transfer in run['transfers'].items())
+        if ((run['start_block'], run['end_block'], run['payout_pool_total']) != (plan['start_block'], plan['end_block'], plan['payout_pool_total'])
+                or planned != sorted(tuple(transfer) for transfer in plan['transfers'])):
+            raise ValueError(f"An unfinished payout for blocks {run['start_block']} to {run['end_block']} is in {journal_path}. "
+                             "Resume or abandon it first.")
+        unresolved = resolve_in_doubt(sub, journal_path, run, keypair)
+        if unresolved:
+            print(f"{len(unresolved)} transfers may still be waiting in the transaction pool: {', '.join(unresolved)}. "
+                  "Execute the plan again once they have been included or dropped.")
+            return None
+        return run, transfers_in_state(run, UNPAID_STATES)
+
+    if last_paid_block != plan['previous_end_block']:
+        raise ValueError("A payout was made since the plan was created; create a new plan.")
+    transfers = [tuple(transfer) for transfer in plan['transfers']]
+    # Every transfer is journaled as planned before anything is sent
+    run_id = start_run(journal_path, transfers, plan['start_block'], plan['end_block'], plan['payout_pool_total'],
+                       sub.get_current_block())
+    return load_runs(journal_path)[run_id], transfers
+
+def _execute_referral_plan(sub, keypair, plan):
+    users_data = load_user_data(payout.user_data_path)
+    paths = get_payout_paths(payout.DEFAULT_PAYOUT_PATHS, plan.get('hotkey'))
+    opened = _open_plan_run(sub, keypair, plan, paths.journal_path,
+                            get_last_paid_block(paths.history_path, PAYOUT_LOG_COLUMNS))
+    if opened is None:
+        return False
+    run, transfers = opened
+    return payout.run_payout(sub, keypair, run, transfers, users_data, plan['transfer_mode'], plan['batch_size'], paths)
+
+def _execute_nominator_plan(sub, keypair, plan):
+    paths = get_payout_paths(nominator_payout.DEFAULT_PAYOUT_PATHS, plan.get('hotkey'))
+    journal_path = paths.journal_path
+    opened = _open_plan_run(sub, keypair, plan, journal_path,
+                            nominator_payout.read_last_processed_block(paths.history_path))
+    if opened is None:
+        return False
+    run, transfers = opened
+    return nominator_payout.run_payout(sub, keypair, run, transfers, plan['transfer_mode'], plan['batch_size'], paths)
+
+def execute_plan(sub, keypair, plan, dry_run=False):
+    """
+    Sends the transfers of an approved plan and records the payout like the interactive scripts.
+
+    :param dry_run: Send the transfers to an in-memory chain instead, recording nothing.
+    :return: True if every transfer was included.
+    :raises ValueError: If the plan isn't approved, was changed since, is for another wallet or
+        is out of date.
+    """
+    if plan['approved_digest'] != get_plan_digest(plan):
+        raise ValueError("The plan was not approved, or was changed after its approval.")
+    if keypair.ss58_address != plan['coldkey']:
+        raise ValueError(f"The plan pays from {plan['coldkey']}, not {keypair.ss58_address}.")
+
+    if dry_run:
+        results = _send(sub, keypair, [tuple(transfer) for transfer in plan['transfers']], plan['transfer_mode'], plan['batch_size'])
+        failed = [key for key, result in results.items() if not result['success']]
+        print(f"Mock sent {len(results) - len(failed)} of {len(results)} transfers.")
+        return not failed
+    if plan['kind'] == 'referral':
+        return _execute_referral_plan(sub, keypair, plan)
+    return _execute_nominator_plan(sub, keypair, plan)
+
+def connect(network):
+    return bt.subtensor(config=bt.subtensor.config(), network=network)
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan payouts to a file without prompting, approve a plan and execute approved plans.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = subparsers.add_parser('plan', help="Calculate a payout and write it to a plan file.")
+    plan_parser.add_argument('--kind', choices=PLAN_KINDS, default='referral', help="Referral payout (payout.py) or nominator payout (nominator_payout.py).")
+    plan_parser.add_argument('--pool', required=True, help="Payout pool in tao.")
+    plan_parser.add_argument('--wallet', required=True, help="Name of the paying wallet. Only its public key is read.")
+    plan_parser.add_argument('--start-block', type=int, help="First block to pay for. Defaults to the block after the last payout.")
+    plan_parser.add_argument('--end-block', type=int, help="Last block to pay for. Defaults to the latest snapshot.")
+    plan_parser.add_argument('--mode', choices=('batch', 'concurrent'), default='batch', help="How the transfers are to be sent.")
+    plan_parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Transfers per batch.")
+    plan_parser.add_argument('--network', default=DEFAULT_NETWORK, help="Subtensor network address, used to price the fees.")
+    plan_parser.add_argument('--hotkey', help="Pay for this hotkey's snapshot store. Defaults to the default store.")
+    plan_parser.add_argument('--workers', type=int, help="Decode snapshots with this many processes when the range is read from the store, for long histories.")
+    plan_parser.add_argument('--output', help="Plan file to write. Defaults to logs/<kind>_payout_plan.json, or logs/<kind>_payout_plan_<hotkey>.json.")
+    plan_parser.add_argument('--csv', help="Also write the transfers to this CSV file.")
+    plan_parser.add_argument('--approve', action='store_true', help="Approve the plan straight away.")
+
+    approve_parser = subparsers.add_parser('approve', help="Show a plan and approve it for execution.")
+    approve_parser.add_argument('plan_file')
+
+    execute_parser = subparsers.add_parser('execute', help="Send the transfers of an approved plan.")
+    execute_parser.add_argument('plan_file')
+    execute_parser.add_argument('--network', help="Subtensor network address. Defaults to the network of the plan.")
+    execute_parser.add_argument('--dry-run', action='store_true', help="Send to an in-memory chain instead, recording nothing.")
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'plan':
+            wallet = bt.wallet(name=args.wallet)
+            build_plan = build_referral_plan if args.kind == 'referral' else build_nominator_plan
+            plan = build_plan(connect(args.network), args.network, args.wallet, wallet.coldkeypub, tao_to_rao(args.pool),
+                              args.start_block, args.end_block, args.mode, args.batch_size, args.hotkey, args.workers)
+            if args.approve:
+                approve_plan(plan)
+            plan_path = args.output or get_default_plan_path(args.kind, args.hotkey)
+            save_plan(plan, plan_path)
+            if args.csv:
+                write_plan_csv(plan, args.csv)
+            print(format_plan(plan))
+            print(f"Wrote the plan to {plan_path}.")
+            return 0
+
+        plan = load_plan(args.plan_file)
+        if args.command == 'approve':
+            print(format_plan(plan))
+            save_plan(approve_plan(plan), args.plan_file)
+            print(f"Approved {args.plan_file}.")
+            return 0
+
+        wallet = bt.wallet(name=plan['wallet'])
+        if args.dry_run:
+            # Dry runs go through the same sending code against an in-memory chain
+            complete = execute_plan(MockSubtensor(), wallet.coldkeypub, plan, dry_run=True)
+        else:
+            complete = execute_plan(connect(args.network or plan['network']), wallet.coldkey, plan)
+        return 0 if complete else 1
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
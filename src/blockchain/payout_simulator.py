@@ -0,0 +1,219 @@
+import argparse
+import csv
+import os
+from collections import namedtuple
+
+import bittensor as bt
+import numpy as np
+
+from ..data_management.user_data import load_user_data
+from ..data_management.snapshot_data import iter_snapshots, get_covering_block
+from ..data_management.snapshot_accumulators import get_ranges_averages
+from ..data_management.payout_history import get_payout_paths
+from ..referral_management.referral_graph import load_referral_graph, apply_referral_taxes_array
+from .stake_matrix import build_percent_matrix, average_address_percents, user_column_ids
+from .payout_math import tao_to_rao, format_rao, FeeSchedule, DEFAULT_FEE_SCHEDULE
+from .transfers import DEFAULT_BATCH_SIZE
+from .payout import (allocate_payouts, estimate_payout_fees, get_payout_range, snapshot_path, user_data_path, referral_csv_path,
+                     DEFAULT_PAYOUT_PATHS)
+
+# One simulated payout: the block range, the label of the referral table, the pool in rao and
+# the resulting payouts (user name -> rao after the transfer fees of the simulation's
+# FeeSchedule), as payout.py would send them with those fees
+Scenario = namedtuple('Scenario', ['start_block', 'end_block', 'table', 'pool_rao', 'payouts'])
+
+def get_address_range_averages(file_path, start_blocks, end_blocks, workers=None):
+    """
+    Block-weighted average percent of every address over several ranges.
+
+    Read from the logger's accumulators when they are up to date; otherwise the union of the
+    ranges is read from the store once and every range is averaged in one pass over it.
+
+    :param workers: Processes to decode the snapshots with when they are read from the store.
+    :return: (addresses, averages) with averages a float64 array of shape (ranges, addresses).
+    """
+    range_averages = get_ranges_averages(file_path, start_blocks, end_blocks)
+    if range_averages is not None:
+        return range_averages
+    first_block = min(start_blocks)
+    covering_block = get_covering_block(file_path, first_block)
+    snapshots = iter_snapshots(file_path, covering_block if covering_block is not None else first_block, max(end_blocks), workers)
+    matrix = build_percent_matrix(snapshots)
+    return matrix.addresses, average_address_percents(matrix, start_blocks, end_blocks)
+
+def get_user_range_averages(file_path, user_addresses, start_blocks, end_blocks, workers=None):
+    """
+    Base percent of every user over several ranges, as calculate_user_sums_and_averages
+    computes it for one.
+
+    :return: (users, averages) with averages a float64 array of shape (users, ranges).
+    """
+    addresses, averages = get_address_range_averages(file_path, start_blocks, end_blocks, workers)
+    users, column_users = user_column_ids(addresses, user_addresses)
+    owned = column_users >= 0
+    user_averages = np.zeros((len(users), len(start_blocks)), dtype=np.float64)
+    np.add.at(user_averages, column_users[owned], averages[:, owned].T)
+    return users, user_averages
+
+def with_taxes(graph, taxes):
+    """
+    Copy of a referral graph with some referrers' taxes replaced, for trying out tax changes.
+
+    :param taxes: Dictionary of referrer name -> tax (0.1 == 10%).
+    :raises ValueError: If a referrer is not in the graph.
+    """
+    adjusted = graph.taxes.copy()
+    for referrer, tax in taxes.items():
+        if referrer not in graph.node_ids:
+            raise ValueError(f"{referrer} is not in the referral table.")
+        adjusted[graph.node_ids[referrer]] = float(tax)
+    return graph._replace(taxes=adjusted)
+
+def simulate_payouts(user_addresses, ranges, pools_rao, referral_tables, file_path=snapshot_path,
+                     fee_schedule=DEFAULT_FEE_SCHEDULE, workers=None):
+    """
+    Computes the payouts of every combination of block range, referral table and pool.
+
+    The base percents of all ranges come from one pass over the snapshot data, the taxes of
+    each table are applied to all ranges at once, and each pool is then split exactly as
+    payout.calculate_payouts would split it.
+
+    :param user_addresses: Dictionary of user name -> list of addresses.
+    :param ranges: List of (start_block, end_block).
+    :param pools_rao: List of pool sizes in rao.
+    :param referral_tables: Dictionary of label -> ReferralGraph.
+    :param fee_schedule: FeeSchedule the transfer fees are deducted with, e.g. estimated by the
+        chain for the payout's wallet and transfer mode (see estimate_payout_fees).
+    :param workers: Processes to decode the snapshots with when they are read from the store.
+    :return: List of Scenarios, by range, then table, then pool.
+    """
+    start_blocks = [start_block for start_block, _ in ranges]
+    end_blocks = [end_block for _, end_block in ranges]
+    users, base_percents = get_user_range_averages(file_path, user_addresses, start_blocks, end_blocks, workers)
+    adjusted = {table: apply_referral_taxes_array(graph, users, base_percents) for table, graph in referral_tables.items()}
+
+    scenarios = []
+    for range_id, (start_block, end_block) in enumerate(ranges):
+        for table, adjusted_percents in adjusted.items():
+            percents = dict(zip(users, adjusted_percents[:, range_id].tolist()))
+            for pool_rao in pools_rao:
+                scenarios.append(Scenario(start_block, end_block, table, pool_rao, allocate_payouts(percents, pool_rao, fee_schedule)))
+    return scenarios
+
+def get_paid_total(scenario):
+    """Rao actually sent in a scenario; non-positive payouts are skipped like in payout.py."""
+    return sum(payout for payout in scenario.payouts.values() if payout > 0)
+
+def format_fee_schedule(schedule):
+    """Describe a FeeSchedule, e.g. for the header of a comparison."""
+    if schedule.batch_size <= 1:
+        return f"{schedule.single_fee_rao} rao per transfer, each in an extrinsic of its own"
+    return (f"{schedule.batch_fee_rao} rao per batch of {schedule.batch_size} transfers "
+            f"({schedule.single_fee_rao} rao for a batch of one)")
+
+def format_comparison(scenarios):
+    """Table of every user's payout (in tao) under every scenario, one column per scenario."""
+    users = list(scenarios[0].payouts) if scenarios else []
+    lines = ["Scenarios:"]
+    for number, scenario in enumerate(scenarios, 1):
+        lines.append(f"  #{number}: blocks {scenario.start_block}-{scenario.end_block}, referral table "
+                     f"{scenario.table}, pool {format_rao(scenario.pool_rao)}")
+
+    name_width = max([len(user) for user in users] + [len("Undistributed")])
+    amount_width = len(format_rao(max([scenario.pool_rao for scenario in scenarios] + [0]))) + 1
+    header = "User".ljust(name_width) + "".join(f"#{number}".rjust(amount_width + 1) for number in range(1, len(scenarios) + 1))
+    lines += ["", header, "-" * len(header)]
+
+    def row(name, amounts):
+        return name.ljust(name_width) + "".join(format_rao(amount).rjust(amount_width + 1) for amount in amounts)
+
+    for user in users:
+        lines.append(row(user, [max(scenario.payouts[user], 0) for scenario in scenarios]))
+    lines.append("-" * len(header))
+    lines.append(row("Paid", [get_paid_total(scenario) for scenario in scenarios]))
+    lines.append(row("Undistributed", [scenario.pool_rao - get_paid_total(scenario) for scenario in scenarios]))
+    return "\n".join(lines)
+
+def write_comparison_csv(scenarios, file_path):
+    """Write one line per scenario and user, with the payout in tao (0 when it would be skipped)."""
+    with open(file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['start_block', 'end_block', 'referral_table', 'pool', 'user', 'payout'])
+        for scenario in scenarios:
+            for user, payout in scenario.payouts.items():
+                writer.writerow([scenario.start_block, scenario.end_block, scenario.table, format_rao(scenario.pool_rao),
+                                 user, format_rao(max(payout, 0))])
+
+def parse_range(text):
+    start_block, _, end_block = text.partition(':')
+    return int(start_block), int(end_block)
+
+def parse_fee_schedule(text):
+    single_fee_rao, _, rest = text.partition(':')
+    if not rest:
+        return FeeSchedule(int(single_fee_rao), int(single_fee_rao), 1)
+    batch_fee_rao, _, batch_size = rest.partition(':')
+    return FeeSchedule(int(single_fee_rao), int(batch_fee_rao), int(batch_size))
+
+def parse_taxes(text):
+    taxes = {}
+    for item in text.split(','):
+        referrer, _, tax = item.partition('=')
+        taxes[referrer.strip()] = float(tax)
+    return taxes
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare payouts for several pools, block ranges and referral taxes without sending anything.")
+    parser.add_argument('--pool', action='append', required=True, help="Payout pool in tao (repeat for several pools).")
+    parser.add_argument('--range', action='append', type=parse_range, dest='ranges', metavar='START:END',
+                        help="Block range to pay for (repeat for several). Defaults to the range of the next payout.")
+    parser.add_argument('--referrals', action='append', default=[], metavar='CSV',
+                        help="Alternative referral table in the format of referral_layers.csv (repeat for several).")
+    parser.add_argument('--taxes', action='append', default=[], metavar='REFERRER=TAX,...',
+                        help="Variant of the current referral table with some taxes changed (repeat for several).")
+    fees = parser.add_mutually_exclusive_group()
+    fees.add_argument('--wallet', help="Estimate the transfer fees from the chain for this wallet, as the payout would. Only its public key is read.")
+    fees.add_argument('--fees', type=parse_fee_schedule, metavar='RAO[:BATCH_RAO:BATCH_SIZE]',
+                      help="Transfer fees to deduct: RAO per transfer, or RAO for a batch of one and BATCH_RAO for a batch of BATCH_SIZE. "
+                           "Defaults to the flat fee the payout falls back to.")
+    parser.add_argument('--mode', choices=('batch', 'concurrent'), default='batch', help="How the transfers would be sent, for --wallet.")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Transfers per batch, for --wallet.")
+    parser.add_argument('--network', default="ws://127.0.0.1:9944", help="Subtensor network address, for --wallet.")
+    parser.add_argument('--hotkey', help="Simulate payouts for this hotkey's snapshot store. Defaults to the default store.")
+    parser.add_argument('--csv', help="Also write every payout of every scenario to this CSV file.")
+    parser.add_argument('--workers', type=int, help="Decode snapshots with this many processes when the range is read from the store, for long histories.")
+    args = parser.parse_args()
+    paths = get_payout_paths(DEFAULT_PAYOUT_PATHS, args.hotkey)
+
+    pools_rao = [tao_to_rao(pool) for pool in args.pool]
+    ranges = args.ranges or [get_payout_range(paths)]
+
+    current = load_referral_graph(referral_csv_path)
+    referral_tables = {'current': current}
+    for referral_path in args.referrals:
+        referral_tables[os.path.basename(referral_path)] = load_referral_graph(referral_path)
+    for taxes in args.taxes:
+        referral_tables[taxes] = with_taxes(current, parse_taxes(taxes))
+
+    users_data = load_user_data(user_data_path)
+    if args.wallet:
+        # Priced like payout.py does, with the largest pool standing in for the largest transfer
+        sub = bt.subtensor(config=bt.subtensor.config(), network=args.network)
+        batch_size = 1 if args.mode == 'concurrent' else args.batch_size
+        fee_schedule = estimate_payout_fees(sub, bt.wallet(name=args.wallet).coldkeypub, users_data, max(pools_rao), batch_size)
+        fee_source = (f"estimated by {args.network} for wallet {args.wallet}" if fee_schedule is not DEFAULT_FEE_SCHEDULE
+                      else "flat default, the chain could not price them")
+    elif args.fees:
+        fee_schedule, fee_source = args.fees, "given"
+    else:
+        fee_schedule, fee_source = DEFAULT_FEE_SCHEDULE, "flat default, pass --wallet to estimate them"
+
+    scenarios = simulate_payouts(users_data, ranges, pools_rao, referral_tables, paths.snapshot_path, fee_schedule, args.workers)
+    print(f"Fees ({fee_source}): {format_fee_schedule(fee_schedule)}\n")
+    print(format_comparison(scenarios))
+    if args.csv:
+        write_comparison_csv(scenarios, args.csv)
+        print(f"\nWrote {len(scenarios)} scenarios to {args.csv}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from collections import namedtuple
+
+import numpy as np
+
+from ..data_management.user_data import build_address_index
+
+# blocks: int64 array (one entry per snapshot, in store order)
+# addresses: list of addresses, the column order of values
+# address_ids: dict mapping address -> column index
+# values: float64 array of shape (snapshots, addresses) holding each nominator's percent
+PercentMatrix = namedtuple('PercentMatrix', ['blocks', 'addresses', 'address_ids', 'values'])
+
+def build_percent_matrix(snapshots, field='nominators_percent'):
+    """
+    Builds a snapshots x addresses matrix from a stream of snapshot records.
+
+    :param snapshots: Iterable of snapshot records, ordered by block.
+    :param field: The (address, value) list to read from each record.
+    :return: A PercentMatrix. Addresses missing from a snapshot hold 0.
+    """
+    address_ids = {}
+    blocks = []
+    row_ids = []
+    column_ids = []
+    entries = []
+
+    for row, snapshot in enumerate(snapshots):
+        blocks.append(snapshot['block'])
+        for address, value in snapshot[field]:
+            column = address_ids.get(address)
+            if column is None:
+                column = address_ids[address] = len(address_ids)
+            row_ids.append(row)
+            column_ids.append(column)
+            entries.append(value)
+
+    values = np.zeros((len(blocks), len(address_ids)), dtype=np.float64)
+    values[np.array(row_ids, dtype=np.int64), np.array(column_ids, dtype=np.int64)] = entries
+
+    return PercentMatrix(
+        blocks=np.array(blocks, dtype=np.int64),
+        addresses=list(address_ids),
+        address_ids=address_ids,
+        values=values,
+    )
+
+def block_range_rows(matrix, start_block=None, end_block=None):
+    """Return the slice of rows whose block lies within [start_block, end_block]."""
+    start = 0 if start_block is None else int(np.searchsorted(matrix.blocks, start_block, side='left'))
+    stop = len(matrix.blocks) if end_block is None else int(np.searchsorted(matrix.blocks, end_block, side='right'))
+    return slice(start, max(start, stop))
+
+def get_block_weights(blocks, start_block=None, end_block=None):
+    """
+    Weights snapshots by the number of blocks within [start_block, end_block] each one covers.
+
+    A snapshot covers the blocks from its own up to the next snapshot's, so irregular spacing
+    (restarts, gaps) doesn't bias averages. A snapshot taken before start_block covers the
+    start of the range up to the first snapshot in it, and the last snapshot covers the range
+    up to end_block. Snapshots outside the range weigh 0.
+
+    :param blocks: Sorted int64 array of snapshot blocks.
+    :param start_block: First block of the range, or an array of them for several ranges.
+        Defaults to the first snapshot.
+    :param end_block: Last block of the range, or an array of them. Defaults to the last snapshot.
+    :return: int64 array of weights aligned with blocks, or of shape (ranges, snapshots).
+    """
+    blocks = np.asarray(blocks, dtype=np.int64)
+    if len(blocks) == 0:
+        return np.zeros(np.shape(start_block) + (0,), dtype=np.int64)
+    start_block = blocks[0] if start_block is None else start_block
+    end_block = blocks[-1] if end_block is None else end_block
+    start_block = np.asarray(start_block, dtype=np.int64)[..., None]
+    end_block = np.asarray(end_block, dtype=np.int64)[..., None]
+    next_blocks = np.append(blocks[1:], np.iinfo(np.int64).max)
+    covered = np.minimum(next_blocks, end_block + 1) - np.maximum(blocks, start_block)
+    return np.maximum(covered, 0)
+
+def average_address_percents(matrix, start_block=None, end_block=None):
+    """
+    Averages each address's percent over a block range, weighting every snapshot by the
+    blocks it covers (see get_block_weights). Pass arrays of start and end blocks to average
+    over several ranges in one pass.
+
+    :return: A float64 array aligned with matrix.addresses (of shape (ranges, addresses) for
+        several ranges), holding zeros for empty ranges.
+    """
+    weights = get_block_weights(matrix.blocks, start_block, end_block)
+    totals = weights.sum(axis=-1, keepdims=True)
+    averages = weights @ matrix.values / np.maximum(totals, 1)
+    return np.where(totals > 0, averages, 0.0)
+
+def user_column_ids(addresses, user_addresses):
+    """
+    Maps every address column (e.g. matrix.addresses) to the index of the user owning it.
+
+    :param addresses: List of addresses, in column order.
+    :param user_addresses: Dictionary of user name -> list of addresses.
+    :return: (users, column_users) where column_users holds -1 for addresses no user owns.
+    """
+    users = list(user_addresses)
+    user_ids = {user: user_id for user_id, user in enumerate(users)}
+    address_index = build_address_index(user_addresses)
+
+    column_users = np.full(len(addresses), -1, dtype=np.int64)
+    for column, address in enumerate(addresses):
+        user = address_index.get(address)
+        if user is not None:
+            column_users[column] = user_ids[user]
+    return users, column_users
+
+def sum_by_user(addresses, address_values, user_addresses):
+    """Adds per-address values (aligned with addresses) up into per-user totals."""
+    users, column_users = user_column_ids(addresses, user_addresses)
+    owned = column_users >= 0
+    totals = np.bincount(column_users[owned], weights=address_values[owned], minlength=len(users))
+    return {user: float(totals[user_id]) for user_id, user in enumerate(users)}
+
+def average_user_percents(matrix, user_addresses, start_block=None, end_block=None):
+    """Block-weighted average percent per user over a block range, summing all of the user's addresses."""
+    return sum_by_user(matrix.addresses, average_address_percents(matrix, start_block, end_block), user_addresses)
@@ -0,0 +1,384 @@
+import logging
+import time
+from collections import deque
+
+from .payout_math import FeeSchedule, DEFAULT_FEE_SCHEDULE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WINDOW = 32
+INCLUSION_TIMEOUT_BLOCKS = 10
+
+# Fee estimates are reused for this long: (batch_size, amount bytes) -> (time, FeeSchedule)
+FEE_CACHE_SECONDS = 600
+_fee_schedules = {}
+
+def compose_transfer_call(substrate, dest, amount_rao):
+    """Compose a Balances.transfer_keep_alive call so the pool account can never be reaped."""
+    return substrate.compose_call(
+        call_module='Balances',
+        call_function='transfer_keep_alive',
+        call_params={'dest': dest, 'value': amount_rao}
+    )
+
+def compose_batch_call(substrate, transfers):
+    """Compose a Utility.batch_all call of transfers, see sign_batch."""
+    calls = [compose_transfer_call(substrate, address, amount_rao) for _, address, amount_rao in transfers]
+    return substrate.compose_call(
+        call_module='Utility',
+        call_function='batch_all',
+        call_params={'calls': calls}
+    )
+
+def sign_batch(substrate, keypair, transfers, nonce=None):
+    """
+    Packs transfers into a single signed Utility.batch_all extrinsic.
+
+    batch_all is atomic: either every transfer in the batch lands or none does.
+
+    :param substrate: A SubstrateInterface (e.g. bt.subtensor().substrate).
+    :param keypair: The signing keypair of the payout pool wallet.
+    :param transfers: List of (key, address, amount_rao) tuples.
+    :param nonce: Nonce to sign with. Defaults to the account's next nonce.
+    :return: The signed extrinsic.
+    """
+    batch_call = compose_batch_call(substrate, transfers)
+    return substrate.create_signed_extrinsic(call=batch_call, keypair=keypair, nonce=nonce)
+
+def get_payment_fee(substrate, call, keypair):
+    """Fee in rao the chain would charge the keypair's account for an extrinsic of this call."""
+    return int(substrate.get_payment_info(call=call, keypair=keypair)['partialFee'])
+
+def estimate_fee_schedule(sub, keypair, address, amount_rao, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Estimates the fees of a payout's extrinsics from the chain's payment info.
+
+    Fees depend on the extrinsic's length, so the representative transfer should be the
+    payout's largest. For batches, a batch_all of one such transfer and one of batch_size
+    are priced; with a batch_size of 1 (concurrent transfers) a single transfer_keep_alive
+    is. Estimates are cached for FEE_CACHE_SECONDS. If the chain can't be asked, the flat
+    DEFAULT_FEE_SCHEDULE is used.
+
+    :param sub: A bt.subtensor (or MockSubtensor).
+    :param keypair: The payout pool's keypair; only its public key is used.
+    :param address: Destination of the representative transfer.
+    :param amount_rao: Amount of the representative transfer.
+    :return: A FeeSchedule.
+    """
+    cache_key = (batch_size, (int(amount_rao).bit_length() + 7) // 8)
+    cached = _fee_schedules.get(cache_key)
+    if cached is not None and time.time() - cached[0] < FEE_CACHE_SECONDS:
+        return cached[1]
+
+    substrate = sub.substrate
+    transfer = ('representative', address, amount_rao)
+    try:
+        if batch_size <= 1:
+            single_fee_rao = get_payment_fee(substrate, compose_transfer_call(substrate, address, amount_rao), keypair)
+            batch_fee_rao = single_fee_rao
+        else:
+            single_fee_rao = get_payment_fee(substrate, compose_batch_call(substrate, [transfer]), keypair)
+            batch_fee_rao = get_payment_fee(substrate, compose_batch_call(substrate, [transfer] * batch_size), keypair)
+    except Exception as e:
+        logger.error(f"Failed to estimate transfer fees, assuming {DEFAULT_FEE_SCHEDULE.single_fee_rao} rao per transfer: {e}")
+        return DEFAULT_FEE_SCHEDULE
+
+    schedule = FeeSchedule(single_fee_rao, batch_fee_rao, max(batch_size, 1))
+    _fee_schedules[cache_key] = (time.time(), schedule)
+    logger.info(f"Estimated fees: {single_fee_rao} rao for one transfer, {batch_fee_rao} rao for {schedule.batch_size}")
+    return schedule
+
+def submit_batch(substrate, keypair, transfers):
+    """Signs a batch of transfers (see sign_batch) and waits for its inclusion. Return the receipt."""
+    extrinsic = sign_batch(substrate, keypair, transfers)
+    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True, wait_for_finalization=False)
+
+def batch_transfer(sub, keypair, transfers, batch_size=DEFAULT_BATCH_SIZE, on_signed=None, on_result=None):
+    """
+    Sends transfers in batches of batch_size, one block inclusion per batch.
+
+    :param sub: A bt.subtensor (or MockSubtensor).
+    :param keypair: The signing keypair of the payout pool wallet (wallet.coldkey).
+    :param transfers: List of (key, address, amount_rao) tuples. key identifies the recipient
+        in the results, e.g. the user name.
+    :param batch_size: Maximum number of transfers per extrinsic.
+    :param on_signed: Optional callback(keys, nonce, extrinsic_hash), called before an
+        extrinsic is submitted.
+    :param on_result: Optional callback(key, result), called once a transfer's extrinsic has
+        been seen in a block. Transfers whose submission errored are not reported, as the
+        extrinsic may still be included later.
+    :return: Dictionary of key -> result with 'address', 'amount_rao', 'success',
+        'extrinsic_hash', 'block_hash' and 'error'.
+    """
+    substrate = sub.substrate
+    results = {}
+    for start in range(0, len(transfers), batch_size):
+        batch = transfers[start:start + batch_size]
+        extrinsic_hash = None
+        block_hash = None
+        included = False
+        try:
+            nonce = substrate.get_account_nonce(keypair.ss58_address)
+            extrinsic = sign_batch(substrate, keypair, batch, nonce)
+            extrinsic_hash = _extrinsic_hash(extrinsic)
+            if on_signed is not None:
+                on_signed([key for key, _, _ in batch], nonce, extrinsic_hash)
+            receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True, wait_for_finalization=False)
+            block_hash = receipt.block_hash
+            included = True
+            success = receipt.is_success
+            error = None if success else str(receipt.error_message)
+        except Exception as e:
+            success = False
+            error = str(e)
+
+        if success:
+            logger.info(f"Batch of {len(batch)} transfers included in block {block_hash} ({extrinsic_hash})")
+        else:
+            logger.error(f"Batch of {len(batch)} transfers failed: {error}")
+
+        for key, address, amount_rao in batch:
+            results[key] = {
+                'address': address,
+                'amount_rao': amount_rao,
+                'success': success,
+                'extrinsic_hash': extrinsic_hash,
+                'block_hash': block_hash,
+                'error': error,
+            }
+            if included and on_result is not None:
+                on_result(key, results[key])
+    return results
+
+def get_extrinsic_receipt(substrate, extrinsic_hash, block_hash):
+    """Look up the receipt of an extrinsic found in a block."""
+    if hasattr(substrate, 'get_extrinsic_receipt'):
+        # MockSubstrate keeps its own receipts
+        return substrate.get_extrinsic_receipt(extrinsic_hash, block_hash)
+    from substrateinterface import ExtrinsicReceipt
+    return ExtrinsicReceipt(substrate=substrate, extrinsic_hash=extrinsic_hash, block_hash=block_hash)
+
+def _extrinsic_hash(extrinsic):
+    """Normalise a block's extrinsic (object, bytes or hex string) to a 0x-prefixed hash."""
+    extrinsic_hash = getattr(extrinsic, 'extrinsic_hash', extrinsic)
+    if isinstance(extrinsic_hash, (bytes, bytearray)):
+        return '0x' + extrinsic_hash.hex()
+    return extrinsic_hash
+
+def get_next_nonce(substrate, ss58_address):
+    """
+    The account's next nonce counting its extrinsics waiting in the node's transaction pool
+    (system_accountNextIndex), unlike get_account_nonce, which only counts included ones.
+    """
+    return int(substrate.rpc_request('system_accountNextIndex', [ss58_address])['result'])
+
+def _reached_pool(substrate, ss58_address, nonce):
+    """Whether an extrinsic signed with nonce, whose submission raised, was pooled (or included) anyway."""
+    try:
+        return get_next_nonce(substrate, ss58_address) > nonce
+    except Exception as e:
+        # Unknown: it is treated as pooled, as reusing its nonce could pay it twice
+        logger.error(f"Failed to read the pool's next nonce: {e}")
+        return True
+
+def compose_filler_call(substrate):
+    """Compose an empty System.remark call, signed with a nonce to stop it holding up later ones."""
+    return substrate.compose_call(call_module='System', call_function='remark', call_params={'remark': ''})
+
+def _wait_for_new_block(sub, last_block, poll_interval):
+    current_block = sub.get_current_block()
+    while current_block <= last_block:
+        time.sleep(poll_interval)
+        current_block = sub.get_current_block()
+    return current_block
+
+def concurrent_transfer(sub, keypair, transfers, window=DEFAULT_WINDOW, max_attempts=3,
+                        timeout_blocks=INCLUSION_TIMEOUT_BLOCKS, poll_interval=2,
+                        on_signed=None, on_result=None):
+    """
+    Submits individual transfers without blocking on inclusion, keeping up to `window` in flight.
+
+    Nonces are assigned locally starting from the pool account's on-chain nonce, so many
+    transfers can sit in the transaction pool at once and land in the same block. Each new
+    block is scanned for the in-flight extrinsic hashes:
+
+    - included and successful: done.
+    - included but failed (e.g. insufficient balance): its nonce is spent, so the transfer is
+      re-signed with a fresh nonce, up to max_attempts.
+    - submission raised: if the pool's next nonce (get_next_nonce) shows the extrinsic was not
+      pooled, its nonce is reused by the next transfer and the transfer is queued again, up
+      to max_attempts. Otherwise, or if that can't be told, only the response was lost and
+      the extrinsic stays in flight.
+    - not included after timeout_blocks: the identical extrinsic (same nonce) is broadcast
+      again. Reusing the nonce guarantees the transfer can never be paid twice.
+    - its nonce used by another extrinsic (seen from the account's on-chain nonce): it can
+      never land and is re-signed with a fresh nonce, up to max_attempts.
+    - still not included after max_attempts rebroadcasts: its unused nonce would hold up
+      every later one, so an empty System.remark is signed with that nonce. Once the remark
+      lands the transfer can't any more and is re-signed with a fresh nonce. Transfers
+      signed after it are left as they are: re-signing them with lower nonces could let
+      their original extrinsics land as well.
+
+    :param sub: A bt.subtensor (or MockSubtensor).
+    :param keypair: The signing keypair of the payout pool wallet (wallet.coldkey).
+    :param transfers: List of (key, address, amount_rao) tuples.
+    :param window: Maximum number of transfers in flight at once.
+    :param on_signed: Optional callback(keys, nonce, extrinsic_hash), as for batch_transfer.
+    :param on_result: Optional callback(key, result), called when a transfer succeeds or
+        fails for good after being seen in a block. Transfers given up on without being seen
+        in a block are not reported.
+    :return: Dictionary of key -> result, in the same format as batch_transfer.
+    """
+    substrate = sub.substrate
+    ss58_address = keypair.ss58_address
+    pending = deque((key, address, amount_rao, 1) for key, address, amount_rao in transfers)
+    # Extrinsic hash -> entry. The entry of a filler remark has no 'transfer' but the hash of
+    # the stranded extrinsic whose nonce it takes in 'stranded'.
+    in_flight = {}
+    results = {}
+    nonce = substrate.get_account_nonce(ss58_address)
+    last_block = sub.get_current_block()
+
+    def finish(key, address, amount_rao, success, error, extrinsic_hash=None, block_hash=None, included=False):
+        results[key] = {
+            'address': address,
+            'amount_rao': amount_rao,
+            'success': success,
+            'extrinsic_hash': extrinsic_hash,
+            'block_hash': block_hash,
+            'error': error,
+        }
+        if included and on_result is not None:
+            on_result(key, results[key])
+
+    def retry(key, address, amount_rao, attempt, error, extrinsic_hash=None, block_hash=None):
+        included = block_hash is not None
+        if attempt < max_attempts:
+            logger.info(f"Retrying transfer to {key} (attempt {attempt + 1}): {error}")
+            pending.append((key, address, amount_rao, attempt + 1))
+            if included and on_result is not None:
+                on_result(key, {
+                    'address': address,
+                    'amount_rao': amount_rao,
+                    'success': False,
+                    'extrinsic_hash': extrinsic_hash,
+                    'block_hash': block_hash,
+                    'error': error,
+                })
+        else:
+            logger.error(f"Transfer to {key} failed after {attempt} attempts: {error}")
+            finish(key, address, amount_rao, False, error, extrinsic_hash, block_hash, included)
+
+    def watch(extrinsic_hash, extrinsic, extrinsic_nonce, transfer=None, stranded=None):
+        in_flight[extrinsic_hash] = {
+            'transfer': transfer,
+            'stranded': stranded,
+            'extrinsic': extrinsic,
+            'nonce': extrinsic_nonce,
+            'submitted_block': last_block,
+            'rebroadcasts': 0,
+            'filled': False,
+        }
+
+    while pending or in_flight:
+        while pending and len(in_flight) < window:
+            key, address, amount_rao, attempt = pending.popleft()
+            try:
+                call = compose_transfer_call(substrate, address, amount_rao)
+                extrinsic = substrate.create_signed_extrinsic(call=call, keypair=keypair, nonce=nonce)
+            except Exception as e:
+                retry(key, address, amount_rao, attempt, str(e))
+                continue
+            extrinsic_hash = _extrinsic_hash(extrinsic)
+            if on_signed is not None:
+                on_signed([key], nonce, extrinsic_hash)
+            try:
+                substrate.submit_extrinsic(extrinsic, wait_for_inclusion=False, wait_for_finalization=False)
+            except Exception as e:
+                if not _reached_pool(substrate, ss58_address, nonce):
+                    retry(key, address, amount_rao, attempt, str(e))
+                    continue
+                logger.info(f"Submission of transfer to {key} raised, but it reached the pool: {e}")
+            watch(extrinsic_hash, extrinsic, nonce, transfer=(key, address, amount_rao, attempt))
+            nonce += 1
+
+        # Read before the blocks are scanned, so every nonce below it was used in one of them
+        account_nonce = substrate.get_account_nonce(ss58_address)
+        current_block = _wait_for_new_block(sub, last_block, poll_interval)
+        for block_number in range(last_block + 1, current_block + 1):
+            block = substrate.get_block(block_number=block_number)
+            if block is None:
+                continue
+            block_hash = block['header']['hash']
+            for extrinsic in block['extrinsics']:
+                extrinsic_hash = _extrinsic_hash(extrinsic)
+                entry = in_flight.pop(extrinsic_hash, None)
+                if entry is None:
+                    continue
+                if entry['transfer'] is None:
+                    # The remark took the stranded transfer's nonce, so that can never land
+                    stranded = in_flight.pop(entry['stranded'], None)
+                    if stranded is not None:
+                        retry(*stranded['transfer'], 'Not included; its nonce was used by a filler remark')
+                    continue
+                key, address, amount_rao, attempt = entry['transfer']
+                receipt = get_extrinsic_receipt(substrate, extrinsic_hash, block_hash)
+                if receipt.is_success:
+                    finish(key, address, amount_rao, True, None, extrinsic_hash, block_hash, included=True)
+                else:
+                    retry(key, address, amount_rao, attempt, str(receipt.error_message), extrinsic_hash, block_hash)
+        last_block = current_block
+
+        # Nonces already used can't be signed with again
+        nonce = max(nonce, account_nonce)
+        for extrinsic_hash, entry in list(in_flight.items()):
+            if entry['nonce'] >= account_nonce:
+                continue
+            # Its nonce was used by an extrinsic that isn't this one
+            del in_flight[extrinsic_hash]
+            if entry['transfer'] is not None:
+                retry(*entry['transfer'], 'Not included; its nonce was used by another extrinsic')
+
+        for extrinsic_hash, entry in list(in_flight.items()):
+            if extrinsic_hash not in in_flight or entry['filled'] or last_block - entry['submitted_block'] < timeout_blocks:
+                continue
+            if entry['nonce'] > account_nonce and any(other['nonce'] == account_nonce for other in in_flight.values()):
+                # Held up by an earlier nonce of this run that is still being settled
+                entry['submitted_block'] = last_block
+                continue
+            if entry['rebroadcasts'] < max_attempts:
+                try:
+                    substrate.submit_extrinsic(entry['extrinsic'], wait_for_inclusion=False, wait_for_finalization=False)
+                except Exception as e:
+                    # Usually "already imported": the original is still waiting in the pool
+                    logger.info(f"Rebroadcast of extrinsic with nonce {entry['nonce']} not accepted: {e}")
+                entry['submitted_block'] = last_block
+                entry['rebroadcasts'] += 1
+                continue
+
+            if entry['transfer'] is not None and entry['nonce'] == account_nonce:
+                # Its unused nonce holds up every later one, so a remark is signed with it instead
+                try:
+                    filler = substrate.create_signed_extrinsic(call=compose_filler_call(substrate), keypair=keypair, nonce=entry['nonce'])
+                    substrate.submit_extrinsic(filler, wait_for_inclusion=False, wait_for_finalization=False)
+                except Exception as e:
+                    logger.error(f"Filler remark with nonce {entry['nonce']} not accepted: {e}")
+                else:
+                    logger.info(f"Transfer to {entry['transfer'][0]} was not included after {entry['rebroadcasts']} rebroadcasts; "
+                                f"signed a filler remark with its nonce {entry['nonce']}")
+                    watch(_extrinsic_hash(filler), filler, entry['nonce'], stranded=extrinsic_hash)
+                    entry['filled'] = True
+                    continue
+                stranded_hash = extrinsic_hash
+            else:
+                stranded_hash = entry['stranded']
+            # Given up on without knowing whether it can still land, so it is left unreported
+            del in_flight[extrinsic_hash]
+            stranded = in_flight.pop(stranded_hash, None) if stranded_hash != extrinsic_hash else entry
+            if stranded is not None:
+                key, address, amount_rao, _ = stranded['transfer']
+                logger.error(f"Transfer to {key} was not included; giving up on it")
+                finish(key, address, amount_rao, False, 'Not included', stranded_hash)
+
+    return results
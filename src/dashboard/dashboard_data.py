@@ -1,44 +1,36 @@
-import datetime
-import re
 import json
 import requests
-import pandas as pd
-
-def get_apr_and_take(log_file_path):
+import numpy as np
+from ..data_management.snapshot_codec import RAO_PER_TAO
+from ..data_management.snapshot_data import load_latest_snapshot
+from ..data_management.snapshot_table import load_snapshot_table, to_datetime
+from ..data_management.user_data import build_address_index
+from ..referral_management.referral_graph import apply_referral_taxes
+
+def get_apr_and_take(snapshot_path):
     """
-    Parses the log file to extract 'take', 'total_daily_return', and 'total_stake' from the last entry
+    Reads 'take', 'total_daily_return', and 'total_stake' from the latest snapshot
     and calculates the APR.
 
-    :param log_file_path: Path to the delegate_info.log file.
+    :param snapshot_path: Path to the delegate_snapshots.jsonl store.
     :return: A tuple containing the APR and the latest 'take' value.
     """
-    total_daily_return = 0
-    total_stake = 0
-    take = 0
-
-    with open(log_file_path, 'r') as file:
-        for line in file:
-            # Processing each line in the log file
-            json_match = re.search(r'\{.*\}', line)
-            if json_match:
-                json_data = json.loads(json_match.group())
-
-                # Extracting values if present in json_data
-                if 'total_daily_return' in json_data and 'total_stake' in json_data:
-                    total_daily_return = json_data['total_daily_return']
-                    total_stake = json_data['total_stake']
-                    take = json_data.get('take', 0)  # Default to 0 if 'take' is not in json_data
+    latest = load_latest_snapshot(snapshot_path) or {}
+    total_daily_return = latest.get('total_daily_return') or 0
+    total_stake = latest.get('total_stake') or 0
+    take = latest.get('take') or 0  # Default to 0 if 'take' is not in the snapshot
 
     apr = (total_daily_return / total_stake) * 365 if total_stake else 0
     return apr, take
 
-def get_latest_user_stakes(log_file_path, json_file_path, user_name):
+def get_latest_user_stakes(snapshot_path, json_file_path, user_name, workers=None):
     """
     Finds the latest stake values for all identifiers associated with a given user name.
     
-    :param log_file_path: Path to the delegate_info.log file.
+    :param snapshot_path: Path to the delegate_snapshots.jsonl store.
     :param json_file_path: Path to the user_data.json file.
     :param user_name: The user name to search for.
+    :param workers: Processes to decode snapshots the table cache is missing with.
     :return: A dictionary with user identifiers as keys and their latest stake information as values.
     """
     # Load user data from JSON file
@@ -51,25 +43,17 @@ def get_latest_user_stakes(log_file_path, json_file_path, user_name):
     # Dictionary to hold the latest stake for each user identifier
     latest_stakes = {user_id: None for user_id in user_ids}
 
-    with open(log_file_path, 'r') as file:
-        for line in file:
-            timestamp_match = re.search(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', line)
-            json_match = re.search(r'\{.*\}', line)
-
-            if timestamp_match and json_match:
-                timestamp = datetime.datetime.strptime(timestamp_match.group(), '%Y-%m-%d %H:%M:%S')
-                json_data = json.loads(json_match.group())
-
-                nominators = json_data.get('nominators', [])
-                for nominator in nominators:
-                    nominator_id, stake = nominator
-                    if nominator_id in user_ids:
-                        current_entry = latest_stakes[nominator_id]
-                        if current_entry is None or timestamp > current_entry['timestamp']:
-                            latest_stakes[nominator_id] = {
-                                'timestamp': timestamp,
-                                'stake': stake
-                            }
+    table = load_snapshot_table(snapshot_path, workers=workers)
+    for user_id in user_ids:
+        column = table.address_ids.get(user_id)
+        if column is None:
+            continue
+        # Stakes are stored in snapshot order, so the last one for the column is the latest
+        latest = np.flatnonzero(table.columns == column)[-1]
+        latest_stakes[user_id] = {
+            'timestamp': to_datetime(table.timestamps[table.rows[latest]]),
+            'stake': table.stakes_rao[latest] / RAO_PER_TAO
+        }
 
     return latest_stakes
 
@@ -90,79 +74,21 @@ def fetch_price():
         print(f"Failed to fetch price from {url}: {e}")
         return None
     
-def process_referral_structure(referral_data):
-    referral_structure = {}
-    for row in referral_data.itertuples(index=False):
-        layer, referrer, tax, *referees = row
-        tax = float(tax)
-        referees = [r for r in referees if r]
-        if layer not in referral_structure:
-            referral_structure[layer] = {}
-        referral_structure[layer][referrer] = {'Tax': tax, 'Referees': referees}
-    return referral_structure
-
-def calculate_user_base_and_adjusted_percent(username, user_data, parsed_delegate_info, referral_structure):
-    def calculate_base_percent(user):
-        user_addresses = user_data.get(user, [])
-        return sum(percent for address, percent in last_block_entry['nominators_percent'] if address in user_addresses)
+def calculate_user_base_and_adjusted_percent(username, user_data, last_block_entry, referral_graph):
+    address_index = build_address_index(user_data)
+    all_base_percents = {user: 0.0 for user in user_data}
+    for address, percent in last_block_entry['nominators_percent']:
+        user = address_index.get(address)
+        if user is not None:
+            all_base_percents[user] += percent
 
-    last_block_entry = parsed_delegate_info[-1]
-    all_base_percents = {user: calculate_base_percent(user) for user in user_data}
-
-    def find_referrer_and_layer(user):
-        for layer, refs in referral_structure.items():
-            for referrer, data in refs.items():
-                if user in data['Referees']:
-                    return referrer, layer
-        return None, None
-
-    def calculate_adjusted_percent(user, all_base_percents):
-        base_percent = all_base_percents.get(user, 0.0)
-        referrer, layer = find_referrer_and_layer(user)
-        if referrer and layer:
-            referrer_tax = referral_structure[layer][referrer]['Tax']
-            tax_deducted = base_percent * referrer_tax
-            base_percent -= tax_deducted
-        
-        # Add tax from referees
-        for ref_data in referral_structure.values():
-            if user in ref_data:
-                tax = ref_data[user]['Tax']
-                for referee in ref_data[user]['Referees']:
-                    if referee in all_base_percents:
-                        base_percent += all_base_percents[referee] * tax
-        
-        return base_percent
+    # Same referral tax propagation as the payout script
+    all_adjusted_percents = apply_referral_taxes(referral_graph, all_base_percents)
 
     base_percent = all_base_percents.get(username, 0.0)
-    adjusted_percent = calculate_adjusted_percent(username, all_base_percents)
+    adjusted_percent = all_adjusted_percents.get(username, 0.0)
     
     return base_percent, adjusted_percent
 
-def parse_delegate_info(log_content):
-    log_pattern = re.compile(
-        r"Timestamp: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}), Block: (\d+), "
-        r"Delegate info for [\w\d]+: ({.*?})", 
-        re.DOTALL
-    )
-    
-    matches = log_pattern.findall(log_content)
-    
-    parsed_data = []
-    for timestamp, block, delegate_info in matches:
-        try:
-            delegate_info_json = json.loads(delegate_info)
-            nominators_percent = delegate_info_json.get('nominators_percent', [])
-            parsed_data.append({
-                'timestamp': timestamp,
-                'block': int(block),
-                'nominators_percent': nominators_percent
-            })
-        except json.JSONDecodeError as e:
-            # Handle error
-            print(f"Error parsing JSON data at block {block}: {e}")
-    
-    return parsed_data
-
 import matplotlib.pyplot as plt
 
@@ -1,23 +1,25 @@
 # Import necessary modules from graph_generator and dashboard_data
 import os
 import json
-import pandas as pd
+import argparse
 # from graph_generator import plot_apr_over_time, plot_user_stake_and_value, plot_user_apr_over_time
 from .graph_generator import plot_apr_over_time, plot_user_stake_and_value, plot_user_apr_over_time
-from .dashboard_data import calculate_user_base_and_adjusted_percent, process_referral_structure, parse_delegate_info
+from .dashboard_data import calculate_user_base_and_adjusted_percent
 from .dashboard_data import get_apr_and_take, get_latest_user_stakes, fetch_price
+from ..data_management.snapshot_data import load_latest_snapshot, get_store_path
+from ..referral_management.referral_graph import load_referral_graph
 
 current_script_dir = os.path.dirname(os.path.abspath(__file__))
+default_snapshot_path = os.path.join(current_script_dir, '../../logs/delegate_snapshots.jsonl')
 
-def display_user_balance():
-    # Paths to your log and JSON data files
-    log_file_path = os.path.join(current_script_dir, '../../logs/delegate_info.log')
+def display_user_balance(snapshot_path=default_snapshot_path, workers=None):
+    # Paths to your JSON data files
     json_file_path = os.path.join(current_script_dir, '../../data/user_data.json')
 
     user_name = input("Enter the user name: ")
 
     # Fetch the latest stakes and prices
-    latest_stakes = get_latest_user_stakes(log_file_path, json_file_path, user_name)
+    latest_stakes = get_latest_user_stakes(snapshot_path, json_file_path, user_name, workers)
     current_price = fetch_price()
 
     if current_price is None:
@@ -41,25 +43,22 @@ def display_user_balance():
     print(f"Dollar Balance: ${total_balance_in_dollars:.2f}")
    # print("Debug - Latest Stakes in Display Function:", latest_stakes)
 
-def calculate_user_apr(user_name, log_file_path, user_data_path, referral_data_path):
-    # Get APR and take from the log file
-    apr, take = get_apr_and_take(log_file_path)
+def calculate_user_apr(user_name, snapshot_path, user_data_path, referral_data_path):
+    # Get APR and take from the latest snapshot
+    apr, take = get_apr_and_take(snapshot_path)
 
     # Load user data from JSON file
     with open(user_data_path, 'r') as file:
         user_data = json.load(file)
 
     # Load referral structure from CSV
-    referral_data = pd.read_csv(referral_data_path)
-    referral_structure = process_referral_structure(referral_data)
+    referral_graph = load_referral_graph(referral_data_path)
 
-    # Parse delegate info log file
-    with open(log_file_path, 'r') as file:
-        log_content = file.read()
-    parsed_delegate_info = parse_delegate_info(log_content)
+    # Only the latest snapshot is needed, read from the tail of the store
+    latest_snapshot = load_latest_snapshot(snapshot_path)
 
     # Calculate base and adjusted percent
-    base_percent, adjusted_percent = calculate_user_base_and_adjusted_percent(user_name, user_data, parsed_delegate_info, referral_structure)
+    base_percent, adjusted_percent = calculate_user_base_and_adjusted_percent(user_name, user_data, latest_snapshot, referral_graph)
 
     # Calculate user APR
     if base_percent > 0:
@@ -70,7 +69,7 @@ def calculate_user_apr(user_name, log_file_path, user_data_path, referral_data_p
     return user_apr
 
 
-def main_menu():
+def main_menu(snapshot_path=default_snapshot_path, workers=None):
     while True:
         print("\nMain Menu:")
         print("1. Plot Global APR Over Time")
@@ -84,29 +83,25 @@ def main_menu():
         choice = input("Enter your choice (1/2/3/4/5/6/7): ")
 
         if choice == '1':
-            log_file_path = os.path.join(current_script_dir, '../../logs/delegate_info.log')
-            plot_apr_over_time(log_file_path)
+            plot_apr_over_time(snapshot_path, workers)
 
         elif choice == '2':
             user_name = input("Enter the user name: ")
-            delegate_info_log_path = os.path.join(current_script_dir, '../../logs/delegate_info.log')
             user_data_path = os.path.join(current_script_dir, '../../data/user_data.json')
             referral_data_path = os.path.join(current_script_dir, '../../data/referral_layers.csv')
 
-            plot_user_apr_over_time(user_name, delegate_info_log_path, user_data_path, referral_data_path)
+            plot_user_apr_over_time(user_name, snapshot_path, user_data_path, referral_data_path, workers)
 
         elif choice == '3':
             user_name = input("Enter the user name: ")
-            delegate_info_log_path = os.path.join(current_script_dir, '../../logs/delegate_info.log')
             user_data_path = os.path.join(current_script_dir, '../../data/user_data.json')
-            plot_user_stake_and_value(user_name, delegate_info_log_path, user_data_path)
+            plot_user_stake_and_value(user_name, snapshot_path, user_data_path, workers)
 
         elif choice == '4':
-            display_user_balance()
+            display_user_balance(snapshot_path, workers)
 
         elif choice == '5':
             user_name = input("Enter the user name for base and adjusted percent calculation: ")
-            delegate_info_log_path = os.path.join(current_script_dir, '../../logs/delegate_info.log')
             user_data_path = os.path.join(current_script_dir, '../../data/user_data.json')
             referral_data_path = os.path.join(current_script_dir, '../../data/referral_layers.csv')
 
@@ -115,26 +110,22 @@ def main_menu():
                 user_data = json.load(file)
 
             # Load referral structure from CSV
-            referral_data = pd.read_csv(referral_data_path)
-            referral_structure = process_referral_structure(referral_data)
+            referral_graph = load_referral_graph(referral_data_path)
 
-            # Parse delegate info log file
-            with open(delegate_info_log_path, 'r') as file:
-                log_content = file.read()
-            parsed_delegate_info = parse_delegate_info(log_content)
+            # Only the latest snapshot is needed, read from the tail of the store
+            latest_snapshot = load_latest_snapshot(snapshot_path)
 
             # Calculate base and adjusted percent
-            base_percent, adjusted_percent = calculate_user_base_and_adjusted_percent(user_name, user_data, parsed_delegate_info, referral_structure)
+            base_percent, adjusted_percent = calculate_user_base_and_adjusted_percent(user_name, user_data, latest_snapshot, referral_graph)
             print(f"Base Percent for {user_name}: {base_percent}")
             print(f"Adjusted Percent for {user_name}: {adjusted_percent}")
 
         elif choice == '6':
             user_name = input("Enter the user name for APR calculation: ")
-            delegate_info_log_path = os.path.join(current_script_dir, '../../logs/delegate_info.log')
             user_data_path = os.path.join(current_script_dir, '../../data/user_data.json')
             referral_data_path = os.path.join(current_script_dir, '../../data/referral_layers.csv')
     
-            user_apr = calculate_user_apr(user_name, delegate_info_log_path, user_data_path, referral_data_path)
+            user_apr = calculate_user_apr(user_name, snapshot_path, user_data_path, referral_data_path)
             print(f"APR for {user_name}: {user_apr}")
 
 
@@ -146,4 +137,8 @@ def main_menu():
             print("Invalid choice. Please select a valid option (1/2/3/4).")
 
 if __name__ == "__main__":
-    main_menu()
+    parser = argparse.ArgumentParser(description="Plot and display delegate and user data from the snapshot store.")
+    parser.add_argument('--hotkey', help="Read this hotkey's snapshot store. Defaults to the default store.")
+    parser.add_argument('--workers', type=int, help="Decode snapshots with this many processes when building the table cache, for long histories.")
+    args = parser.parse_args()
+    main_menu(get_store_path(default_snapshot_path, args.hotkey), args.workers)
@@ -1,39 +1,31 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-import datetime
-import re
 import json
 import matplotlib.dates as mdates
 import matplotlib.ticker as ticker
 import matplotlib.ticker as mticker
+import numpy as np
+from ..data_management.snapshot_table import (load_snapshot_table, get_address_stakes, get_group_percents,
+                                             get_address_columns, get_datetimes, to_datetime)
+from ..data_management.user_data import build_address_index
+from ..referral_management.referral_graph import load_referral_graph, apply_referral_taxes_array
 
-def parse_log_file(file_path):
+def parse_log_file(file_path, workers=None):
     """
-    Parses the log file to extract timestamp, total_stake, and total_daily_return.
+    Reads the snapshot table to extract timestamp, total_stake, and total_daily_return.
     """
-    data_with_timestamps = []
-    with open(file_path, 'r') as file:
-        for line in file:
-            timestamp_match = re.search(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', line)
-            json_match = re.search(r'\{.*\}', line)
-            
-            if timestamp_match and json_match:
-                timestamp = datetime.datetime.strptime(timestamp_match.group(), '%Y-%m-%d %H:%M:%S')
-                json_data = json.loads(json_match.group())
-                
-                if 'total_stake' in json_data and 'total_daily_return' in json_data:
-                    data_with_timestamps.append({
-                        'timestamp': timestamp,
-                        'total_stake': json_data['total_stake'],
-                        'total_daily_return': json_data['total_daily_return']
-                    })
-    return data_with_timestamps
-
-def plot_apr_over_time(file_path):
+    table = load_snapshot_table(file_path, workers=workers)
+    return [
+        {'timestamp': timestamp, 'total_stake': total_stake, 'total_daily_return': total_daily_return}
+        for timestamp, total_stake, total_daily_return
+        in zip(get_datetimes(table), table.total_stake.tolist(), table.total_daily_return.tolist())
+    ]
+
+def plot_apr_over_time(file_path, workers=None):
     """
-    Plots the APR over time from a log file.
+    Plots the APR over time from the snapshot store.
     """
-    log_data = parse_log_file(file_path)
+    log_data = parse_log_file(file_path, workers)
     df = pd.DataFrame(log_data)
     df['APR'] = (df['total_daily_return'] / df['total_stake']) * 365
 
@@ -48,38 +40,26 @@ def plot_apr_over_time(file_path):
     plt.tight_layout()
     plt.show()
 
-def plot_user_stake_and_value(user_name, delegate_info_log_path, user_data_path):
+def plot_user_stake_and_value(user_name, delegate_info_log_path, user_data_path, workers=None):
     def parse_delegate_info_log_for_user(file_path, user_addresses):
+        table = load_snapshot_table(file_path, workers=workers)
+        # Calculate the user's total stake in every snapshot
+        user_stakes = get_address_stakes(table, get_address_columns(table, user_addresses))
+
         parsed_data = []
-        with open(file_path, 'r') as file:
-            for line in file:
-                # Extracting the price from the log message
-                price_match = re.search(r'Price: (\d+(\.\d+)?)', line)
-                if price_match:
-                    price = float(price_match.group(1))
-
-                    # Extract JSON data and additional info from the next line
-                    json_line = next(file, '')
-                    json_match = re.search(r'Timestamp: (.*), Block: (\d+), Delegate info for .+: (\{.*\})', json_line)
-                    if json_match:
-                        timestamp, block_number, json_data = json_match.groups()
-                        json_data = json.loads(json_data)
-
-                        # Extract nominators
-                        nominators = json_data.get('nominators', [])
-
-                        # Calculate the user's total stake
-                        user_stake = sum(stake for addr, stake in nominators if addr in user_addresses)
-
-                        # Calculate dollar value
-                        dollar_value = user_stake * price
-
-                        parsed_data.append({
-                            'timestamp': timestamp,
-                            'block_number': int(block_number),
-                            'user_stake': user_stake,
-                            'dollar_value': dollar_value
-                        })
+        for row in range(len(table.blocks)):
+            # Snapshots logged without a price can't be valued
+            price = table.prices[row]
+            if np.isnan(price):
+                continue
+
+            user_stake = float(user_stakes[row])
+            parsed_data.append({
+                'timestamp': to_datetime(table.timestamps[row]),
+                'block_number': int(table.blocks[row]),
+                'user_stake': user_stake,
+                'dollar_value': user_stake * float(price)
+            })
 
         return parsed_data
 
@@ -99,8 +79,8 @@ def plot_user_stake_and_value(user_name, delegate_info_log_path, user_data_path)
             filtered_user_data.append(entry)
             first_non_zero_found = True
 
-    # Convert timestamps to datetime objects and prepare data for plotting
-    timestamps = [datetime.datetime.strptime(entry['timestamp'], '%Y-%m-%d %H:%M:%S') for entry in filtered_user_data]
+    # Prepare data for plotting
+    timestamps = [entry['timestamp'] for entry in filtered_user_data]
     user_stakes = [entry['user_stake'] for entry in filtered_user_data]
     dollar_values = [entry['dollar_value'] for entry in filtered_user_data]
 
@@ -134,84 +114,55 @@ def plot_user_stake_and_value(user_name, delegate_info_log_path, user_data_path)
 
     plt.show()
 
-def plot_user_apr_over_time(user_name, delegate_info_log_path, user_data_path, referral_data_path):
-    # Process the referral structure from the CSV
-    def process_referral_structure(referral_data):
-        referral_structure = {}
-        for row in referral_data.itertuples(index=False):
-            layer, referrer, tax, *referees = row
-            tax = float(tax)
-            referees = [r for r in referees if r]
-            if layer not in referral_structure:
-                referral_structure[layer] = {}
-            referral_structure[layer][referrer] = {'Tax': tax, 'Referees': referees}
-        return referral_structure
-    # Function to calculate base and adjusted percent
-    def calculate_base_and_adjusted_percent(username, user_data, delegate_info, referral_structure):
-        def calculate_base_percent(user, nominators_percent):
-            user_addresses = user_data.get(user, [])
-            return sum(percent for address, percent in nominators_percent if address in user_addresses)
-
-        nominators_percent = delegate_info.get('nominators_percent', [])
-        all_base_percents = {user: calculate_base_percent(user, nominators_percent) for user in user_data}
-
-        def calculate_adjusted_percent(user, referral_structure):
-            if user not in referral_structure['L1']:
-                return all_base_percents.get(user, 0.0)
-            else:
-                tax = referral_structure['L1'][user]['Tax']
-                total_tax_collected = sum(calculate_adjusted_percent(referee, referral_structure) * tax for referee in referral_structure['L1'][user]['Referees'])
-                return all_base_percents.get(user, 0.0) + total_tax_collected
-
-        adjusted_percent = calculate_adjusted_percent(username, referral_structure)
-        base_percent = all_base_percents.get(username, 0.0)
-
-        return base_percent, adjusted_percent
-
-    # Function to parse the delegate info log and extract necessary data
-    def parse_delegate_info_log_for_user(file_path, user_addresses, referral_structure):
-        parsed_data = []
-        with open(file_path, 'r') as file:
-            for line in file:
-                json_match = re.search(r'\{.*\}', line)
-                timestamp_match = re.search(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', line)
-                
-                if json_match and timestamp_match:
-                    timestamp = datetime.datetime.strptime(timestamp_match.group(), '%Y-%m-%d %H:%M:%S')
-                    json_data = json.loads(json_match.group())
-
-                    total_stake = json_data.get('total_stake', 0)
-                    total_daily_return = json_data.get('total_daily_return', 0)
-                    apr = (total_daily_return / total_stake) * 365 if total_stake else 0
-                    take = json_data.get('take', 0)
-
-                    # Calculate base_percent and adjusted_percent for each log entry
-                    base_percent, adjusted_percent = calculate_base_and_adjusted_percent(user_name, user_data, json_data, referral_structure)
-
-                    # Calculate user APR based on the formula
-                    if base_percent > 0:
-                        user_apr = apr * (take * (adjusted_percent - base_percent) / base_percent + 1)
-                    else:
-                        user_apr = 0
-
-                    parsed_data.append({
-                        'timestamp': timestamp,
-                        'user_apr': user_apr
-                    })
-
-        return parsed_data
+def plot_user_apr_over_time(user_name, delegate_info_log_path, user_data_path, referral_data_path, workers=None):
+    # Function to parse the snapshot table and extract necessary data
+    def parse_delegate_info_log_for_user(file_path, user_addresses, referral_graph):
+        table = load_snapshot_table(file_path, workers=workers)
+
+        # Sum every user's nominator percents per snapshot, grouping the address columns by user
+        users = list(user_data)
+        user_ids = {user: user_id for user_id, user in enumerate(users)}
+        column_users = np.full(len(table.addresses), -1, dtype=np.int64)
+        for address, column in table.address_ids.items():
+            user = address_index.get(address)
+            if user is not None:
+                column_users[column] = user_ids[user]
+        user_percents = get_group_percents(table, column_users, len(users))
+
+        # The referral taxes of every snapshot are applied at once, one column per snapshot
+        snapshot_count = len(table.blocks)
+        if user_name in user_ids:
+            base_percents = user_percents[:, user_ids[user_name]]
+            adjusted_percents = apply_referral_taxes_array(referral_graph, users, user_percents.T)[user_ids[user_name]]
+        else:
+            base_percents = adjusted_percents = np.zeros(snapshot_count)
+
+        total_stakes = np.nan_to_num(table.total_stake)
+        total_daily_returns = np.nan_to_num(table.total_daily_return)
+        takes = np.nan_to_num(table.take)
+        aprs = np.divide(total_daily_returns * 365, total_stakes, out=np.zeros(snapshot_count), where=total_stakes != 0)
+
+        # Calculate user APR based on the formula, for snapshots where the user has a base percent
+        user_aprs = np.zeros(snapshot_count)
+        staked = base_percents > 0
+        user_aprs[staked] = aprs[staked] * (takes[staked] * (adjusted_percents[staked] - base_percents[staked]) / base_percents[staked] + 1)
+
+        return [
+            {'timestamp': timestamp, 'user_apr': user_apr}
+            for timestamp, user_apr in zip(get_datetimes(table), user_aprs.tolist())
+        ]
 
 
     # Load user data and referral structure
     with open(user_data_path, 'r') as file:
         user_data = json.load(file)
     user_addresses = user_data.get(user_name, [])
+    address_index = build_address_index(user_data)
 
-    referral_data = pd.read_csv(referral_data_path)
-    referral_structure = process_referral_structure(referral_data)
+    referral_graph = load_referral_graph(referral_data_path)
 
     # Parse the delegate_info.log file for the given user
-    user_apr_data = parse_delegate_info_log_for_user(delegate_info_log_path, user_addresses, referral_structure)
+    user_apr_data = parse_delegate_info_log_for_user(delegate_info_log_path, user_addresses, referral_graph)
 
     # New: Filter out entries with zero APR until the first non-zero APR is found
     first_non_zero_found = False
@@ -0,0 +1,232 @@
+import csv
+import hashlib
+import logging
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from .snapshot_data import get_store_path, get_hotkey_snapshot_path
+
+logger = logging.getLogger(__name__)
+
+# Column of every field in the two payout histories. The recipient is what payments are
+# looked up by: the user name in payout_log.csv (written by payout.py, with a header line)
+# and the address in payment_history.log (written by nominator_payout.py).
+PAYOUT_LOG_COLUMNS = {'recipient': 0, 'address': 1, 'amount': 2, 'start_block': 3, 'end_block': 4, 'payout_pool_total': 5}
+PAYMENT_HISTORY_COLUMNS = {'start_block': 0, 'end_block': 1, 'recipient': 2, 'address': 2, 'amount': 3}
+
+# Every complete line of a history is indexed at '<history>.index', one fixed-width entry per
+# line, appended as the history grows. key is a 64-bit hash of the line's recipient. Lines of
+# one payout run are consecutive and share their start and end block.
+INDEX_SUFFIX = '.index'
+INDEX_DTYPE = np.dtype([
+    ('start_block', '<i8'),
+    ('end_block', '<i8'),
+    ('key', '<i8'),
+    ('offset', '<i8'),
+])
+
+TAIL_CHUNK_SIZE = 4096
+
+# The files of one kind of payout: the snapshot store it is calculated from, the history it is
+# logged to and the journal its transfers are recorded in
+PayoutPaths = namedtuple('PayoutPaths', ['snapshot_path', 'history_path', 'journal_path'])
+
+def get_payout_paths(default_paths, hotkey_ss58_address=None):
+    """
+    The files of payouts for a hotkey. The hotkey logged to the default store (see
+    snapshot_data.get_store_path) keeps default_paths; any other hotkey has a store, history
+    and journal of its own, named after it like its store.
+    """
+    store_path = get_store_path(default_paths.snapshot_path, hotkey_ss58_address)
+    if store_path == default_paths.snapshot_path:
+        return default_paths
+    return PayoutPaths(store_path, get_hotkey_snapshot_path(default_paths.history_path, hotkey_ss58_address),
+                       get_hotkey_snapshot_path(default_paths.journal_path, hotkey_ss58_address))
+
+def iter_lines_backward(file_path):
+    """
+    Yield the non-empty lines of a file from the last one back, reading backwards from its
+    end in chunks, so the last lines take the same time to read however long the file is.
+    """
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            step = min(TAIL_CHUNK_SIZE, position)
+            position -= step
+            file.seek(position)
+            lines = (file.read(step) + tail).split(b'\n')
+            # The first piece may continue in the previous chunk
+            tail = lines.pop(0)
+            for line in reversed(lines):
+                line = line.rstrip(b'\r')
+                if line:
+                    yield line.decode('utf-8')
+        tail = tail.rstrip(b'\r')
+        if tail:
+            yield tail.decode('utf-8')
+
+def read_last_line(file_path):
+    """Return the last non-empty line of a file, or None if there is none."""
+    return next(iter_lines_backward(file_path), None)
+
+def _parse_line(line, columns):
+    """Split a history line into its fields. Return None for the header and malformed lines."""
+    row = next(csv.reader([line]), [])
+    try:
+        return {
+            field: int(row[column]) if field in ('start_block', 'end_block') else row[column]
+            for field, column in columns.items()
+        }
+    except (IndexError, ValueError):
+        return None
+
+def get_last_paid_block(file_path, columns):
+    """
+    Return the end block of the latest payout in a history, or None if nothing was paid yet.
+    A torn last line (a crash mid-write) is skipped, as is the header.
+    """
+    for line in iter_lines_backward(file_path):
+        entry = _parse_line(line, columns)
+        if entry is not None:
+            return entry['end_block']
+    return None
+
+def _recipient_key(recipient):
+    return int.from_bytes(hashlib.blake2b(recipient.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+def load_index(file_path):
+    """Memory-map a history's index. Return an empty array if there is none."""
+    index_path = file_path + INDEX_SUFFIX
+    # A torn entry at the end (a crash mid-write) is ignored
+    count = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+    if count == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+
+def _read_line_at(file, offset):
+    file.seek(offset)
+    return file.readline().decode('utf-8')
+
+def update_index(file_path, columns):
+    """
+    Indexes the lines appended to a history since its index was last updated.
+
+    The index is rebuilt from scratch if the last indexed line no longer matches the
+    history, e.g. after the history was edited by hand.
+
+    :return: The memory-mapped index.
+    """
+    index_path = file_path + INDEX_SUFFIX
+    if not os.path.exists(file_path):
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+    index = load_index(file_path)
+    rebuilding = False
+    with open(file_path, 'rb') as file:
+        start = 0
+        if len(index):
+            last = index[-1]
+            entry = _parse_line(_read_line_at(file, int(last['offset'])), columns)
+            if (entry is not None and entry['start_block'] == last['start_block'] and entry['end_block'] == last['end_block']
+                    and _recipient_key(entry['recipient']) == last['key']):
+                # Resume after the last indexed line
+                start = file.tell()
+            else:
+                logger.error(f"Payout history {file_path} no longer matches its index; rebuilding the index.")
+                index = np.zeros(0, dtype=INDEX_DTYPE)
+                rebuilding = True
+
+        entries = []
+        file.seek(start)
+        offset = start
+        for line in iter(file.readline, b''):
+            # A line without its newline may still be being written
+            if not line.endswith(b'\n'):
+                break
+            entry = _parse_line(line.decode('utf-8'), columns)
+            if entry is not None:
+                entries.append((entry['start_block'], entry['end_block'], _recipient_key(entry['recipient']), offset))
+            offset += len(line)
+
+    if entries or rebuilding:
+        # A torn entry left by a crash is cut off before appending
+        with open(index_path, 'ab' if start else 'wb') as index_file:
+            if start:
+                index_file.truncate(len(index) * INDEX_DTYPE.itemsize)
+            index_file.write(np.array(entries, dtype=INDEX_DTYPE).tobytes())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+    return load_index(file_path)
+
+def list_payout_runs(file_path, columns):
+    """
+    Lists the payout runs in a history from its index, oldest first.
+
+    :return: List of dictionaries with 'start_block', 'end_block', 'recipients' (the number
+        of lines of the run) and 'offset' (of its first line).
+    """
+    index = update_index(file_path, columns)
+    if len(index) == 0:
+        return []
+    blocks = np.stack((index['start_block'], index['end_block']), axis=1)
+    starts = np.concatenate(([0], np.flatnonzero(np.any(blocks[1:] != blocks[:-1], axis=1)) + 1))
+    counts = np.diff(np.append(starts, len(index)))
+    return [
+        {'start_block': int(index[start]['start_block']), 'end_block': int(index[start]['end_block']),
+         'recipients': int(count), 'offset': int(index[start]['offset'])}
+        for start, count in zip(starts.tolist(), counts.tolist())
+    ]
+
+def load_payout_run(file_path, columns, run):
+    """Read the lines of one run (as returned by list_payout_runs), seeking straight to it."""
+    with open(file_path, 'rb') as file:
+        file.seek(run['offset'])
+        return [_parse_line(file.readline().decode('utf-8'), columns) for _ in range(run['recipients'])]
+
+def get_payment_history(file_path, columns, recipient):
+    """
+    Every payment to a recipient (user name or address, see the column layouts), oldest first.
+
+    Matching lines are found with a vectorized scan of the index's recipient hashes, and only
+    those lines are read from the history.
+
+    :return: List of dictionaries of the fields of each matching line.
+    """
+    index = update_index(file_path, columns)
+    positions = np.flatnonzero(index['key'] == _recipient_key(recipient))
+    payments = []
+    if len(positions) == 0:
+        return payments
+    with open(file_path, 'rb') as file:
+        for offset in index['offset'][positions].tolist():
+            entry = _parse_line(_read_line_at(file, offset), columns)
+            # Guard against hash collisions
+            if entry is not None and entry['recipient'] == recipient:
+                payments.append(entry)
+    return payments
+
+def main():
+    base_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    payout_log_path = os.path.join(base_directory, 'logs', 'payout_log.csv')
+
+    if len(sys.argv) > 1:
+        user_name = sys.argv[1]
+        payments = get_payment_history(payout_log_path, PAYOUT_LOG_COLUMNS, user_name)
+        print(f"{len(payments)} payments to {user_name}:")
+        for payment in payments:
+            print(f"  Blocks {payment['start_block']}-{payment['end_block']}: {payment['amount']} to {payment['address']}")
+        return
+
+    runs = list_payout_runs(payout_log_path, PAYOUT_LOG_COLUMNS)
+    print(f"{len(runs)} payout runs in {payout_log_path}:")
+    for run in runs:
+        print(f"  Blocks {run['start_block']}-{run['end_block']}: {run['recipients']} recipients")
+
+if __name__ == "__main__":
+    main()
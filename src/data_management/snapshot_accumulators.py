@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from .snapshot_codec import KEYFRAME_INTERVAL
+from .snapshot_data import iter_snapshots, load_index
+
+logger = logging.getLogger(__name__)
+
+# Running accumulators of the store's nominator percents, at '<store>.accum': raw float64 rows,
+# one for every ROW_INTERVAL-th snapshot in store order (snapshots 0, ROW_INTERVAL, ...).
+# Column 0 is the snapshot's block, and column 1 + c holds
+#     P[k, c] = sum over i < k of (b[i+1] - b[i]) * percent[i, c]
+# i.e. address c's percent summed over every block before snapshot k, each snapshot holding
+# until the next one. The sums at the snapshots in between are recovered from the row before
+# them and the percents of the few snapshots that follow it, read from the store. Rows are
+# 1 + capacity wide; the capacity doubles as addresses appear.
+# '<store>.accum.json' holds the row count, the capacity, the address of every column, and the
+# number of snapshots accumulated with the block, sums and percents of the last of them (its
+# percents hold past its block).
+ACCUMULATOR_SUFFIX = '.accum'
+ACCUMULATOR_META_SUFFIX = '.accum.json'
+INITIAL_CAPACITY = 256
+# Rows are kept at the store's keyframe interval, so recovering the sums at a snapshot decodes
+# about as many snapshots as seeking to it in the store does
+ROW_INTERVAL = KEYFRAME_INTERVAL
+# Readers map the rows again when they were widened while being mapped, at most this many
+# times before falling back to the store
+MAP_ATTEMPTS = 3
+
+def get_accumulator_paths(file_path):
+    return file_path + ACCUMULATOR_SUFFIX, file_path + ACCUMULATOR_META_SUFFIX
+
+def _load_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Ignoring unreadable snapshot accumulator metadata {meta_path}: {e}")
+        return None
+
+def _save_meta(meta, meta_path):
+    temp_path = meta_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file, separators=(',', ':'))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, meta_path)
+
+def _map_rows(accumulator_path, meta, mode='r'):
+    """Memory-map the rows the metadata vouches for; anything past them is a torn or abandoned write."""
+    width = 1 + meta['capacity']
+    available = os.path.getsize(accumulator_path) // (8 * width) if os.path.exists(accumulator_path) else 0
+    rows = min(meta['rows'], available)
+    if rows == 0:
+        return np.zeros((0, width), dtype=np.float64)
+    return np.memmap(accumulator_path, dtype=np.float64, mode=mode, shape=(rows, width))
+
+def _widen(accumulator_path, rows, old_capacity, capacity):
+    """Rewrite the first rows with room for `capacity` addresses, padding with zeros."""
+    temp_path = accumulator_path + '.tmp'
+    old = np.memmap(accumulator_path, dtype=np.float64, mode='r', shape=(rows, 1 + old_capacity)) if rows else None
+    with open(temp_path, 'wb') as file:
+        for start in range(0, rows, 4096):
+            part = np.zeros((min(4096, rows - start), 1 + capacity), dtype=np.float64)
+            part[:, :1 + old_capacity] = old[start:start + len(part)]
+            file.write(part.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    del old
+    os.replace(temp_path, accumulator_path)
+
+def _state_matches(meta, index_blocks):
+    """Whether the metadata's last accumulated snapshot is still the one the index has at its position."""
+    count = meta.get('snapshots')
+    if count is None or count > len(index_blocks) or meta['rows'] != -(-count // ROW_INTERVAL):
+        return False
+    return meta.get('last_block') == (int(index_blocks[count - 1]) if count else None)
+
+def _get_percents(record, address_ids, width):
+    """The record's percents as an array aligned with the accumulator columns."""
+    values = np.zeros(width, dtype=np.float64)
+    percents = record['nominators_percent']
+    if percents:
+        columns = np.fromiter((address_ids[address] for address, _ in percents), dtype=np.int64, count=len(percents))
+        values[columns] = [value for _, value in percents]
+    return values
+
+def update_accumulators(file_path):
+    """
+    Brings the store's accumulators up to date with its index.
+
+    Only snapshots past the last accumulated one are read. Rows from the first snapshot whose
+    block no longer matches the index (a merge inserted earlier blocks) are recomputed. Meant
+    to be called by the store's single writer, i.e. the logger, after it changes the store.
+
+    :param file_path: Path to the snapshot store.
+    :return: The number of rows written.
+    """
+    accumulator_path, meta_path = get_accumulator_paths(file_path)
+    index_blocks = np.asarray(load_index(file_path)['block'])
+    meta = _load_meta(meta_path)
+    if meta is None:
+        meta = {'rows': 0, 'capacity': INITIAL_CAPACITY, 'addresses': []}
+
+    # Keep the leading rows whose blocks still match the index
+    rows = _map_rows(accumulator_path, meta)
+    row_blocks = index_blocks[::ROW_INTERVAL]
+    kept = min(len(rows), len(row_blocks))
+    mismatched = np.flatnonzero(rows[:kept, 0] != row_blocks[:kept])
+    if len(mismatched):
+        kept = int(mismatched[0])
+
+    address_ids = {address: column for column, address in enumerate(meta['addresses'])}
+    capacity = meta['capacity']
+    cumulative = np.zeros(capacity, dtype=np.float64)
+    values = np.zeros(capacity, dtype=np.float64)
+    if kept == len(rows) == meta['rows'] and _state_matches(meta, index_blocks):
+        # Every row and the last accumulated snapshot still match the store
+        count = meta['snapshots']
+        if count == len(index_blocks):
+            return 0
+        last_block = meta['last_block']
+        cumulative[:len(meta['cumulative'])] = meta['cumulative']
+        values[:len(meta['values'])] = meta['values']
+        snapshots = iter_snapshots(file_path, start_block=last_block + 1)
+    elif kept:
+        # Continue from the last kept row, whose snapshot's percents are read back from the store
+        count = (kept - 1) * ROW_INTERVAL + 1
+        last_block = int(rows[kept - 1, 0])
+        cumulative = np.array(rows[kept - 1, 1:])
+        snapshots = iter_snapshots(file_path, start_block=last_block)
+    else:
+        count = 0
+        last_block = None
+        snapshots = iter_snapshots(file_path)
+    del rows
+
+    written = 0
+    mode = 'r+b' if os.path.exists(accumulator_path) else 'w+b'
+    file = open(accumulator_path, mode)
+    try:
+        file.truncate(kept * 8 * (1 + capacity))
+        file.seek(0, os.SEEK_END)
+        for record in snapshots:
+            block = record['block']
+            for address, _ in record['nominators_percent']:
+                if address not in address_ids:
+                    address_ids[address] = len(address_ids)
+
+            if len(address_ids) > capacity:
+                new_capacity = capacity
+                while new_capacity < len(address_ids):
+                    new_capacity *= 2
+                file.close()
+                _widen(accumulator_path, kept + written, capacity, new_capacity)
+                # The rows now have the new width, so the metadata has to follow before anything
+                # else. It vouches for the rows only, so an interrupted update resumes from them.
+                _save_meta({'rows': kept + written, 'capacity': new_capacity, 'addresses': list(address_ids)}, meta_path)
+                file = open(accumulator_path, 'r+b')
+                file.seek(0, os.SEEK_END)
+                cumulative = np.concatenate((cumulative, np.zeros(new_capacity - capacity)))
+                values = np.concatenate((values, np.zeros(new_capacity - capacity)))
+                capacity = new_capacity
+
+            # The snapshot of the row continued from, read back for its percents, is accumulated already
+            if block != last_block:
+                if last_block is not None:
+                    cumulative += (block - last_block) * values
+                if count % ROW_INTERVAL == 0:
+                    file.write(np.concatenate(([block], cumulative)).tobytes())
+                    written += 1
+                count += 1
+
+            values = _get_percents(record, address_ids, capacity)
+            last_block = block
+        file.flush()
+        os.fsync(file.fileno())
+    finally:
+        file.close()
+
+    addresses = list(address_ids)
+    _save_meta({
+        'rows': kept + written,
+        'capacity': capacity,
+        'addresses': addresses,
+        'snapshots': count,
+        'last_block': last_block,
+        'cumulative': cumulative[:len(addresses)].tolist(),
+        'values': values[:len(addresses)].tolist(),
+    }, meta_path)
+    return written
+
+def _sum_before(file_path, row_blocks, prefix, address_ids, block):
+    """
+    Percents summed over every block before a block, from the row at or before it and the
+    snapshots after the row's, read from the store. Return None if the store changed since the
+    row was written.
+    """
+    row = int(np.searchsorted(row_blocks, block, side='right')) - 1
+    sums = np.array(prefix[row])
+    last_block = None
+    try:
+        for record in iter_snapshots(file_path, start_block=int(row_blocks[row]), end_block=block - 1):
+            if last_block is not None:
+                sums += (record['block'] - last_block) * values
+            elif record['block'] != row_blocks[row]:
+                return None
+            values = _get_percents(record, address_ids, len(sums))
+            last_block = record['block']
+    except KeyError:
+        # An address the accumulators haven't seen
+        return None
+    if last_block is not None:
+        sums += (block - last_block) * values
+    return sums
+
+def get_ranges_averages(file_path, start_blocks, end_blocks):
+    """
+    Block-weighted average percent of every address over several ranges, from the
+    accumulators, each as a difference of two prefix sums. Reads a row and at most
+    ROW_INTERVAL snapshots per range end whatever the range's length.
+
+    Equal to stake_matrix.average_address_percents over the same snapshots, including the
+    one in effect at each start block.
+
+    :param start_blocks: First block of every range.
+    :param end_blocks: Last block of every range.
+    :return: (addresses, averages) with averages a float64 array of shape (ranges, addresses),
+        or None if the accumulators don't reach the last end block yet (see update_accumulators).
+    """
+    accumulator_path, meta_path = get_accumulator_paths(file_path)
+    for _ in range(MAP_ATTEMPTS):
+        meta = _load_meta(meta_path)
+        if meta is None or not meta.get('snapshots'):
+            return None
+        rows = _map_rows(accumulator_path, meta)
+        # The rows are rewritten when they are widened, so the metadata is checked again
+        current = _load_meta(meta_path)
+        if current is not None and current['capacity'] == meta['capacity']:
+            break
+    else:
+        logger.info(f"Snapshot accumulators of {file_path} kept being widened while mapping them; reading the store instead")
+        return None
+    end_blocks = np.asarray(end_blocks, dtype=np.int64)
+    if len(rows) < meta['rows'] or (len(end_blocks) and meta['last_block'] < end_blocks.max()):
+        return None
+    # Snapshots merged in before the last accumulated one move the rows off their snapshots
+    index_blocks = np.asarray(load_index(file_path)['block'])
+    if not _state_matches(meta, index_blocks) or np.any(rows[:, 0] != index_blocks[::ROW_INTERVAL][:len(rows)]):
+        return None
+
+    addresses = meta['addresses']
+    address_ids = {address: column for column, address in enumerate(addresses)}
+    row_blocks = np.array(rows[:, 0], dtype=np.int64)
+    prefix = rows[:, 1:1 + len(addresses)]
+    cumulative = np.zeros(len(addresses), dtype=np.float64)
+    cumulative[:len(meta['cumulative'])] = meta['cumulative']
+    last_values = np.zeros(len(addresses), dtype=np.float64)
+    last_values[:len(meta['values'])] = meta['values']
+    first_block, last_block = int(row_blocks[0]), meta['last_block']
+
+    # Sums before the first block of every range and after its last, start blocks first
+    blocks = np.concatenate((np.asarray(start_blocks, dtype=np.int64), end_blocks + 1))
+    sums = np.zeros((len(blocks), len(addresses)), dtype=np.float64)
+    for position, block in enumerate(blocks.tolist()):
+        if block <= first_block:
+            continue
+        if block > last_block:
+            # Past the last snapshot its own percents hold
+            sums[position] = cumulative + (block - last_block) * last_values
+            continue
+        block_sums = _sum_before(file_path, row_blocks, prefix, address_ids, block)
+        if block_sums is None:
+            return None
+        sums[position] = block_sums
+    del rows
+
+    weights = np.maximum(blocks - first_block, 0)
+    ranges = len(end_blocks)
+    range_weights = (weights[ranges:] - weights[:ranges])[:, None]
+    averages = (sums[ranges:] - sums[:ranges]) / np.maximum(range_weights, 1)
+    return addresses, np.where(range_weights > 0, averages, 0.0)
+
+def get_range_averages(file_path, start_block, end_block):
+    """
+    Block-weighted average percent of every address over [start_block, end_block], from the
+    accumulators (see get_ranges_averages).
+
+    :return: (addresses, averages) with averages a float64 array aligned with addresses, or
+        None if the accumulators don't reach end_block yet.
+    """
+    range_averages = get_ranges_averages(file_path, [start_block], [end_block])
+    if range_averages is None:
+        return None
+    addresses, averages = range_averages
+    return addresses, averages[0]
+
+def main():
+    base_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    snapshot_path = os.path.join(base_directory, 'logs', 'delegate_snapshots.jsonl')
+    written = update_accumulators(snapshot_path)
+    print(f"Accumulated {written} snapshots of {snapshot_path}.")
+
+if __name__ == "__main__":
+    main()
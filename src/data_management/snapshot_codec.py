@@ -0,0 +1,249 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+RAO_PER_TAO = 10 ** 9
+
+# Addresses are interned in a dictionary file next to the store: line n holds the address with id n.
+ADDRESS_BOOK_SUFFIX = '.addresses'
+
+# Every this many records the store holds a keyframe with all stakes; the rest are deltas.
+KEYFRAME_INTERVAL = 24
+
+# Short keys of a compact record and the snapshot fields they hold. Stakes are stored in rao,
+# see SnapshotEncoder. nominators_percent is not stored at all and is derived from the stakes
+# when the record is decoded.
+COMPACT_FIELDS = {
+    't': 'timestamp',
+    'b': 'block',
+    'p': 'price',
+    'tk': 'take',
+    'vp': 'validator_permits',
+    'rg': 'registrations',
+    'r1': 'return_per_1000',
+    'dr': 'total_daily_return',
+}
+
+def tao_to_rao(amount):
+    """
+    Convert a tao amount (str, Decimal, int or float) to an integer number of rao.
+
+    Strings and Decimals are converted exactly; floats go through their shortest repr, so
+    0.1 becomes exactly 100000000 rao. Fractions of a rao are rounded half to even.
+
+    :raises ValueError: If the amount is not a finite number.
+    """
+    try:
+        rao = Decimal(str(amount)).scaleb(9)
+        return int(rao.to_integral_value(rounding=ROUND_HALF_EVEN))
+    except (InvalidOperation, ValueError, OverflowError):
+        raise ValueError(f"Invalid tao amount: {amount!r}")
+
+def rao_to_tao(amount_rao):
+    return amount_rao / RAO_PER_TAO
+
+class AddressBook:
+    """
+    Append-only dictionary of address <-> integer id, stored one address per line.
+
+    New addresses are written (and fsynced) before any record using them, so a reader that
+    meets an unknown id only has to reload the file. Writers hold an exclusive lock on the
+    file while assigning ids, so the logger and a backfill can add addresses at the same time.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.addresses = []
+        self.ids = {}
+        self.offset = 0
+        self.refresh()
+
+    def refresh(self):
+        """Load addresses appended to the file since it was last read."""
+        if not os.path.exists(self.file_path):
+            return
+        with open(self.file_path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            address = line.decode('utf-8')
+            self.ids[address] = len(self.addresses)
+            self.addresses.append(address)
+        self.offset += end
+
+    def address(self, address_id):
+        if address_id >= len(self.addresses):
+            self.refresh()
+        return self.addresses[address_id]
+
+    def get_id(self, address, new_addresses):
+        """Return the id of an address, assigning a new one (collected in new_addresses) if needed."""
+        address_id = self.ids.get(address)
+        if address_id is None:
+            address_id = self.ids[address] = len(self.addresses)
+            self.addresses.append(address)
+            new_addresses.append(address)
+        return address_id
+
+    @contextmanager
+    def writing(self):
+        """
+        Lock the file for assigning ids. Yields a list to collect new addresses in; they are
+        written when the block exits.
+        """
+        with open(self.file_path, 'ab') as file:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            try:
+                # Pick up ids another process assigned since we last read the file
+                self.refresh()
+                new_addresses = []
+                try:
+                    yield new_addresses
+                except BaseException:
+                    # Forget ids that were never written
+                    for address in new_addresses:
+                        del self.ids[address]
+                    del self.addresses[len(self.addresses) - len(new_addresses):]
+                    raise
+                if new_addresses:
+                    data = ''.join(address + '\n' for address in new_addresses).encode('utf-8')
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                    self.offset += len(data)
+            finally:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+_address_books = {}
+
+def get_address_book(file_path):
+    """Return the (cached) address book of the snapshot store at file_path."""
+    book_path = file_path + ADDRESS_BOOK_SUFFIX
+    book = _address_books.get(book_path)
+    if book is None or not os.path.exists(book_path) and book.addresses:
+        book = _address_books[book_path] = AddressBook(book_path)
+    return book
+
+def _compact_header(record, book, new_addresses):
+    compact = {key: record[field] for key, field in COMPACT_FIELDS.items()}
+    compact['h'] = book.get_id(record['hotkey_ss58'], new_addresses) if record['hotkey_ss58'] else None
+    compact['o'] = book.get_id(record['owner_ss58'], new_addresses) if record['owner_ss58'] else None
+    compact['ts'] = tao_to_rao(record['total_stake'] or 0)
+    compact['ds'] = tao_to_rao(record['delegate_stake'] or 0)
+    return compact
+
+def is_keyframe(parsed):
+    """Keyframes (and plain JSON records) can be decoded without any earlier record."""
+    return 'u' not in parsed
+
+class SnapshotEncoder:
+    """
+    Serializes consecutive snapshot records of one store to compact lines.
+
+    Every keyframe_interval-th record is a keyframe holding all stakes ('n'). The records in
+    between are deltas against the previous record: 'u' holds the [id, rao, ...] pairs that
+    changed or were added and 'x' the ids that were removed. A delta that wouldn't be smaller
+    than a keyframe is written as a keyframe instead.
+
+    :param book: The store's AddressBook.
+    :param stakes: Dictionary of id -> rao of the store's last record, or None to start with a
+        keyframe.
+    :param since_keyframe: Number of deltas written since the last keyframe.
+    """
+
+    def __init__(self, book, stakes=None, since_keyframe=0, keyframe_interval=KEYFRAME_INTERVAL):
+        self.book = book
+        self.stakes = stakes
+        self.since_keyframe = since_keyframe
+        self.keyframe_interval = keyframe_interval
+
+    def encode(self, record):
+        """Serialize a record, adding new addresses to the book. Return the line, including its newline."""
+        with self.book.writing() as new_addresses:
+            compact = _compact_header(record, self.book, new_addresses)
+            stakes = {}
+            for address, stake in record['nominators'] or ():
+                stakes[self.book.get_id(address, new_addresses)] = tao_to_rao(stake)
+
+        previous = self.stakes
+        if previous is not None and self.since_keyframe + 1 < self.keyframe_interval:
+            updates = [item for address_id, rao in stakes.items() if previous.get(address_id) != rao for item in (address_id, rao)]
+            removed = [address_id for address_id in previous if address_id not in stakes]
+            if len(updates) // 2 + len(removed) < len(stakes):
+                compact['u'] = updates
+                compact['x'] = removed
+                self.since_keyframe += 1
+
+        if 'u' not in compact:
+            compact['n'] = [item for address_id, rao in stakes.items() for item in (address_id, rao)]
+            self.since_keyframe = 0
+
+        self.stakes = stakes
+        return json.dumps(compact, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+class SnapshotDecoder:
+    """
+    Decodes consecutive lines of one store, tracking the stakes that deltas apply to.
+
+    decode() is cheap: it parses a line and updates the running stakes. materialize() builds
+    the full snapshot record and is only needed for records the caller keeps.
+
+    :param book: The store's AddressBook.
+    :param stakes: Running stakes (id -> rao) when resuming in the middle of a store.
+    """
+
+    def __init__(self, book, stakes=None):
+        self.book = book
+        self.stakes = stakes
+
+    def decode(self, line):
+        """
+        Parse one store line and apply it to the running stakes.
+
+        :return: The parsed line, to pass to materialize().
+        :raises ValueError: If the line is malformed, or is a delta with no keyframe before it.
+        """
+        parsed = json.loads(line)
+        if 'n' in parsed:
+            flat = parsed['n']
+            self.stakes = dict(zip(flat[::2], flat[1::2]))
+        elif 'u' in parsed:
+            if self.stakes is None:
+                raise ValueError(f"Delta snapshot for block {parsed['b']} has no keyframe before it")
+            flat = parsed['u']
+            self.stakes.update(zip(flat[::2], flat[1::2]))
+            for address_id in parsed['x']:
+                del self.stakes[address_id]
+        else:
+            # Plain JSON record written before the compact encoding
+            self.stakes = None
+        return parsed
+
+    def materialize(self, parsed):
+        """Expand the line last passed to decode() into a full snapshot record."""
+        if 'n' not in parsed and 'u' not in parsed:
+            return parsed
+
+        book = self.book
+        record = {field: parsed[key] for key, field in COMPACT_FIELDS.items()}
+        record['hotkey_ss58'] = book.address(parsed['h']) if parsed['h'] is not None else None
+        record['owner_ss58'] = book.address(parsed['o']) if parsed['o'] is not None else None
+        total_stake = rao_to_tao(parsed['ts'])
+        delegate_stake = rao_to_tao(parsed['ds'])
+        record['total_stake'] = total_stake
+        record['delegate_stake'] = delegate_stake
+
+        remaining_stake = total_stake - delegate_stake
+        nominators = []
+        nominators_percent = []
+        for address_id, rao in self.stakes.items():
+            address = book.address(address_id)
+            stake = rao_to_tao(rao)
+            nominators.append((address, stake))
+            nominators_percent.append((address, stake / remaining_stake if remaining_stake > 0 else 0))
+        record['nominators'] = nominators
+        record['nominators_percent'] = nominators_percent
+        return record
@@ -0,0 +1,680 @@
+import calendar
+import fcntl
+import heapq
+import json
+import logging
+import mmap
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+from .snapshot_codec import get_address_book, is_keyframe, SnapshotEncoder, SnapshotDecoder
+
+logger = logging.getLogger(__name__)
+
+# Every record in the snapshot store carries exactly these keys, one JSON object per line.
+SNAPSHOT_FIELDS = (
+    'timestamp',
+    'block',
+    'price',
+    'hotkey_ss58',
+    'total_stake',
+    'nominators',
+    'nominators_percent',
+    'owner_ss58',
+    'delegate_stake',
+    'take',
+    'validator_permits',
+    'registrations',
+    'return_per_1000',
+    'total_daily_return',
+)
+
+# The store is split into segments. Records are appended to the active segment, which lives at
+# the store path itself. Once it holds SEGMENT_RECORDS records it is sealed by renaming it to
+# '<root>.<segment number><ext>' (e.g. delegate_snapshots.000003.jsonl) and never written
+# again. Every segment starts with a keyframe, so each can be decoded on its own.
+SEGMENT_RECORDS = 720
+SEGMENT_NUMBER_DIGITS = 6
+
+# Sidecar index at '<store>.index': one fixed-size entry per record, in block order, with the
+# record's block, timestamp (epoch seconds), segment, byte offset within the segment and the
+# offset of the keyframe it decodes from. It is searched with a binary search on the mapped file.
+INDEX_SUFFIX = '.index'
+INDEX_DTYPE = np.dtype([
+    ('block', '<i8'),
+    ('timestamp', '<i8'),
+    ('segment', '<i8'),
+    ('offset', '<i8'),
+    ('keyframe', '<i8'),
+])
+
+# Writers hold an exclusive lock on '<store>.lock' while changing the store's segments and
+# index, so a merge (e.g. a backfill) never swaps segments under an append of the logger
+LOCK_SUFFIX = '.lock'
+
+# Reads with several worker processes split the range into this many chunks per worker, so a
+# worker that finishes early picks up another chunk
+CHUNKS_PER_WORKER = 4
+
+def build_snapshot_record(timestamp, block, delegate_info, price=None):
+    """
+    Builds a store record from a delegate info dictionary.
+
+    :param timestamp: Snapshot time formatted as '%Y-%m-%d %H:%M:%S' (UTC).
+    :param block: Block number the snapshot was taken at.
+    :param delegate_info: Dictionary produced by the delegate info logger.
+    :param price: Token price at the time of the snapshot, if known.
+    :return: A dictionary with exactly the keys in SNAPSHOT_FIELDS.
+    """
+    record = {field: delegate_info.get(field) for field in SNAPSHOT_FIELDS}
+    record['timestamp'] = timestamp
+    record['block'] = int(block)
+    record['price'] = float(price) if price is not None else None
+    return record
+
+def encode_snapshot(record):
+    """Serialize a snapshot record to a single line of plain JSON (the format before compact encoding)."""
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+def get_hotkey_snapshot_path(file_path, hotkey_ss58_address):
+    """Derive a per-hotkey store path, e.g. delegate_snapshots.jsonl -> delegate_snapshots_<hotkey>.jsonl."""
+    root, extension = os.path.splitext(file_path)
+    return f"{root}_{hotkey_ss58_address}{extension}"
+
+def get_store_path(file_path, hotkey_ss58_address=None):
+    """
+    The snapshot store of a hotkey. The logger keeps one hotkey on the default store file_path
+    and gives every other one a store of its own (see get_hotkey_snapshot_path), so file_path
+    is returned for None and for the hotkey logged to it.
+    """
+    if hotkey_ss58_address is None:
+        return file_path
+    latest_snapshot = load_latest_snapshot(file_path)
+    if latest_snapshot is not None and latest_snapshot['hotkey_ss58'] == hotkey_ss58_address:
+        return file_path
+    return get_hotkey_snapshot_path(file_path, hotkey_ss58_address)
+
+def get_segment_path(file_path, segment):
+    """Path of a sealed segment, e.g. delegate_snapshots.jsonl -> delegate_snapshots.000003.jsonl."""
+    root, extension = os.path.splitext(file_path)
+    return f"{root}.{segment:0{SEGMENT_NUMBER_DIGITS}d}{extension}"
+
+def list_segments(file_path):
+    """
+    Lists the store's segments in block order.
+
+    :param file_path: Path to the snapshot store.
+    :return: List of (segment number, path). The active segment (file_path itself) comes last,
+        numbered one past the last sealed segment, and is only listed if it exists.
+    """
+    directory = os.path.dirname(file_path) or '.'
+    root, extension = os.path.splitext(os.path.basename(file_path))
+    pattern = re.compile(re.escape(root) + r'\.(\d{%d})' % SEGMENT_NUMBER_DIGITS + re.escape(extension) + '$')
+
+    segments = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(directory, name)))
+    segments.sort()
+
+    if os.path.exists(file_path):
+        segments.append((_next_segment(segments), file_path))
+    return segments
+
+def _next_segment(sealed):
+    return sealed[-1][0] + 1 if sealed else 0
+
+def _get_segment_file(segments, segment):
+    """Return the path of a segment number, or None if the store has no such segment."""
+    for number, path in segments:
+        if number == segment:
+            return path
+    return None
+
+def _parse_timestamp(timestamp):
+    """Convert a '%Y-%m-%d %H:%M:%S' UTC timestamp to epoch seconds (0 if it can't be parsed)."""
+    try:
+        return calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+    except (TypeError, ValueError):
+        return 0
+
+def load_index(file_path):
+    """Memory-map the store's index. Return an empty array if there is none."""
+    index_path = file_path + INDEX_SUFFIX
+    # A torn entry at the end (a crash mid-write) is ignored
+    count = os.path.getsize(index_path) // INDEX_DTYPE.itemsize if os.path.exists(index_path) else 0
+    if count == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(count,))
+
+def _append_index_entry(file_path, entry):
+    with open(file_path + INDEX_SUFFIX, 'ab') as file:
+        size = file.tell()
+        if size % INDEX_DTYPE.itemsize:
+            # Drop a torn entry so the entries stay aligned
+            file.truncate(size - size % INDEX_DTYPE.itemsize)
+        file.write(np.array([entry], dtype=INDEX_DTYPE).tobytes())
+
+def rebuild_index(file_path):
+    """Rebuild the store's index by scanning every segment."""
+    entries = []
+    decoder = SnapshotDecoder(get_address_book(file_path))
+    for segment, path in list_segments(file_path):
+        offset = 0
+        keyframe = 0
+        with open(path, 'rb') as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    parsed = decoder.decode(line)
+                    if is_keyframe(parsed):
+                        keyframe = offset
+                    block = parsed['b'] if 'b' in parsed else parsed['block']
+                    timestamp = parsed['t'] if 't' in parsed else parsed['timestamp']
+                    entries.append((block, _parse_timestamp(timestamp), segment, offset, keyframe))
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Skipping malformed snapshot record: {e}")
+                offset += len(line)
+
+    index_path = file_path + INDEX_SUFFIX
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(np.array(entries, dtype=INDEX_DTYPE).tobytes())
+    os.replace(temp_path, index_path)
+
+@contextmanager
+def _locked_store(file_path):
+    """Hold the store's write lock for the duration of the block."""
+    with open(file_path + LOCK_SUFFIX, 'a') as file:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+def _last_keyframe_offset(mapped):
+    """Return the byte offset of the last keyframe in a mapped segment, or 0 if there is none."""
+    end = mapped.rfind(b'\n')
+    while end != -1:
+        start = mapped.rfind(b'\n', 0, end) + 1
+        try:
+            if is_keyframe(json.loads(mapped[start:end])):
+                return start
+        except ValueError as e:
+            logger.error(f"Skipping malformed snapshot record: {e}")
+        end = start - 1
+    return 0
+
+def _read_tail(file_path, decoder):
+    """
+    Decodes a segment from its last keyframe to its end, seeking straight to the keyframe.
+
+    :return: Dictionary with 'last' (the last parsed line, or None if the segment is empty),
+        'offset' (its byte offset), 'keyframe' (offset of the keyframe it decodes from) and
+        'deltas' (number of deltas after that keyframe).
+    """
+    tail = {'last': None, 'offset': 0, 'keyframe': 0, 'deltas': 0}
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return tail
+        with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+            offset = _last_keyframe_offset(mapped)
+            end = mapped.find(b'\n', offset)
+            while end != -1:
+                try:
+                    parsed = decoder.decode(mapped[offset:end])
+                    if is_keyframe(parsed):
+                        tail['keyframe'] = offset
+                        tail['deltas'] = 0
+                    else:
+                        tail['deltas'] += 1
+                    tail['last'] = parsed
+                    tail['offset'] = offset
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Skipping malformed snapshot record: {e}")
+                offset = end + 1
+                end = mapped.find(b'\n', offset)
+    return tail
+
+# Append state of stores this process writes to: the encoder continuing the delta chain, the
+# active segment's number, record count and current keyframe offset, and the (inode, size) the
+# active segment was left at, to notice other writers.
+_store_writers = {}
+
+def _get_store_writer(file_path):
+    """Return the append state of a store, recovering it from the active segment's tail if needed."""
+    stat = os.stat(file_path) if os.path.exists(file_path) else None
+    state = (stat.st_ino, stat.st_size) if stat else None
+    writer = _store_writers.get(file_path)
+    if writer is not None and writer['state'] == state:
+        return writer
+
+    segments = list_segments(file_path)
+    sealed = [(number, path) for number, path in segments if path != file_path]
+    segment = _next_segment(sealed)
+    book = get_address_book(file_path)
+    decoder = SnapshotDecoder(book)
+    tail = _read_tail(file_path, decoder) if stat else {'last': None, 'offset': 0, 'keyframe': 0, 'deltas': 0}
+
+    # Bring the index up to date if the last append didn't get to write its entry, or the
+    # store was written by a version without an index
+    index = load_index(file_path)
+    if tail['last'] is not None:
+        current = len(index) and index[-1]['segment'] == segment and index[-1]['offset'] == tail['offset']
+    elif sealed:
+        current = len(index) and index[-1]['segment'] == sealed[-1][0]
+    else:
+        current = not len(index)
+    if not current:
+        rebuild_index(file_path)
+        index = load_index(file_path)
+
+    return {
+        'encoder': SnapshotEncoder(book, decoder.stakes if tail['last'] is not None else None, tail['deltas']),
+        'segment': segment,
+        'records': int(np.count_nonzero(index['segment'] == segment)),
+        'keyframe': tail['keyframe'],
+        'state': state,
+    }
+
+def append_snapshot(record, file_path):
+    """
+    Append a single snapshot record to the store, as a keyframe or a delta against the previous
+    record, and index it. Seals the active segment once it holds SEGMENT_RECORDS records.
+    """
+    with _locked_store(file_path):
+        _append_locked(record, file_path)
+
+def _append_locked(record, file_path):
+    writer = _get_store_writer(file_path)
+    _store_writers.pop(file_path, None)
+    encoder = writer['encoder']
+    line = encoder.encode(record)
+    with open(file_path, 'a', encoding='utf-8') as file:
+        offset = file.tell()
+        file.write(line)
+        file.flush()
+        os.fsync(file.fileno())
+        stat = os.fstat(file.fileno())
+
+    if encoder.since_keyframe == 0:
+        writer['keyframe'] = offset
+    _append_index_entry(file_path, (record['block'], _parse_timestamp(record['timestamp']), writer['segment'], offset, writer['keyframe']))
+    writer['records'] += 1
+
+    if writer['records'] >= SEGMENT_RECORDS:
+        # Renaming keeps the inode, so cached positions in this segment stay valid. The next
+        # append starts a new active segment with a keyframe.
+        os.rename(file_path, get_segment_path(file_path, writer['segment']))
+        return
+    writer['state'] = (stat.st_ino, stat.st_size)
+    _store_writers[file_path] = writer
+
+def read_snapshots_from(file_path, offset=0, decoder=None, start_block=None, end_block=None):
+    """
+    Yields (record, end_offset) for every complete record stored in a segment after a byte offset.
+
+    The segment is memory-mapped and decoded one line at a time, so memory use stays
+    constant regardless of how large it grows. Records outside the block range are
+    decoded (deltas depend on them) but never expanded, and reading stops after end_block.
+
+    :param file_path: Path to one segment of a snapshot store.
+    :param offset: Byte offset to start reading from. Must be at a record boundary.
+    :param decoder: SnapshotDecoder holding the stakes at offset. Required unless offset is 0
+        or at a keyframe; it is updated as records are read. Sealed segments share the store's
+        address book, so they must be read with a decoder over get_address_book(store path).
+    :param start_block: Skip records before this block (inclusive bound).
+    :param end_block: Stop after this block (inclusive bound).
+    """
+    if decoder is None:
+        decoder = SnapshotDecoder(get_address_book(file_path))
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= offset:
+            return
+        with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+            while offset < size:
+                end = mapped.find(b'\n', offset)
+                if end == -1:
+                    # A record is only complete once its newline is written.
+                    break
+                line = mapped[offset:end]
+                offset = end + 1
+                try:
+                    parsed = decoder.decode(line)
+                    block = parsed['b'] if 'b' in parsed else parsed['block']
+                    if start_block is not None and block < start_block:
+                        continue
+                    if end_block is not None and block > end_block:
+                        break
+                    record = decoder.materialize(parsed)
+                except (ValueError, KeyError, IndexError) as e:
+                    logger.error(f"Skipping malformed snapshot record: {e}")
+                    continue
+                yield record, offset
+
+def _seek(file_path, segments, start_block):
+    """
+    Finds where to start reading for records from start_block on, using the index.
+
+    :return: (segment number, byte offset of the keyframe to decode from). Falls back to the
+        start of the first segment when the index doesn't cover the block.
+    """
+    first = (segments[0][0], 0)
+    if start_block is None:
+        return first
+    index = load_index(file_path)
+    # Past the last indexed block, the unindexed tail is read from the last indexed keyframe
+    position = min(int(np.searchsorted(index['block'], start_block, side='left')), len(index) - 1)
+    if position < 0:
+        return first
+    entry = index[position]
+    path = _get_segment_file(segments, int(entry['segment']))
+    if path is None or os.path.getsize(path) <= int(entry['keyframe']):
+        return first
+    return int(entry['segment']), int(entry['keyframe'])
+
+def _last_segment_for(file_path, end_block):
+    """Return the segment holding the first indexed record after end_block, or None to read to the end."""
+    if end_block is None:
+        return None
+    index = load_index(file_path)
+    position = int(np.searchsorted(index['block'], end_block, side='right'))
+    if position == len(index):
+        return None
+    return int(index[position]['segment'])
+
+def _plan_chunks(file_path, start_block, end_block, chunk_count):
+    """
+    Splits the indexed records within a block range into chunks that can be decoded independently.
+
+    Chunks start at keyframes, so no delta depends on a record in another chunk.
+
+    :return: List of (segment, keyframe offset, first block, last block), in block order, or
+        None if the index doesn't cover the range. The last chunk's last block is end_block, so
+        it also covers records appended after the index was written.
+    """
+    index = load_index(file_path)
+    first = 0 if start_block is None else int(np.searchsorted(index['block'], start_block, side='left'))
+    stop = len(index) if end_block is None else int(np.searchsorted(index['block'], end_block, side='right'))
+    if first >= stop:
+        return None
+
+    keyframes = np.flatnonzero(index['offset'][first:stop] == index['keyframe'][first:stop]) + first
+    starts = [first]
+    for target in np.linspace(first, stop, chunk_count + 1)[1:-1]:
+        position = int(np.searchsorted(keyframes, target))
+        if position < len(keyframes) and keyframes[position] > starts[-1]:
+            starts.append(int(keyframes[position]))
+
+    chunks = []
+    for number, position in enumerate(starts):
+        entry = index[position]
+        chunk_start = start_block if number == 0 else int(entry['block'])
+        chunk_end = end_block if number == len(starts) - 1 else int(index[starts[number + 1]]['block']) - 1
+        chunks.append((int(entry['segment']), int(entry['keyframe']), chunk_start, chunk_end))
+    return chunks
+
+def _read_chunk(file_path, segment, offset, start_block, end_block):
+    """Decode one chunk of the store (see _plan_chunks) in a worker process."""
+    decoder = SnapshotDecoder(get_address_book(file_path))
+    return list(_iter_store(file_path, start_block, end_block, position=(segment, offset, decoder)))
+
+def _iter_store(file_path, start_block=None, end_block=None, position=None, workers=None):
+    """
+    Yields (record, segment, end_offset) for the store's records within a block range.
+
+    :param position: (segment, byte offset, decoder) to resume reading from instead of
+        seeking with the index.
+    :param workers: Number of processes to decode with. The range is split at keyframes into
+        CHUNKS_PER_WORKER chunks per worker, decoded in a process pool and yielded in block
+        order. Reads serially when the index doesn't cover the range.
+    """
+    segments = list_segments(file_path)
+    if not segments:
+        return
+
+    if workers is not None and workers > 1 and position is None:
+        chunks = _plan_chunks(file_path, start_block, end_block, workers * CHUNKS_PER_WORKER)
+        if chunks is not None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for entries in executor.map(_read_chunk, *zip(*[(file_path,) + chunk for chunk in chunks])):
+                    yield from entries
+            return
+
+    if position is None:
+        segment, offset = _seek(file_path, segments, start_block)
+        decoder = SnapshotDecoder(get_address_book(file_path))
+    else:
+        segment, offset, decoder = position
+    last_segment = _last_segment_for(file_path, end_block)
+
+    # Every segment starts with a keyframe, so one decoder carries across them
+    for number, path in segments:
+        if number < segment:
+            continue
+        if number > segment:
+            offset = 0
+        for record, end_offset in read_snapshots_from(path, offset, decoder, start_block, end_block):
+            yield record, number, end_offset
+        if last_segment is not None and number >= last_segment:
+            break
+
+def iter_snapshots(file_path, start_block=None, end_block=None, workers=None):
+    """
+    Yields snapshot records from the store in block order.
+
+    With a start_block, the index is used to seek straight to the segment and keyframe the
+    range begins at, so the history before it is never read.
+
+    :param file_path: Path to the snapshot store.
+    :param start_block: Skip records before this block (inclusive bound).
+    :param end_block: Skip records after this block (inclusive bound).
+    :param workers: Decode with this many processes, for large ranges. Defaults to reading
+        in this process.
+    """
+    for record, _, _ in _iter_store(file_path, start_block, end_block, workers=workers):
+        yield record
+
+def get_covering_block(file_path, block):
+    """
+    Return the block of the last snapshot at or before a block, i.e. the snapshot whose values
+    still held at that block, or None if there is none.
+    """
+    index = load_index(file_path)
+    position = int(np.searchsorted(index['block'], block, side='right')) - 1
+    return int(index[position]['block']) if position >= 0 else None
+
+def get_file_fingerprint(file_path):
+    """Identify a store file by inode, size and first line so rotation or truncation can be detected."""
+    stat = os.stat(file_path)
+    with open(file_path, 'rb') as file:
+        head = file.readline(4096)
+    return {'device': stat.st_dev, 'inode': stat.st_ino, 'size': stat.st_size, 'head': head}
+
+def _position_is_valid(position, fingerprint):
+    """A saved read position is reusable while its segment is the same file and has only grown."""
+    if position['offset'] == 0:
+        return True
+    return (
+        position['device'] == fingerprint['device']
+        and position['inode'] == fingerprint['inode']
+        and position['offset'] <= fingerprint['size']
+        and position['head'] == fingerprint['head']
+    )
+
+def load_latest_snapshot(file_path):
+    """Return the most recent snapshot record, or None if the store is empty."""
+    # Only the records from the last keyframe of the newest non-empty segment are decoded,
+    # and only the last one is expanded
+    for _, path in reversed(list_segments(file_path)):
+        decoder = SnapshotDecoder(get_address_book(file_path))
+        last = _read_tail(path, decoder)['last']
+        if last is None:
+            continue
+        try:
+            return decoder.materialize(last)
+        except (KeyError, IndexError) as e:
+            logger.error(f"Failed to decode the latest snapshot record: {e}")
+            return None
+    return None
+
+def merge_snapshots(file_path, records):
+    """
+    Merges records into the store, keeping the store ordered by block.
+
+    The merged store is written to temporary segments, re-encoded with fresh keyframes, which
+    then replace the old ones with os.replace, sealed segments first and the active segment
+    last, and the index is rebuilt. Records the logger appends while the merge is running are
+    carried over before the swap, holding the store's lock so no append lands in between.
+    Records for blocks already in the store are dropped.
+
+    :param file_path: Path to the snapshot store.
+    :param records: Iterable of snapshot records, ordered by block.
+    :return: The number of records added.
+    """
+    old_segments = list_segments(file_path)
+    book = get_address_book(file_path)
+    decoder = SnapshotDecoder(book)
+    encoder = None
+    temp_files = []
+    added = 0
+    position = (old_segments[0][0], 0) if old_segments else None
+    last_block = None
+
+    def existing():
+        nonlocal position
+        if position is None:
+            return
+        for record, segment, offset in _iter_store(file_path, position=(position[0], 0, decoder)):
+            position = (segment, offset)
+            yield 0, record
+
+    def new():
+        for record in records:
+            yield 1, record
+
+    def write(record):
+        nonlocal encoder
+        if not temp_files or temp_files[-1][2] >= SEGMENT_RECORDS:
+            # Every segment starts with a keyframe
+            encoder = SnapshotEncoder(book)
+            temp_path = get_segment_path(file_path, len(temp_files)) + '.merge'
+            temp_files.append([temp_path, open(temp_path, 'w', encoding='utf-8'), 0])
+        temp_files[-1][1].write(encoder.encode(record))
+        temp_files[-1][2] += 1
+
+    try:
+        # Existing records sort before new ones for the same block, so the new ones are dropped
+        for source, record in heapq.merge(existing(), new(), key=lambda item: (item[1]['block'], item[0])):
+            if source == 1:
+                if record['block'] == last_block:
+                    continue
+                added += 1
+            write(record)
+            last_block = record['block']
+
+        # Appends wait while the last records are carried over and the segments are swapped
+        with _locked_store(file_path):
+            while position is not None:
+                appended = list(_iter_store(file_path, position=(position[0], position[1], decoder)))
+                if not appended:
+                    break
+                for record, segment, offset in appended:
+                    write(record)
+                    position = (segment, offset)
+
+            for _, file, _ in temp_files:
+                file.flush()
+                os.fsync(file.fileno())
+                file.close()
+
+            # The last segment written becomes the active one
+            for segment, (temp_path, _, _) in enumerate(temp_files):
+                os.replace(temp_path, file_path if segment == len(temp_files) - 1 else get_segment_path(file_path, segment))
+            for segment, path in old_segments:
+                if path != file_path and segment >= len(temp_files) - 1:
+                    os.remove(path)
+
+            _store_writers.pop(file_path, None)
+            rebuild_index(file_path)
+    except BaseException:
+        for temp_path, file, _ in temp_files:
+            file.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        raise
+    return added
+
+def compact_store(file_path):
+    """Rewrite a store holding plain JSON or delta-free records (written by older versions) in the current encoding."""
+    if list_segments(file_path):
+        merge_snapshots(file_path, [])
+
+def import_legacy_log(log_file_path, file_path):
+    """
+    Converts snapshots embedded in the old free-text delegate_info.log into store records.
+
+    :param log_file_path: Path to the legacy delegate_info.log file.
+    :param file_path: Path to the snapshot store to append to.
+    :return: The number of records imported.
+    """
+    price_pattern = re.compile(r"Reporting for block number: (\d+), Price: (\d+(?:\.\d+)?)")
+    snapshot_pattern = re.compile(r"Timestamp: (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}), Block: (\d+), Delegate info for \w+: (\{.*\})")
+
+    imported = 0
+    price = None
+    with open(log_file_path, 'r', encoding='utf-8') as log_file:
+        for line in log_file:
+            price_match = price_pattern.search(line)
+            if price_match:
+                price = float(price_match.group(2))
+                continue
+
+            snapshot_match = snapshot_pattern.search(line)
+            if not snapshot_match:
+                continue
+
+            timestamp, block, delegate_info = snapshot_match.groups()
+            try:
+                delegate_info = json.loads(delegate_info)
+            except json.JSONDecodeError as e:
+                logger.error(f"Error parsing JSON data at block {block}: {e}")
+                continue
+
+            append_snapshot(build_snapshot_record(timestamp, block, delegate_info, price), file_path)
+            imported += 1
+            price = None
+
+    return imported
+
+def main():
+    base_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    log_file_path = os.path.join(base_directory, 'logs', 'delegate_info.log')
+    snapshot_path = os.path.join(base_directory, 'logs', 'delegate_snapshots.jsonl')
+
+    if list_segments(snapshot_path):
+        size = sum(os.path.getsize(path) for _, path in list_segments(snapshot_path))
+        compact_store(snapshot_path)
+        print(f"Snapshot store already exists at {snapshot_path}. Rewrote it in the current encoding "
+              f"({size} -> {sum(os.path.getsize(path) for _, path in list_segments(snapshot_path))} bytes).")
+        return
+
+    imported = import_legacy_log(log_file_path, snapshot_path)
+    print(f"Imported {imported} snapshots into {snapshot_path}.")
+
+if __name__ == "__main__":
+    main()
+
+# Example usage:
+# for record in iter_snapshots('path/to/delegate_snapshots.jsonl', start_block=1000):
+#     print(record['block'], record['total_stake'])
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from .snapshot_data import load_index
+
+logger = logging.getLogger(__name__)
+
+# Missed snapshots are journaled next to the store, at '<store>.gaps', one event per line:
+# 'missed' when a target block could not be snapshotted, 'retry_failed' for every failed retry,
+# and 'filled' or 'abandoned' once it is resolved. The latest event for a block is its state.
+GAPS_SUFFIX = '.gaps'
+
+# Blocks the logger targets (multiples of this interval)
+SNAPSHOT_INTERVAL_BLOCKS = 300
+
+# Retries back off exponentially from RETRY_BASE_SECONDS up to RETRY_MAX_SECONDS. A block is
+# abandoned after MAX_RETRY_ATTEMPTS failed retries, e.g. once it falls out of the node's
+# pruning window; it can still be filled later with a backfill against an archive node.
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+MAX_RETRY_ATTEMPTS = 8
+
+def get_gaps_path(file_path):
+    return file_path + GAPS_SUFFIX
+
+def _append_events(gaps_path, events):
+    """Append events to the gap journal and fsync before returning."""
+    with open(gaps_path, 'a', encoding='utf-8') as file:
+        for event in events:
+            event['time'] = time.time()
+            file.write(json.dumps(event, separators=(',', ':')) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+def record_missed(file_path, blocks, error):
+    """Queue target blocks of the store that could not be snapshotted for retrying."""
+    _append_events(get_gaps_path(file_path), [{'event': 'missed', 'block': block, 'error': error} for block in blocks])
+
+def record_retry_failed(file_path, block, error, attempts):
+    """Record a failed retry, abandoning the block once it has used up its attempts."""
+    event = 'abandoned' if attempts >= MAX_RETRY_ATTEMPTS else 'retry_failed'
+    _append_events(get_gaps_path(file_path), [{'event': event, 'block': block, 'error': error}])
+
+def record_filled(file_path, blocks):
+    _append_events(get_gaps_path(file_path), [{'event': 'filled', 'block': block} for block in blocks])
+
+def load_gaps(file_path):
+    """
+    Replays the store's gap journal.
+
+    :param file_path: Path to the snapshot store.
+    :return: Dictionary of block -> gap, ordered by block. A gap is a dictionary with 'state'
+        ('pending', 'filled' or 'abandoned'), 'attempts' (failed retries so far), 'missed_at'
+        and 'last_attempt' (epoch seconds) and 'error' (the latest error).
+    """
+    gaps = {}
+    gaps_path = get_gaps_path(file_path)
+    if not os.path.exists(gaps_path):
+        return gaps
+
+    with open(gaps_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be torn, by a crash in the middle of a write
+                logger.error("Skipping incomplete snapshot gap journal line")
+                continue
+
+            block = event['block']
+            kind = event['event']
+            if kind == 'missed':
+                gap = gaps.get(block)
+                if gap is None or gap['state'] != 'pending':
+                    gaps[block] = {'state': 'pending', 'attempts': 0, 'missed_at': event['time'],
+                                   'last_attempt': event['time'], 'error': event['error']}
+                continue
+
+            gap = gaps.get(block)
+            if gap is None:
+                continue
+            if kind == 'filled':
+                gap['state'] = 'filled'
+            else:
+                gap['state'] = 'abandoned' if kind == 'abandoned' else 'pending'
+                gap['attempts'] += 1
+                gap['last_attempt'] = event['time']
+                gap['error'] = event['error']
+    return dict(sorted(gaps.items()))
+
+def get_retry_delay(attempts):
+    """Seconds to wait before the next retry of a gap that has failed `attempts` retries."""
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempts)
+
+def get_due_blocks(gaps, now=None):
+    """List the pending blocks whose backoff has elapsed, in block order."""
+    now = time.time() if now is None else now
+    return [
+        block for block, gap in gaps.items()
+        if gap['state'] == 'pending' and now - gap['last_attempt'] >= get_retry_delay(gap['attempts'])
+    ]
+
+def get_missing_blocks(file_path, start_block, end_block, interval=SNAPSHOT_INTERVAL_BLOCKS):
+    """
+    Lists the target blocks within [start_block, end_block] that have no snapshot.
+
+    A target block counts as covered when the store has a snapshot less than half an
+    interval away from it, as for a backfill.
+    """
+    blocks = np.asarray(load_index(file_path)['block'])
+    targets = np.arange(-(-start_block // interval) * interval, end_block + 1, interval, dtype=np.int64)
+    if len(blocks) == 0:
+        return targets.tolist()
+    # Distance from every target to the nearest snapshot on either side
+    after = np.searchsorted(blocks, targets, side='left')
+    nearest_after = blocks[np.minimum(after, len(blocks) - 1)]
+    nearest_before = blocks[np.maximum(after - 1, 0)]
+    distance = np.minimum(np.abs(nearest_after - targets), np.abs(targets - nearest_before))
+    return targets[distance >= interval / 2].tolist()
+
+def get_coverage(file_path, start_block, end_block, interval=SNAPSHOT_INTERVAL_BLOCKS):
+    """
+    Summarizes how completely the store covers a block range, e.g. the range of a payout.
+
+    :return: Dictionary with 'targets' (target blocks in the range), 'missing' (list of those
+        without a snapshot), 'coverage' (fraction of targets covered, 1.0 for an empty range)
+        and 'pending' and 'abandoned' (missing blocks the logger is still retrying or gave up on).
+    """
+    targets = len(range(-(-start_block // interval) * interval, end_block + 1, interval))
+    missing = get_missing_blocks(file_path, start_block, end_block, interval)
+    gaps = load_gaps(file_path)
+    return {
+        'targets': targets,
+        'missing': missing,
+        'coverage': 1 - len(missing) / targets if targets else 1.0,
+        'pending': [block for block in missing if gaps.get(block, {}).get('state') == 'pending'],
+        'abandoned': [block for block in missing if gaps.get(block, {}).get('state') == 'abandoned'],
+    }
+
+def format_coverage(coverage, start_block, end_block):
+    """One-line description of a coverage summary, for payout prompts."""
+    covered = coverage['targets'] - len(coverage['missing'])
+    text = (f"Snapshot coverage for blocks {start_block}-{end_block}: {covered} of {coverage['targets']} "
+            f"target blocks ({coverage['coverage']:.1%})")
+    if coverage['missing']:
+        text += (f"; {len(coverage['pending'])} missing blocks are queued for retry, {len(coverage['abandoned'])} "
+                 f"were abandoned (use a backfill to fill them)")
+    return text + '.'
+
+def resolve_filled_gaps(file_path, interval=SNAPSHOT_INTERVAL_BLOCKS):
+    """Mark open gaps (pending or abandoned) that now have a snapshot, e.g. after a backfill, as filled."""
+    open_blocks = [block for block, gap in load_gaps(file_path).items() if gap['state'] != 'filled']
+    if not open_blocks:
+        return []
+    missing = set(get_missing_blocks(file_path, open_blocks[0], open_blocks[-1], interval))
+    filled = [block for block in open_blocks if block not in missing]
+    if filled:
+        record_filled(file_path, filled)
+    return filled
@@ -0,0 +1,245 @@
+import datetime
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .snapshot_codec import RAO_PER_TAO
+from .snapshot_data import (_iter_store, _plan_chunks, _read_chunk, _get_segment_file, _position_is_valid, _parse_timestamp,
+                            list_segments, get_file_fingerprint, CHUNKS_PER_WORKER)
+
+logger = logging.getLogger(__name__)
+
+# Columnar form of the snapshot store, one row per snapshot in block order:
+# blocks, timestamps (epoch seconds), prices (nan when unknown), total_stake, delegate_stake,
+# take, total_daily_return: one array entry per snapshot
+# addresses: list of nominator addresses, address_ids: dict mapping address -> its index
+# rows, columns, stakes_rao: one entry per (snapshot, nominator) stake, in row order
+SnapshotTable = namedtuple('SnapshotTable', [
+    'blocks', 'timestamps', 'prices', 'total_stake', 'delegate_stake', 'take', 'total_daily_return',
+    'addresses', 'address_ids', 'rows', 'columns', 'stakes_rao',
+])
+
+# Per-snapshot columns, with the record field they are read from and their dtype
+TABLE_COLUMNS = (
+    ('blocks', 'block', np.int64),
+    ('prices', 'price', np.float64),
+    ('total_stake', 'total_stake', np.float64),
+    ('delegate_stake', 'delegate_stake', np.float64),
+    ('take', 'take', np.float64),
+    ('total_daily_return', 'total_daily_return', np.float64),
+)
+
+TABLE_SUFFIX = '.table.npz'
+
+def _build_table(records):
+    """Build a table from snapshot records, ordered by block."""
+    addresses = []
+    address_ids = {}
+    scalars = {name: [] for name, _, _ in TABLE_COLUMNS}
+    timestamps = []
+    rows = []
+    columns = []
+    stakes = []
+
+    for row, record in enumerate(records):
+        for name, field, _ in TABLE_COLUMNS:
+            value = record[field]
+            scalars[name].append(np.nan if value is None else value)
+        timestamps.append(_parse_timestamp(record['timestamp']))
+        for address, stake in record['nominators'] or ():
+            column = address_ids.get(address)
+            if column is None:
+                column = address_ids[address] = len(addresses)
+                addresses.append(address)
+            rows.append(row)
+            columns.append(column)
+            stakes.append(stake)
+
+    return SnapshotTable(
+        timestamps=np.array(timestamps, dtype=np.int64),
+        addresses=addresses,
+        address_ids=address_ids,
+        rows=np.array(rows, dtype=np.int64),
+        columns=np.array(columns, dtype=np.int64),
+        # Same rounding as tao_to_rao, vectorized
+        stakes_rao=np.rint(np.array(stakes, dtype=np.float64) * RAO_PER_TAO).astype(np.int64),
+        **{name: np.array(scalars[name], dtype=dtype) for name, _, dtype in TABLE_COLUMNS}
+    )
+
+def _append_table(table, part):
+    """Append the rows of another table, mapping its address columns onto the table's. Return the new table."""
+    addresses = list(table.addresses)
+    address_ids = dict(table.address_ids)
+    column_map = np.zeros(len(part.addresses), dtype=np.int64)
+    for column, address in enumerate(part.addresses):
+        mapped = address_ids.get(address)
+        if mapped is None:
+            mapped = address_ids[address] = len(addresses)
+            addresses.append(address)
+        column_map[column] = mapped
+
+    return SnapshotTable(
+        timestamps=np.concatenate([table.timestamps, part.timestamps]),
+        addresses=addresses,
+        address_ids=address_ids,
+        rows=np.concatenate([table.rows, part.rows + len(table.blocks)]),
+        columns=np.concatenate([table.columns, column_map[part.columns]]),
+        stakes_rao=np.concatenate([table.stakes_rao, part.stakes_rao]),
+        **{name: np.concatenate([getattr(table, name), getattr(part, name)]) for name, _, _ in TABLE_COLUMNS}
+    )
+
+def _read_table_chunk(file_path, segment, offset, start_block, end_block):
+    """
+    Decode one chunk of the store (see _plan_chunks) into a table in a worker process. Tables
+    are returned rather than records as their arrays are much cheaper to send between processes.
+
+    :return: (table, segment, end offset of its last record), or None if the chunk is empty.
+    """
+    entries = _read_chunk(file_path, segment, offset, start_block, end_block)
+    if not entries:
+        return None
+    _, segment, offset = entries[-1]
+    return _build_table([record for record, _, _ in entries]), segment, offset
+
+def _load_cache(cache_path):
+    """Load a cached table and the store position it covers. Return (None, None) if there is none."""
+    if not os.path.exists(cache_path):
+        return None, None
+    try:
+        with np.load(cache_path) as cache:
+            addresses = cache['addresses'].tolist()
+            table = SnapshotTable(
+                addresses=addresses,
+                address_ids={address: column for column, address in enumerate(addresses)},
+                **{name: cache[name] for name in SnapshotTable._fields if name not in ('addresses', 'address_ids')}
+            )
+            position = {
+                'segment': int(cache['segment']),
+                'offset': int(cache['offset']),
+                'device': int(cache['device']),
+                'inode': int(cache['inode']),
+                'head': cache['head'].item(),
+            }
+        return table, position
+    except Exception as e:
+        logger.error(f"Ignoring unreadable snapshot table cache {cache_path}: {e}")
+        return None, None
+
+def _save_cache(table, position, cache_path):
+    # np.savez adds '.npz' to names that don't end with it
+    temp_path = cache_path[:-len('.npz')] + '.tmp.npz'
+    try:
+        arrays = {name: getattr(table, name) for name in SnapshotTable._fields if name not in ('addresses', 'address_ids')}
+        np.savez_compressed(
+            temp_path,
+            addresses=np.array(table.addresses, dtype=str),
+            segment=position['segment'],
+            offset=position['offset'],
+            device=position['device'],
+            inode=position['inode'],
+            head=np.array(position['head'], dtype=bytes),
+            **arrays
+        )
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.error(f"Failed to save snapshot table cache {cache_path}: {e}")
+
+def load_snapshot_table(file_path, cache_path=None, workers=None):
+    """
+    Loads the snapshot store as a SnapshotTable, parsing only snapshots added since the last call.
+
+    The table is cached in a compressed NumPy file next to the store, together with the segment
+    and byte offset it was read up to and that segment's fingerprint, so it is shared by every
+    dashboard option and process. While the store has only grown, the cached table is extended
+    with the snapshots after its last block, found through the store's index. It is rebuilt
+    when the store was rewritten (e.g. by a merge).
+
+    :param file_path: Path to the snapshot store.
+    :param cache_path: Where to cache the table. Defaults to '<file_path>.table.npz'.
+    :param workers: Number of processes to decode new snapshots with, e.g. when building the
+        table for a large store. Defaults to decoding in this process.
+    :return: A SnapshotTable, empty if the store doesn't exist.
+    """
+    segments = list_segments(file_path)
+    if not segments:
+        return _build_table([])
+
+    cache_path = cache_path or file_path + TABLE_SUFFIX
+    table, position = _load_cache(cache_path)
+    path = _get_segment_file(segments, position['segment']) if position is not None else None
+    if path is None or not _position_is_valid(position, get_file_fingerprint(path)):
+        table = _build_table([])
+
+    start_block = int(table.blocks[-1]) + 1 if len(table.blocks) else None
+    chunks = None
+    if workers is not None and workers > 1:
+        chunks = _plan_chunks(file_path, start_block, None, workers * CHUNKS_PER_WORKER)
+    if chunks is not None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_read_table_chunk, *zip(*[(file_path,) + chunk for chunk in chunks])))
+    else:
+        entries = list(_iter_store(file_path, start_block))
+        parts = [(_build_table([record for record, _, _ in entries]), entries[-1][1], entries[-1][2])] if entries else []
+
+    parts = [part for part in parts if part is not None]
+    if not parts:
+        return table
+    for part, segment, offset in parts:
+        table = _append_table(table, part)
+
+    fingerprint = get_file_fingerprint(_get_segment_file(list_segments(file_path), segment))
+    position = {
+        'segment': segment,
+        'offset': offset,
+        'device': fingerprint['device'],
+        'inode': fingerprint['inode'],
+        'head': fingerprint['head'],
+    }
+    _save_cache(table, position, cache_path)
+    return table
+
+def get_address_stakes(table, columns):
+    """
+    Return every snapshot's total stake in tao of the addresses in the given columns (see
+    get_address_columns), summed from the table's (row, column, stake) entries.
+    """
+    selected = np.zeros(len(table.addresses), dtype=bool)
+    selected[columns] = True
+    entries = selected[table.columns]
+    stakes_rao = np.bincount(table.rows[entries], weights=table.stakes_rao[entries], minlength=len(table.blocks))
+    return stakes_rao / RAO_PER_TAO
+
+def get_group_percents(table, column_groups, group_count):
+    """
+    Return a snapshots x groups matrix of the summed nominator percents of each group of
+    addresses, computed like a record's 'nominators_percent': stake / (total_stake - delegate_stake).
+
+    :param column_groups: int64 array mapping every address column to its group, or -1 for
+        addresses in no group.
+    """
+    groups = column_groups[table.columns]
+    entries = groups >= 0
+    cells = table.rows[entries] * group_count + groups[entries]
+    stakes_rao = np.bincount(cells, weights=table.stakes_rao[entries], minlength=len(table.blocks) * group_count)
+    stakes = stakes_rao.reshape(len(table.blocks), group_count) / RAO_PER_TAO
+
+    remaining = table.total_stake - table.delegate_stake
+    percents = np.zeros_like(stakes)
+    positive = remaining > 0
+    percents[positive] = stakes[positive] / remaining[positive, None]
+    return percents
+
+def get_address_columns(table, addresses):
+    """Return the column indexes of those addresses that appear in the table."""
+    return np.array([table.address_ids[address] for address in addresses if address in table.address_ids], dtype=np.int64)
+
+def to_datetime(timestamp):
+    """Convert a table timestamp to a naive UTC datetime, as parsed from a record's 'timestamp'."""
+    return datetime.datetime.fromtimestamp(int(timestamp), datetime.timezone.utc).replace(tzinfo=None)
+
+def get_datetimes(table):
+    """Return every snapshot's timestamp as a naive UTC datetime."""
+    return [to_datetime(timestamp) for timestamp in table.timestamps]
@@ -14,6 +14,14 @@ def save_user_data(data, file_path):
     with open(file_path, 'w', encoding='utf-8') as file:
         json.dump(data, file, indent=4)
 
+def build_address_index(data):
+    """Build a reverse index mapping each address to the user that owns it."""
+    address_index = {}
+    for username, addresses in data.items():
+        for address in addresses:
+            address_index[address] = username
+    return address_index
+
 # The example usage commented out below is for demonstration
 # on how other scripts would use these functions.
 # Example usage:
@@ -13,7 +13,7 @@ def run_delegate_info_logger():
 
     # Prompt for PM2 instance name and hotkey address
     pm2_instance_name = input("Enter PM2 instance name for the delegate info logger: ")
-    hotkey_address = input("Enter the hotkey_ss58_address: ")
+    hotkey_address = input("Enter the hotkey_ss58_address (separate several hotkeys with commas): ").replace(' ', '')
 
     # Ask if the user is running a local or remote Subtensor network
     subtensor_network_choice = input("Connect to local Subtensor network? (yes/no): ").strip().lower()
@@ -29,6 +29,11 @@ def run_delegate_info_logger():
     os.system(f'pm2 start {python_interpreter} --name="{pm2_instance_name}" -- {delegate_logger_path} {hotkey_address} {network_address}')
     print("Delegate info logger is now running in the background.")
 
+def get_hotkey_option():
+    # Every hotkey but the one logged to the default store has a store of its own
+    hotkey_address = input("Enter the hotkey_ss58_address to use (leave empty for the default store): ").strip()
+    return f' --hotkey {hotkey_address}' if hotkey_address else ''
+
 def run_referral_payout():
     python_interpreter = sys.executable
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -44,9 +49,11 @@ def run_referral_payout():
         print("Invalid response. Please enter 'yes' or 'no'.")
         return
 
+    hotkey_option = get_hotkey_option()
+
     print("Starting payout process...")
     # os.system(f'{python_interpreter} {payout_script_path} {network_address}')
-    os.system(f'{python_interpreter} -m src.blockchain.payout {network_address}')
+    os.system(f'{python_interpreter} -m src.blockchain.payout {network_address}{hotkey_option}')
     print("Payout process completed.")
 
 #def run_nominator_payout():
@@ -69,6 +76,22 @@ def run_referral_payout():
   #  os.system(f'{python_interpreter} -m src.blockchain.payout {network_address}')
    # print("Payout process completed.")
 
+def run_delegate_info_backfill():
+    python_interpreter = sys.executable
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    delegate_logger_path = os.path.join(script_dir, 'blockchain', 'delegate_info_logger.py')
+
+    hotkey_address = input("Enter the hotkey_ss58_address (separate several hotkeys with commas): ").replace(' ', '')
+    network_address = input("Enter the Subtensor network address (use an archive node for old blocks): ").strip()
+    start_block = input("Enter the first block to backfill: ").strip()
+    end_block = input("Enter the last block to backfill: ").strip()
+    stride = input("Blocks between snapshots (press Enter for 300): ").strip() or '300'
+    connections = input("Number of parallel connections (press Enter for 4): ").strip() or '4'
+
+    print("Backfilling missing snapshots...")
+    os.system(f'{python_interpreter} {delegate_logger_path} {hotkey_address} {network_address} backfill {start_block} {end_block} {stride} {connections}')
+    print("Backfill completed.")
+
 def stop_delegate_info_logger():
     print("Stopping delegate info logger...")
     os.system('pm2 stop delegate_info_logger')
@@ -85,7 +108,8 @@ def main_menu():
         print("6. Add referral")
         print("7. Edit referrals")
         print("8. Charts and Statistics")
-        print("9. Exit")
+        print("9. Backfill delegate info")
+        print("10. Exit")
 
         choice = input("Enter your choice: ")
 
@@ -94,7 +118,7 @@ def main_menu():
         elif choice == '2':
             run_referral_payout()
         elif choice == '3':
-            os.system('python3 -m src.blockchain.nominator_payout')
+            os.system(f'python3 -m src.blockchain.nominator_payout{get_hotkey_option()}')
         elif choice == '4':
             add_users_submenu()
         elif choice == '5':
@@ -104,8 +128,10 @@ def main_menu():
         elif choice == '7':
             os.system('python3 -m src.referral_management.edit_referrals')
         elif choice == '8':
-            os.system('python3 -m src.dashboard.dashboard_menu')
+            os.system(f'python3 -m src.dashboard.dashboard_menu{get_hotkey_option()}')
         elif choice == '9':
+            run_delegate_info_backfill()
+        elif choice == '10':
             print("Exiting...")
             break
         else:
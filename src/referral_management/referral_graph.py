@@ -0,0 +1,128 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# names: list of every user appearing in the referral table
+# node_ids: dict mapping user name -> node index
+# taxes: float64 array, the tax each node charges its referees
+# edge_referees / edge_referrers: int64 arrays of node indices, one entry per referral,
+#     ordered so a referee's own referrals always come before the referee is taxed
+ReferralGraph = namedtuple('ReferralGraph', ['names', 'node_ids', 'taxes', 'edge_referees', 'edge_referrers'])
+
+def build_referral_graph(referral_data):
+    """
+    Compiles the referral table into a graph with edges in bottom-up order.
+
+    Layers in the table are not trusted for ordering (e.g. 'L10' sorts before 'L2');
+    the order is derived from the referrals themselves.
+
+    :param referral_data: DataFrame with columns Layer, Referrer, Tax, Referee 1, Referee 2, ...
+    :return: A ReferralGraph.
+    :raises ValueError: If the referrals contain a cycle.
+    """
+    node_ids = {}
+    taxes = []
+    referees = []
+    referrers = []
+
+    def node(name):
+        if name not in node_ids:
+            node_ids[name] = len(node_ids)
+            taxes.append(0.0)
+        return node_ids[name]
+
+    for row in referral_data.itertuples(index=False):
+        _, referrer, tax, *row_referees = row
+        referrer_id = node(referrer)
+        taxes[referrer_id] = float(tax)
+        for referee in row_referees:
+            if isinstance(referee, str) and referee:
+                referees.append(node(referee))
+                referrers.append(referrer_id)
+
+    # Kahn's algorithm from the leaves up: a node is ready once all of its referees are
+    referee_counts = [0] * len(node_ids)
+    referrers_of = [[] for _ in node_ids]
+    for referee, referrer in zip(referees, referrers):
+        referee_counts[referrer] += 1
+        referrers_of[referee].append(referrer)
+
+    ready = [node_id for node_id, count in enumerate(referee_counts) if count == 0]
+    position = [0] * len(node_ids)
+    visited = 0
+    while ready:
+        node_id = ready.pop()
+        position[node_id] = visited
+        visited += 1
+        for referrer in referrers_of[node_id]:
+            referee_counts[referrer] -= 1
+            if referee_counts[referrer] == 0:
+                ready.append(referrer)
+
+    if visited < len(node_ids):
+        raise ValueError("Referral structure contains a cycle.")
+
+    edge_order = sorted(range(len(referees)), key=lambda edge: position[referees[edge]])
+    return ReferralGraph(
+        names=list(node_ids),
+        node_ids=node_ids,
+        taxes=np.array(taxes, dtype=np.float64),
+        edge_referees=np.array([referees[edge] for edge in edge_order], dtype=np.int64),
+        edge_referrers=np.array([referrers[edge] for edge in edge_order], dtype=np.int64),
+    )
+
+def load_referral_graph(file_path):
+    """Load the referral CSV and compile it. Return an empty graph if the file doesn't exist."""
+    try:
+        referral_data = pd.read_csv(file_path)
+    except FileNotFoundError:
+        referral_data = pd.DataFrame(columns=['Layer', 'Referrer', 'Tax', 'Referee 1'])
+    return build_referral_graph(referral_data)
+
+def apply_referral_taxes(graph, base_percents):
+    """
+    Moves each referee's referral tax up to their referrer, deepest referrals first.
+
+    A referee's share is taxed after it has collected tax from its own referees.
+    Referrals where either side has no base percent are skipped.
+
+    :param graph: A ReferralGraph.
+    :param base_percents: Dictionary of user name -> base percent.
+    :return: Dictionary of user name -> adjusted percent.
+    """
+    names = graph.names
+    taxes = graph.taxes.tolist()
+    adjusted = dict(base_percents)
+    for referee_id, referrer_id in zip(graph.edge_referees.tolist(), graph.edge_referrers.tolist()):
+        referee = names[referee_id]
+        referrer = names[referrer_id]
+        if referee not in adjusted or referrer not in adjusted:
+            continue
+        tax_amount = adjusted[referee] * taxes[referrer_id]
+        adjusted[referee] -= tax_amount
+        adjusted[referrer] += tax_amount
+    return adjusted
+
+def apply_referral_taxes_array(graph, users, base_percents):
+    """
+    Array form of apply_referral_taxes for many scenarios at once.
+
+    :param graph: A ReferralGraph.
+    :param users: List of user names aligned with the first axis of base_percents.
+    :param base_percents: float64 array of shape (len(users), ...), e.g. one column per snapshot.
+    :return: Array of adjusted percents with the same shape.
+    """
+    adjusted = np.array(base_percents, dtype=np.float64, copy=True)
+    user_rows = {user: row for row, user in enumerate(users)}
+    node_rows = np.array([user_rows.get(name, -1) for name in graph.names], dtype=np.int64)
+
+    for referee_id, referrer_id in zip(graph.edge_referees.tolist(), graph.edge_referrers.tolist()):
+        referee_row = node_rows[referee_id]
+        referrer_row = node_rows[referrer_id]
+        if referee_row < 0 or referrer_row < 0:
+            continue
+        tax_amount = adjusted[referee_row] * graph.taxes[referrer_id]
+        adjusted[referee_row] -= tax_amount
+        adjusted[referrer_row] += tax_amount
+    return adjusted
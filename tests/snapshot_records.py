@@ -0,0 +1,65 @@
+import calendar
+import time
+
+import pytest
+
+HOTKEY = '5HotkeyAddress'
+OWNER = '5OwnerAddress'
+
+# Blocks are 12 seconds apart, counted from 2024-01-01 00:00:00 UTC
+GENESIS_TIME = calendar.timegm((2024, 1, 1, 0, 0, 0))
+BLOCK_SECONDS = 12
+
+def make_record(block, stakes, delegate_stake=5.0, price=1.25):
+    """Builds a store record for a block from a dictionary of nominator address -> stake."""
+    remaining_stake = sum(stakes.values())
+    return {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(GENESIS_TIME + block * BLOCK_SECONDS)),
+        'block': block,
+        'price': price,
+        'hotkey_ss58': HOTKEY,
+        'total_stake': remaining_stake + delegate_stake,
+        'nominators': list(stakes.items()),
+        'nominators_percent': [(address, stake / remaining_stake) for address, stake in stakes.items()],
+        'owner_ss58': OWNER,
+        'delegate_stake': delegate_stake,
+        'take': 0.18,
+        'validator_permits': [1, 3],
+        'registrations': [1, 3],
+        'return_per_1000': 0.25,
+        'total_daily_return': 1.5,
+    }
+
+def evolve_stakes(stakes, rng):
+    """Returns the stakes of the next snapshot: a few stakes change, one may leave and one may join."""
+    stakes = dict(stakes)
+    for address in rng.sample(sorted(stakes), min(3, len(stakes))):
+        stakes[address] = round(stakes[address] + rng.uniform(0, 2), 9)
+    if len(stakes) > 2 and rng.random() < 0.3:
+        del stakes[rng.choice(sorted(stakes))]
+    if rng.random() < 0.3:
+        stakes[f'5Nominator{rng.randrange(1000)}'] = round(rng.uniform(1, 100), 9)
+    return stakes
+
+def make_history(blocks, rng, nominators=10):
+    """Builds one record per block, with stakes evolving from one to the next."""
+    stakes = {f'5Nominator{i}': round(rng.uniform(1, 100), 9) for i in range(nominators)}
+    records = []
+    for block in blocks:
+        records.append(make_record(block, stakes))
+        stakes = evolve_stakes(stakes, rng)
+    return records
+
+def assert_same_record(decoded, record):
+    """Decoded records hold the same values, with stakes at rao precision and nominators as pairs."""
+    assert decoded.keys() == record.keys()
+    for field in record:
+        if field in ('nominators', 'nominators_percent'):
+            assert dict(decoded[field]) == _approx(dict(record[field]))
+        elif field in ('total_stake', 'delegate_stake'):
+            assert decoded[field] == _approx(record[field])
+        else:
+            assert decoded[field] == record[field]
+
+def _approx(expected):
+    return pytest.approx(expected, rel=1e-12, abs=1e-9)
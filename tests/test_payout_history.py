@@ -0,0 +1,77 @@
+from src.data_management import payout_history
+from src.data_management.payout_history import (iter_lines_backward, get_last_paid_block, update_index, list_payout_runs,
+                                                load_payout_run, get_payment_history, PAYOUT_LOG_COLUMNS,
+                                                PAYMENT_HISTORY_COLUMNS)
+
+HEADER = 'User,Address,Amount,Start Block,End Block,Payout Pool Total\n'
+
+def payout_lines(start_block, end_block, users):
+    return ''.join(f'{user},5{user.title()},{amount},{start_block},{end_block},10.0\n' for user, amount in users.items())
+
+def write_history(tmp_path, *parts):
+    history_path = str(tmp_path / 'payout_log.csv')
+    with open(history_path, 'w', encoding='utf-8', newline='') as file:
+        file.write(''.join(parts))
+    return history_path
+
+def append_history(history_path, *parts):
+    with open(history_path, 'a', encoding='utf-8', newline='') as file:
+        file.write(''.join(parts))
+
+def test_lines_are_read_backwards_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(payout_history, 'TAIL_CHUNK_SIZE', 7)
+    lines = [f'line {number} ' + 'x' * (number % 11) for number in range(50)]
+    history_path = write_history(tmp_path, '\r\n'.join(lines[:25]) + '\n\n' + '\n'.join(lines[25:]))
+
+    assert list(iter_lines_backward(history_path)) == lines[::-1]
+    assert list(iter_lines_backward(str(tmp_path / 'missing.csv'))) == []
+
+def test_last_paid_block_comes_from_the_last_complete_line(tmp_path):
+    history_path = write_history(tmp_path, HEADER)
+    assert get_last_paid_block(history_path, PAYOUT_LOG_COLUMNS) is None
+    assert get_last_paid_block(str(tmp_path / 'missing.csv'), PAYOUT_LOG_COLUMNS) is None
+
+    append_history(history_path, payout_lines(100, 200, {'alice': 1.5, 'bob': 2.5}), payout_lines(201, 300, {'alice': 1.0}))
+    assert get_last_paid_block(history_path, PAYOUT_LOG_COLUMNS) == 300
+    # A crash mid-write leaves a torn line
+    append_history(history_path, 'bob,5Bob,3.')
+    assert get_last_paid_block(history_path, PAYOUT_LOG_COLUMNS) == 300
+
+def test_payment_history_layout(tmp_path):
+    history_path = str(tmp_path / 'payment_history.log')
+    with open(history_path, 'w', encoding='utf-8') as file:
+        file.write('100,200,5Alice,1.5\n100,200,5Bob,2.5\n201,300,5Alice,1.0\n')
+
+    assert get_last_paid_block(history_path, PAYMENT_HISTORY_COLUMNS) == 300
+    assert [payment['amount'] for payment in get_payment_history(history_path, PAYMENT_HISTORY_COLUMNS, '5Alice')] == ['1.5', '1.0']
+
+def test_runs_are_listed_and_read_from_the_index(tmp_path):
+    history_path = write_history(tmp_path, HEADER, payout_lines(100, 200, {'alice': 1.5, 'bob': 2.5, 'carol': 0.5}),
+                                 payout_lines(201, 300, {'alice': 1.0, 'bob': 2.0}))
+
+    runs = list_payout_runs(history_path, PAYOUT_LOG_COLUMNS)
+    assert [(run['start_block'], run['end_block'], run['recipients']) for run in runs] == [(100, 200, 3), (201, 300, 2)]
+    assert [line['recipient'] for line in load_payout_run(history_path, PAYOUT_LOG_COLUMNS, runs[1])] == ['alice', 'bob']
+
+    payments = get_payment_history(history_path, PAYOUT_LOG_COLUMNS, 'bob')
+    assert [(payment['end_block'], payment['amount']) for payment in payments] == [(200, '2.5'), (300, '2.0')]
+    assert get_payment_history(history_path, PAYOUT_LOG_COLUMNS, 'dave') == []
+
+def test_the_index_follows_appends(tmp_path):
+    history_path = write_history(tmp_path, HEADER, payout_lines(100, 200, {'alice': 1.5}))
+    assert len(update_index(history_path, PAYOUT_LOG_COLUMNS)) == 1
+
+    # A line still being written isn't indexed until its newline is
+    append_history(history_path, payout_lines(201, 300, {'alice': 1.0, 'bob': 2.0}), 'carol,5Carol,0.5,201,3')
+    assert len(update_index(history_path, PAYOUT_LOG_COLUMNS)) == 3
+    append_history(history_path, '00,10.0\n')
+    assert [payment['end_block'] for payment in get_payment_history(history_path, PAYOUT_LOG_COLUMNS, 'carol')] == [300]
+    assert len(update_index(history_path, PAYOUT_LOG_COLUMNS)) == 4
+
+def test_the_index_is_rebuilt_after_the_history_is_edited(tmp_path):
+    history_path = write_history(tmp_path, HEADER, payout_lines(100, 200, {'alice': 1.5, 'bob': 2.5}))
+    update_index(history_path, PAYOUT_LOG_COLUMNS)
+
+    write_history(tmp_path, HEADER, payout_lines(100, 250, {'alice': 1.5, 'bob': 2.5, 'carol': 0.5}))
+    runs = list_payout_runs(history_path, PAYOUT_LOG_COLUMNS)
+    assert [(run['start_block'], run['end_block'], run['recipients']) for run in runs] == [(100, 250, 3)]
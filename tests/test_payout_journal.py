@@ -0,0 +1,135 @@
+from src.blockchain.mock_subtensor import MockSubtensor
+from src.blockchain.payout_journal import (start_run, record_submitted, record_result, load_runs, find_open_run,
+                                           transfers_in_state, resolve_in_doubt, PAID_STATES, UNPAID_STATES)
+from src.blockchain.transfers import batch_transfer, concurrent_transfer, compose_transfer_call
+
+POOL = 'pool'
+
+class Keypair:
+    def __init__(self, ss58_address):
+        self.ss58_address = ss58_address
+
+def make_transfers(count):
+    return [(f'user{i}', f'address{i}', 1000 + i) for i in range(count)]
+
+def send(chain, journal_path, run_id, transfers, send_transfers=batch_transfer, **kwargs):
+    """Sends transfers journaled like payout.send_transfers does."""
+    return send_transfers(chain, Keypair(POOL), transfers,
+                          on_signed=lambda keys, nonce, extrinsic_hash: record_submitted(journal_path, run_id, keys, nonce, extrinsic_hash),
+                          on_result=lambda key, result: record_result(journal_path, run_id, key, result),
+                          **kwargs)
+
+def test_resumed_run_only_pays_unpaid_recipients(tmp_path):
+    journal_path = str(tmp_path / 'payout_journal.jsonl')
+    chain = MockSubtensor(balances={POOL: 10 ** 12}, fail_addresses={'address4'})
+    transfers = make_transfers(6)
+    run_id = start_run(journal_path, transfers, 300, 900, '1.000000000', chain.get_current_block())
+
+    send(chain, journal_path, run_id, transfers, batch_size=2)
+    run = find_open_run(journal_path)
+    assert run['run_id'] == run_id
+    assert [key for key, _, _ in transfers_in_state(run, UNPAID_STATES)] == ['user4', 'user5']
+
+    # The rejection is fixed and the run resumed with the recipients that weren't paid
+    chain.substrate.fail_addresses = set()
+    send(chain, journal_path, run_id, transfers_in_state(run, UNPAID_STATES), batch_size=2)
+    run = load_runs(journal_path)[run_id]
+    assert len(transfers_in_state(run, PAID_STATES)) == 6
+    assert [chain.substrate.balances[f'address{i}'] for i in range(6)] == [1000 + i for i in range(6)]
+
+def test_lost_response_is_resolved_as_included(tmp_path):
+    journal_path = str(tmp_path / 'payout_journal.jsonl')
+    chain = MockSubtensor(balances={POOL: 10 ** 12}, lost_response_addresses={'address1'})
+    transfers = make_transfers(4)
+    run_id = start_run(journal_path, transfers, 300, 900, '1.000000000', chain.get_current_block())
+
+    results = send(chain, journal_path, run_id, transfers, batch_size=2)
+    # The batch landed but its submission raised, so its outcome was never recorded
+    assert not results['user0']['success']
+    run = load_runs(journal_path)[run_id]
+    assert run['transfers']['user0']['state'] == 'submitted'
+
+    assert resolve_in_doubt(chain, journal_path, run, Keypair(POOL)) == []
+    run = load_runs(journal_path)[run_id]
+    assert transfers_in_state(run, UNPAID_STATES) == []
+    assert len(transfers_in_state(run, PAID_STATES)) == 4
+    assert chain.substrate.balances['address1'] == 1001
+
+def test_resolve_in_doubt_fails_a_transfer_whose_nonce_was_used(tmp_path):
+    journal_path = str(tmp_path / 'payout_journal.jsonl')
+    chain = MockSubtensor(balances={POOL: 10 ** 12})
+    run_id = start_run(journal_path, make_transfers(1), 300, 900, '1.000000000', chain.get_current_block())
+    # Signed and journaled, but lost before reaching the pool; another extrinsic then took its nonce
+    record_submitted(journal_path, run_id, ['user0'], 0, '0xlost')
+    batch_transfer(chain, Keypair(POOL), [('other', 'address9', 5)])
+
+    run = load_runs(journal_path)[run_id]
+    assert resolve_in_doubt(chain, journal_path, run, Keypair(POOL)) == []
+    assert load_runs(journal_path)[run_id]['transfers']['user0']['state'] == 'failed'
+
+def test_resolve_in_doubt_fails_a_transfer_that_was_never_broadcast(tmp_path):
+    journal_path = str(tmp_path / 'payout_journal.jsonl')
+    chain = MockSubtensor(balances={POOL: 10 ** 12})
+    run_id = start_run(journal_path, make_transfers(1), 300, 900, '1.000000000', chain.get_current_block())
+    # Journaled, then the payout stopped before broadcasting it
+    record_submitted(journal_path, run_id, ['user0'], 0, '0xunsent')
+
+    run = load_runs(journal_path)[run_id]
+    assert resolve_in_doubt(chain, journal_path, run, Keypair(POOL)) == []
+    assert load_runs(journal_path)[run_id]['transfers']['user0']['state'] == 'failed'
+    # Nothing waits behind its nonce, so no remark is needed
+    assert chain.substrate.pool == []
+
+    send(chain, journal_path, run_id, transfers_in_state(run, UNPAID_STATES))
+    assert len(transfers_in_state(load_runs(journal_path)[run_id], PAID_STATES)) == 1
+    assert chain.substrate.balances['address0'] == 1000
+
+def test_resolve_in_doubt_fills_an_unbroadcast_nonce_holding_up_pooled_transfers(tmp_path):
+    journal_path = str(tmp_path / 'payout_journal.jsonl')
+    chain = MockSubtensor(balances={POOL: 10 ** 12})
+    substrate = chain.substrate
+    transfers = make_transfers(2)
+    run_id = start_run(journal_path, transfers, 300, 900, '1.000000000', chain.get_current_block())
+    # Transfers signed concurrently: nonce 0 was journaled but never broadcast, and nonce 1
+    # waits in the pool behind it
+    record_submitted(journal_path, run_id, ['user0'], 0, '0xunsent')
+    extrinsic = substrate.create_signed_extrinsic(call=compose_transfer_call(substrate, 'address1', 1001),
+                                                  keypair=Keypair(POOL), nonce=1)
+    record_submitted(journal_path, run_id, ['user1'], 1, extrinsic.extrinsic_hash)
+    substrate.submit_extrinsic(extrinsic)
+
+    run = load_runs(journal_path)[run_id]
+    assert resolve_in_doubt(chain, journal_path, run, Keypair(POOL)) == ['user1']
+    assert run['transfers']['user0']['state'] == 'failed'
+    assert run['transfers']['user1']['state'] == 'submitted'
+
+    # The remark signed with nonce 0 lets the pooled transfer land
+    chain.get_current_block()
+    run = load_runs(journal_path)[run_id]
+    assert resolve_in_doubt(chain, journal_path, run, Keypair(POOL)) == []
+    assert run['transfers']['user1']['state'] == 'included'
+
+    send(chain, journal_path, run_id, transfers_in_state(run, UNPAID_STATES))
+    run = load_runs(journal_path)[run_id]
+    assert len(transfers_in_state(run, PAID_STATES)) == 2
+    assert [substrate.balances['address0'], substrate.balances['address1']] == [1000, 1001]
+
+def test_concurrent_run_with_a_dropped_transfer_resumes_it(tmp_path):
+    journal_path = str(tmp_path / 'payout_journal.jsonl')
+    chain = MockSubtensor(balances={POOL: 10 ** 12}, drop_addresses={'address2'})
+    transfers = make_transfers(5)
+    run_id = start_run(journal_path, transfers, 300, 900, '1.000000000', chain.get_current_block())
+
+    send(chain, journal_path, run_id, transfers, concurrent_transfer, timeout_blocks=2, poll_interval=0)
+    run = load_runs(journal_path)[run_id]
+    # Given up on without being seen in a block, so it is settled on resume
+    assert run['transfers']['user2']['state'] == 'submitted'
+    assert resolve_in_doubt(chain, journal_path, run, Keypair(POOL)) == []
+    unpaid = transfers_in_state(run, UNPAID_STATES)
+    assert [key for key, _, _ in unpaid] == ['user2']
+
+    chain.substrate.drop_addresses = set()
+    send(chain, journal_path, run_id, unpaid, concurrent_transfer, poll_interval=0)
+    run = load_runs(journal_path)[run_id]
+    assert len(transfers_in_state(run, PAID_STATES)) == 5
+    assert chain.substrate.balances['address2'] == 1002
@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from src.blockchain.payout_math import (tao_to_rao, format_rao, percents_to_fixed, allocate_rao, deduct_fees, get_extrinsic_fee,
+                                        get_total_fee, FeeSchedule, DEFAULT_FEE_SCHEDULE, TRANSFER_FEE_RAO, PERCENT_SHIFT)
+
+def test_tao_to_rao_is_exact():
+    assert tao_to_rao('0.1') == 100000000
+    assert tao_to_rao(0.1) == 100000000
+    assert tao_to_rao('123456789.123456789') == 123456789123456789
+    # Half a rao rounds to even
+    assert tao_to_rao('0.0000000005') == 0
+    assert tao_to_rao('0.0000000015') == 2
+
+@pytest.mark.parametrize('amount', ['abc', 'nan', 'inf', ''])
+def test_tao_to_rao_rejects_invalid_amounts(amount):
+    with pytest.raises(ValueError):
+        tao_to_rao(amount)
+
+def test_format_rao():
+    assert format_rao(1500000000) == '1.500000000'
+    assert format_rao(-5) == '-0.000000005'
+    assert tao_to_rao(format_rao(123456789123456789)) == 123456789123456789
+
+def test_allocations_add_up_to_the_pool():
+    rng = random.Random(10)
+    for _ in range(200):
+        weights = [rng.random() ** 4 for _ in range(rng.randint(1, 50))]
+        total = sum(weights)
+        percents = {f'user{i}': weight / total for i, weight in enumerate(weights)}
+        pool_rao = rng.randint(0, 10 ** 18)
+
+        allocations = allocate_rao(percents, pool_rao)
+        assert list(allocations) == list(percents)
+        # Exactly the pool times the fixed point percents, rounded to the nearest rao
+        fixed_total = sum(percents_to_fixed(list(percents.values())).tolist())
+        assert sum(allocations.values()) == (pool_rao * fixed_total + (1 << (PERCENT_SHIFT - 1))) >> PERCENT_SHIFT
+        for user, percent in percents.items():
+            assert abs(allocations[user] - percent * pool_rao) <= 1 + pool_rao * 2 ** -50
+
+def test_percents_summing_to_one_allocate_the_whole_pool():
+    percents = {'a': 0.5, 'b': 0.25, 'c': 0.125, 'd': 0.0625, 'e': 0.0625}
+    for pool_rao in (0, 1, 7, 10 ** 9 + 3, 2 ** 63 + 11):
+        assert sum(allocate_rao(percents, pool_rao).values()) == pool_rao
+
+def test_leftover_rao_go_to_the_earlier_of_equal_remainders():
+    assert allocate_rao({'a': 1 / 3, 'b': 1 / 3, 'c': 1 / 3}, 10) == {'a': 4, 'b': 3, 'c': 3}
+
+def test_allocations_of_a_partial_pool():
+    # Half of 1001 rounds to 501 rao, the leftover one going to the earlier recipient
+    assert allocate_rao({'a': 0.25, 'b': 0.25}, 1001) == {'a': 251, 'b': 250}
+
+def test_negative_percents_are_rejected():
+    with pytest.raises(ValueError):
+        allocate_rao({'a': 1.5, 'b': -0.5}, 100)
+
+def test_batch_fees_are_interpolated_and_rounded_up():
+    schedule = FeeSchedule(144, 276, 4)
+    assert [get_extrinsic_fee(schedule, count) for count in range(1, 5)] == [144, 188, 232, 276]
+    assert get_total_fee(schedule, 9) == 2 * 276 + 144
+    assert get_total_fee(FeeSchedule(100, 201, 3), 2) == 151
+    assert get_total_fee(DEFAULT_FEE_SCHEDULE, 5) == 5 * TRANSFER_FEE_RAO
+
+def test_fees_are_split_between_the_paid_recipients():
+    schedule = FeeSchedule(144, 276, 4)
+    allocations = {'a': 10 ** 9, 'b': 5 * 10 ** 8, 'c': 3, 'd': 0, 'e': 7 * 10 ** 8}
+
+    payouts = deduct_fees(allocations, schedule)
+    # c can't cover its share of the fee and d has nothing, so neither is paid
+    assert payouts['c'] == 0 and payouts['d'] == 0
+    paid = [recipient for recipient, payout in payouts.items() if payout > 0]
+    assert paid == ['a', 'b', 'e']
+    fees = {recipient: allocations[recipient] - payouts[recipient] for recipient in paid}
+    # 232 rao for one batch of 3, one more rao for the first recipient
+    assert fees == {'a': 78, 'b': 77, 'e': 77}
+    assert sum(payouts.values()) + get_total_fee(schedule, len(paid)) == sum(allocations[recipient] for recipient in paid)
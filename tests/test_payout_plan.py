@@ -0,0 +1,99 @@
+import pytest
+
+pytest.importorskip('bittensor')
+
+from src.blockchain import nominator_payout
+from src.blockchain.mock_subtensor import MockSubtensor
+from src.blockchain.payout_journal import find_open_run, load_runs
+from src.blockchain.payout_plan import get_plan_digest, approve_plan, save_plan, load_plan, execute_plan, PLAN_VERSION
+from src.data_management.payout_history import PayoutPaths
+
+POOL = 'pool'
+
+class Keypair:
+    def __init__(self, ss58_address):
+        self.ss58_address = ss58_address
+
+def make_plan(previous_end_block=None):
+    transfers = [[f'5Nominator{i}', f'5Nominator{i}', 10 ** 9 + i] for i in range(5)]
+    return {
+        'version': PLAN_VERSION,
+        'kind': 'nominator',
+        'created': '2024-01-01T00:00:00Z',
+        'network': 'ws://127.0.0.1:9944',
+        'wallet': 'default',
+        'coldkey': POOL,
+        'hotkey': None,
+        'start_block': 301,
+        'end_block': 900,
+        'previous_end_block': previous_end_block,
+        'payout_pool_rao': 5 * 10 ** 9 + 10,
+        'payout_pool_total': '5.000000010',
+        'transfer_mode': 'batch',
+        'batch_size': 2,
+        'fee_schedule': {'single_fee_rao': 144, 'batch_fee_rao': 144, 'batch_size': 1},
+        'estimated_fee_rao': 720,
+        'coverage': 1.0,
+        'transfers': transfers,
+        'approved_digest': None,
+    }
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    paths = PayoutPaths(str(tmp_path / 'delegate_snapshots.jsonl'), str(tmp_path / 'payment_history.log'),
+                        str(tmp_path / 'nominator_payout_journal.jsonl'))
+    monkeypatch.setattr(nominator_payout, 'DEFAULT_PAYOUT_PATHS', paths)
+    return paths
+
+def test_the_digest_covers_everything_but_the_approval():
+    plan = make_plan()
+    digest = get_plan_digest(plan)
+    assert approve_plan(plan)['approved_digest'] == digest
+    assert get_plan_digest(plan) == digest
+
+    plan['transfers'][0][2] += 1
+    assert get_plan_digest(plan) != digest
+
+def test_saved_plans_stay_approved(tmp_path):
+    plan_path = str(tmp_path / 'nominator_payout_plan.json')
+    save_plan(approve_plan(make_plan()), plan_path)
+    plan = load_plan(plan_path)
+    assert plan['approved_digest'] == get_plan_digest(plan)
+
+    save_plan(dict(plan, version=PLAN_VERSION + 1), plan_path)
+    with pytest.raises(ValueError):
+        load_plan(plan_path)
+
+def test_unapproved_plans_are_refused():
+    with pytest.raises(ValueError):
+        execute_plan(None, Keypair(POOL), make_plan())
+
+def test_plans_changed_after_their_approval_are_refused():
+    plan = approve_plan(make_plan())
+    plan['transfers'][0][1] = '5Attacker'
+    with pytest.raises(ValueError):
+        execute_plan(None, Keypair(POOL), plan)
+
+def test_plans_for_another_wallet_are_refused():
+    with pytest.raises(ValueError):
+        execute_plan(None, Keypair('another'), approve_plan(make_plan()))
+
+def test_dry_runs_record_nothing(paths, tmp_path):
+    chain = MockSubtensor(balances={POOL: 10 ** 12})
+    assert execute_plan(chain, Keypair(POOL), approve_plan(make_plan()), dry_run=True)
+    assert list(tmp_path.iterdir()) == []
+
+def test_approved_plans_are_paid_once(paths):
+    chain = MockSubtensor(balances={POOL: 10 ** 12})
+    plan = approve_plan(make_plan())
+
+    assert execute_plan(chain, Keypair(POOL), plan)
+    assert [chain.substrate.balances[f'5Nominator{i}'] for i in range(5)] == [10 ** 9 + i for i in range(5)]
+    with open(paths.history_path) as file:
+        assert [line.split(',')[:3] for line in file] == [['0', '900', f'5Nominator{i}'] for i in range(5)]
+    assert find_open_run(paths.journal_path) is None
+    assert len(load_runs(paths.journal_path)) == 1
+
+    # The range is paid now, so the plan is out of date
+    with pytest.raises(ValueError):
+        execute_plan(chain, Keypair(POOL), plan)
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.referral_management.referral_graph import (build_referral_graph, load_referral_graph, apply_referral_taxes,
+                                                    apply_referral_taxes_array)
+
+def make_table(rows):
+    return pd.DataFrame(rows, columns=['Layer', 'Referrer', 'Tax', 'Referee 1', 'Referee 2'])
+
+def test_referees_are_taxed_after_collecting_from_their_own_referees():
+    # The top referral comes first and its layer sorts after the deeper one's
+    graph = build_referral_graph(make_table([
+        ['L2', 'alice', 0.1, 'bob', None],
+        ['L10', 'bob', 0.2, 'carol', 'dave'],
+    ]))
+
+    adjusted = apply_referral_taxes(graph, {'alice': 0.2, 'bob': 0.3, 'carol': 0.4, 'dave': 0.1})
+    # bob collects 0.08 + 0.02 from carol and dave first, then pays 10% of 0.4 to alice
+    assert adjusted == pytest.approx({'alice': 0.24, 'bob': 0.36, 'carol': 0.32, 'dave': 0.08})
+    assert sum(adjusted.values()) == pytest.approx(1.0)
+
+def test_referrals_without_a_base_percent_are_skipped():
+    graph = build_referral_graph(make_table([['L1', 'alice', 0.1, 'bob', 'erin']]))
+    assert apply_referral_taxes(graph, {'bob': 0.5, 'erin': 0.5}) == {'bob': 0.5, 'erin': 0.5}
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        build_referral_graph(make_table([
+            ['L1', 'alice', 0.1, 'bob', None],
+            ['L2', 'bob', 0.1, 'carol', None],
+            ['L3', 'carol', 0.1, 'alice', None],
+        ]))
+
+def test_array_form_matches_the_dictionary_form():
+    graph = build_referral_graph(make_table([
+        ['L1', 'alice', 0.1, 'bob', 'carol'],
+        ['L2', 'bob', 0.25, 'dave', None],
+        ['L2', 'carol', 0.05, 'erin', 'frank'],
+    ]))
+    users = ['frank', 'alice', 'bob', 'carol', 'dave', 'erin', 'grace']
+    base_percents = np.random.default_rng(6).random((len(users), 5))
+
+    adjusted = apply_referral_taxes_array(graph, users, base_percents)
+    for column in range(base_percents.shape[1]):
+        expected = apply_referral_taxes(graph, dict(zip(users, base_percents[:, column].tolist())))
+        assert adjusted[:, column].tolist() == pytest.approx([expected[user] for user in users])
+
+def test_a_missing_referral_file_is_an_empty_graph(tmp_path):
+    graph = load_referral_graph(str(tmp_path / 'referral_layers.csv'))
+    assert graph.names == []
+    assert apply_referral_taxes(graph, {'alice': 1.0}) == {'alice': 1.0}
@@ -0,0 +1,99 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.blockchain.stake_matrix import build_percent_matrix, average_address_percents
+from src.data_management import snapshot_accumulators
+from src.data_management.snapshot_accumulators import update_accumulators, get_ranges_averages, get_range_averages, MAP_ATTEMPTS
+from src.data_management.snapshot_data import append_snapshot, iter_snapshots, merge_snapshots
+
+from snapshot_records import make_history
+
+def make_ranges(rng, first_block, last_block, count=40):
+    starts = [rng.randint(first_block - 50, last_block) for _ in range(count)]
+    ends = [rng.randint(start, last_block) for start in starts]
+    return np.array(starts), np.array(ends)
+
+def assert_matches_the_matrix(store_path, start_blocks, end_blocks):
+    addresses, averages = get_ranges_averages(store_path, start_blocks, end_blocks)
+    matrix = build_percent_matrix(iter_snapshots(store_path))
+    expected = average_address_percents(matrix, start_blocks, end_blocks)
+    columns = [addresses.index(address) for address in matrix.addresses]
+    assert set(addresses) == set(matrix.addresses)
+    assert averages[:, columns] == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'delegate_snapshots.jsonl')
+
+def test_accumulated_averages_match_the_matrix(store_path):
+    rng = random.Random(21)
+    history = make_history(sorted(rng.sample(range(1000, 5000), 300)), rng)
+    for record in history[:120]:
+        append_snapshot(record, store_path)
+    update_accumulators(store_path)
+    for record in history[120:]:
+        append_snapshot(record, store_path)
+    # Only the new snapshots are accumulated: rows 5 to 12 hold snapshots 120, 144, ..., 288
+    assert update_accumulators(store_path) == 8
+    assert update_accumulators(store_path) == 0
+
+    assert_matches_the_matrix(store_path, *make_ranges(rng, history[0]['block'], history[-1]['block']))
+    _, averages = get_range_averages(store_path, 2000, 3000)
+    assert averages.tolist() == get_ranges_averages(store_path, [2000], [3000])[1][0].tolist()
+
+def test_widened_rows_keep_their_sums(store_path, monkeypatch):
+    monkeypatch.setattr(snapshot_accumulators, 'INITIAL_CAPACITY', 4)
+    rng = random.Random(22)
+    history = make_history(range(0, 2000, 10), rng, nominators=6)
+    for start in range(0, len(history), 50):
+        for record in history[start:start + 50]:
+            append_snapshot(record, store_path)
+        update_accumulators(store_path)
+
+    assert_matches_the_matrix(store_path, *make_ranges(rng, 0, history[-1]['block']))
+
+def test_merged_snapshots_are_accumulated_again(store_path):
+    rng = random.Random(23)
+    history = make_history(range(0, 3000, 10), rng)
+    for record in history[100:]:
+        append_snapshot(record, store_path)
+    update_accumulators(store_path)
+
+    merge_snapshots(store_path, history[:100])
+    # The rows no longer line up with the store until they are updated
+    assert get_ranges_averages(store_path, [0], [2000]) is None
+    update_accumulators(store_path)
+    assert_matches_the_matrix(store_path, *make_ranges(rng, 0, history[-1]['block']))
+
+def test_averages_past_the_accumulated_snapshots_are_unavailable(store_path):
+    history = make_history(range(0, 1000, 10), random.Random(24))
+    assert get_ranges_averages(store_path, [0], [500]) is None
+    for record in history[:50]:
+        append_snapshot(record, store_path)
+    update_accumulators(store_path)
+    for record in history[50:]:
+        append_snapshot(record, store_path)
+
+    assert get_ranges_averages(store_path, [0], [490]) is not None
+    assert get_ranges_averages(store_path, [0], [500]) is None
+
+def test_readers_give_up_when_the_rows_keep_being_widened(store_path, monkeypatch):
+    for record in make_history(range(0, 500, 10), random.Random(25)):
+        append_snapshot(record, store_path)
+    update_accumulators(store_path)
+
+    load_meta = snapshot_accumulators._load_meta
+    loads = []
+
+    def widening_load_meta(meta_path):
+        # Every read finds the rows twice as wide as the last one did
+        meta = load_meta(meta_path)
+        loads.append(meta_path)
+        meta['capacity'] = meta['capacity'] * 2 ** len(loads)
+        return meta
+
+    monkeypatch.setattr(snapshot_accumulators, '_load_meta', widening_load_meta)
+    assert get_ranges_averages(store_path, [0], [400]) is None
+    assert len(loads) == 2 * MAP_ATTEMPTS
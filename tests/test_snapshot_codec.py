@@ -0,0 +1,111 @@
+import json
+import random
+
+import pytest
+
+from src.data_management.snapshot_codec import (AddressBook, SnapshotEncoder, SnapshotDecoder, get_address_book, is_keyframe,
+                                                ADDRESS_BOOK_SUFFIX, KEYFRAME_INTERVAL)
+
+from snapshot_records import make_record, make_history, assert_same_record, HOTKEY, OWNER
+
+def round_trip(book, records):
+    encoder = SnapshotEncoder(book)
+    decoder = SnapshotDecoder(book)
+    lines = [encoder.encode(record) for record in records]
+    return lines, [decoder.materialize(decoder.decode(line)) for line in lines]
+
+def test_compact_records_round_trip(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    record = make_record(100, {'5Alice': 12.5, '5Bob': 0.1, '5Carol': 123456.123456789})
+
+    lines, decoded = round_trip(book, [record])
+    assert_same_record(decoded[0], record)
+    compact = json.loads(lines[0])
+    # Stakes are stored as whole rao, nominators_percent not at all
+    assert compact['ts'] == 123473723456789 and compact['ds'] == 5000000000
+    assert compact['n'][1::2] == [12500000000, 100000000, 123456123456789]
+    assert set(compact) == {'t', 'b', 'p', 'tk', 'vp', 'rg', 'r1', 'dr', 'h', 'o', 'ts', 'ds', 'n'}
+    assert not any(address in lines[0] for address in ('5Alice', HOTKEY, OWNER))
+
+def test_nominators_percent_is_derived_from_the_stakes(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    record = make_record(100, {'5Alice': 3.0, '5Bob': 1.0}, delegate_stake=2.0)
+
+    _, decoded = round_trip(book, [record])
+    assert decoded[0]['nominators_percent'] == [('5Alice', 0.75), ('5Bob', 0.25)]
+
+def test_missing_hotkey_and_owner(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    record = make_record(100, {'5Alice': 3.0})
+    record['hotkey_ss58'] = None
+    record['owner_ss58'] = None
+
+    _, decoded = round_trip(book, [record])
+    assert decoded[0]['hotkey_ss58'] is None and decoded[0]['owner_ss58'] is None
+
+def test_addresses_are_interned_once(tmp_path):
+    store_path = str(tmp_path / 'delegate_snapshots.jsonl')
+    book = get_address_book(store_path)
+    round_trip(book, [make_record(block, {'5Alice': 1.0, '5Bob': 2.0}) for block in range(3)])
+
+    with open(store_path + ADDRESS_BOOK_SUFFIX, encoding='utf-8') as file:
+        assert file.read().split() == [HOTKEY, OWNER, '5Alice', '5Bob']
+
+def test_addresses_added_by_another_writer_are_picked_up(tmp_path):
+    book_path = str(tmp_path / 'delegate_snapshots.jsonl') + ADDRESS_BOOK_SUFFIX
+    logger_book = AddressBook(book_path)
+    backfill_book = AddressBook(book_path)
+
+    line = SnapshotEncoder(logger_book).encode(make_record(100, {'5Alice': 1.0}))
+    backfill_line = SnapshotEncoder(backfill_book).encode(make_record(50, {'5Bob': 1.0, '5Alice': 2.0}))
+
+    # Both writers agree on the ids, and a reader that meets an unknown one reloads the file
+    reader = SnapshotDecoder(AddressBook(book_path))
+    assert reader.materialize(reader.decode(line))['nominators'] == [('5Alice', 1.0)]
+    assert reader.materialize(reader.decode(backfill_line))['nominators'] == [('5Bob', 1.0), ('5Alice', 2.0)]
+
+def test_plain_json_records_pass_through(tmp_path):
+    decoder = SnapshotDecoder(get_address_book(str(tmp_path / 'delegate_snapshots.jsonl')))
+    record = make_record(100, {'5Alice': 3.0})
+
+    parsed = decoder.decode(json.dumps(record))
+    assert decoder.materialize(parsed) == json.loads(json.dumps(record))
+
+def test_deltas_between_keyframes_round_trip(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    history = make_history(range(3 * KEYFRAME_INTERVAL + 5), random.Random(15), nominators=40)
+
+    lines, decoded = round_trip(book, history)
+    for record, expected in zip(decoded, history):
+        assert_same_record(record, expected)
+    keyframes = [number for number, line in enumerate(lines) if is_keyframe(json.loads(line))]
+    assert keyframes == [0, KEYFRAME_INTERVAL, 2 * KEYFRAME_INTERVAL, 3 * KEYFRAME_INTERVAL]
+
+def test_deltas_hold_changes_and_removals(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    stakes = {f'5Nominator{i}': float(i + 1) for i in range(10)}
+    changed = dict(stakes, **{'5Nominator3': 7.5, '5Newcomer': 2.0})
+    del changed['5Nominator8']
+
+    lines, decoded = round_trip(book, [make_record(1, stakes), make_record(2, changed)])
+    delta = json.loads(lines[1])
+    assert [book.address(address_id) for address_id in delta['u'][::2]] == ['5Nominator3', '5Newcomer']
+    assert delta['u'][1::2] == [7500000000, 2000000000]
+    assert [book.address(address_id) for address_id in delta['x']] == ['5Nominator8']
+    assert dict(decoded[1]['nominators']) == changed
+
+def test_a_delta_that_would_not_be_smaller_is_a_keyframe(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    stakes = {'5Alice': 1.0, '5Bob': 2.0}
+
+    lines, decoded = round_trip(book, [make_record(1, stakes), make_record(2, {'5Alice': 1.5, '5Bob': 2.5})])
+    assert is_keyframe(json.loads(lines[1]))
+    assert dict(decoded[1]['nominators']) == {'5Alice': 1.5, '5Bob': 2.5}
+
+def test_a_delta_without_a_keyframe_is_rejected(tmp_path):
+    book = get_address_book(str(tmp_path / 'delegate_snapshots.jsonl'))
+    stakes = {f'5Nominator{i}': float(i + 1) for i in range(10)}
+    lines, _ = round_trip(book, [make_record(1, stakes), make_record(2, dict(stakes, **{'5Nominator0': 3.0}))])
+
+    with pytest.raises(ValueError):
+        SnapshotDecoder(book).decode(lines[1])
@@ -0,0 +1,118 @@
+import random
+
+import pytest
+
+from src.data_management.snapshot_data import (append_snapshot, iter_snapshots, read_snapshots_from, merge_snapshots, load_index,
+                                               list_segments, rebuild_index, load_latest_snapshot, get_covering_block,
+                                               SEGMENT_RECORDS)
+from src.data_management.snapshot_codec import SnapshotDecoder, get_address_book
+
+from snapshot_records import make_history, assert_same_record
+
+def make_store(tmp_path, records):
+    store_path = str(tmp_path / 'delegate_snapshots.jsonl')
+    for record in records:
+        append_snapshot(record, store_path)
+    return store_path
+
+def test_merging_backfilled_snapshots_keeps_block_order(tmp_path):
+    history = make_history(range(100, 400, 3), random.Random(11))
+    # The logger wrote every other snapshot; the backfill brings the rest, plus blocks already stored
+    store_path = make_store(tmp_path, history[::2])
+    backfill = history[1::2] + history[10:14]
+    backfill.sort(key=lambda record: record['block'])
+
+    assert merge_snapshots(store_path, backfill) == len(history[1::2])
+    merged = list(iter_snapshots(store_path))
+    assert [record['block'] for record in merged] == [record['block'] for record in history]
+    for decoded, record in zip(merged, history):
+        assert_same_record(decoded, record)
+
+    index = load_index(store_path)
+    assert index['block'].tolist() == [record['block'] for record in history]
+    assert_same_record(load_latest_snapshot(store_path), history[-1])
+
+def test_merged_store_takes_appends_and_range_reads(tmp_path):
+    history = make_history(range(1000, 1600, 5), random.Random(12))
+    store_path = make_store(tmp_path, history[40:80])
+    merge_snapshots(store_path, history[:40])
+    for record in history[80:]:
+        append_snapshot(record, store_path)
+
+    blocks = [record['block'] for record in history]
+    assert [record['block'] for record in iter_snapshots(store_path)] == blocks
+    assert [record['block'] for record in iter_snapshots(store_path, 1203, 1402)] == [block for block in blocks if 1203 <= block <= 1402]
+    index = load_index(store_path).copy()
+    rebuild_index(store_path)
+    assert (load_index(store_path) == index).all()
+
+def test_merging_into_an_empty_store(tmp_path):
+    history = make_history(range(10), random.Random(13))
+    store_path = str(tmp_path / 'delegate_snapshots.jsonl')
+
+    assert merge_snapshots(store_path, history) == len(history)
+    assert len(list_segments(store_path)) == 1
+    assert [record['block'] for record in iter_snapshots(store_path)] == list(range(10))
+
+@pytest.fixture(scope='module')
+def sealed_store(tmp_path_factory):
+    # Two sealed segments and part of the active one, a snapshot every 5 blocks from block 1000
+    history = make_history(range(1000, 1000 + 5 * (2 * SEGMENT_RECORDS + 160), 5), random.Random(16))
+    return make_store(tmp_path_factory.mktemp('store'), history), history
+
+def test_full_segments_are_sealed(sealed_store):
+    store_path, history = sealed_store
+    segments = list_segments(store_path)
+    assert [number for number, _ in segments] == [0, 1, 2]
+    assert segments[-1][1] == store_path
+
+    index = load_index(store_path)
+    assert index['segment'].tolist() == [0] * SEGMENT_RECORDS + [1] * SEGMENT_RECORDS + [2] * 160
+    assert index['block'].tolist() == [record['block'] for record in history]
+    # Every segment starts with a keyframe and decodes on its own
+    for number, path in segments:
+        first = index[index['segment'] == number][0]
+        assert first['offset'] == first['keyframe'] == 0
+        decoder = SnapshotDecoder(get_address_book(store_path))
+        records = [record for record, _ in read_snapshots_from(path, decoder=decoder)]
+        assert [record['block'] for record in records] == index['block'][index['segment'] == number].tolist()
+
+@pytest.mark.parametrize('start_block, end_block', [
+    (None, None),
+    (1000, 1000),
+    (4000, 4700),
+    (4595, 4605),
+    (3600, 10000),
+    (8199, None),
+    (None, 1002),
+    (9000, None),
+    (500, 900),
+])
+def test_range_reads_seek_across_segments(sealed_store, start_block, end_block):
+    store_path, history = sealed_store
+    expected = [record for record in history
+                if (start_block is None or record['block'] >= start_block) and (end_block is None or record['block'] <= end_block)]
+
+    records = list(iter_snapshots(store_path, start_block, end_block))
+    assert [record['block'] for record in records] == [record['block'] for record in expected]
+    for decoded, record in zip(records, expected):
+        assert_same_record(decoded, record)
+
+def test_parallel_reads_match_serial_reads(sealed_store):
+    store_path, _ = sealed_store
+    serial = list(iter_snapshots(store_path, 2000, 8000))
+    assert list(iter_snapshots(store_path, 2000, 8000, workers=2)) == serial
+
+def test_covering_and_latest_snapshots(sealed_store):
+    store_path, history = sealed_store
+    assert get_covering_block(store_path, 999) is None
+    assert get_covering_block(store_path, 1000) == 1000
+    assert get_covering_block(store_path, 4604) == 4600
+    assert get_covering_block(store_path, 10 ** 9) == history[-1]['block']
+    assert_same_record(load_latest_snapshot(store_path), history[-1])
+
+def test_rebuilt_index_matches_the_appended_one(sealed_store):
+    store_path, _ = sealed_store
+    index = load_index(store_path).copy()
+    rebuild_index(store_path)
+    assert (load_index(store_path) == index).all()
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from src.blockchain.stake_matrix import build_percent_matrix, get_block_weights, average_address_percents, average_user_percents
+
+def make_snapshots():
+    return [
+        {'block': 100, 'nominators_percent': [('5Alice', 0.5), ('5Bob', 0.5)]},
+        {'block': 110, 'nominators_percent': [('5Alice', 1.0)]},
+        {'block': 140, 'nominators_percent': [('5Bob', 0.25), ('5Carol', 0.75)]},
+    ]
+
+def test_snapshots_weigh_the_blocks_they_cover():
+    blocks = np.array([100, 110, 140])
+    assert get_block_weights(blocks).tolist() == [10, 30, 1]
+    # The snapshot before the range covers its start; the last one runs to the end of the range
+    assert get_block_weights(blocks, 105, 150).tolist() == [5, 30, 11]
+    assert get_block_weights(blocks, 111, 120).tolist() == [0, 10, 0]
+    assert get_block_weights(blocks, 50, 99).tolist() == [0, 0, 0]
+
+def test_averages_are_weighted_by_blocks():
+    matrix = build_percent_matrix(make_snapshots())
+    assert matrix.addresses == ['5Alice', '5Bob', '5Carol']
+
+    averages = average_address_percents(matrix, 105, 150)
+    assert averages.tolist() == pytest.approx([(5 * 0.5 + 30 * 1.0) / 46, (5 * 0.5 + 11 * 0.25) / 46, 11 * 0.75 / 46])
+
+def test_a_range_between_snapshots_takes_the_covering_one():
+    matrix = build_percent_matrix(make_snapshots())
+    assert average_address_percents(matrix, 120, 130).tolist() == [1.0, 0.0, 0.0]
+
+def test_several_ranges_in_one_pass():
+    matrix = build_percent_matrix(make_snapshots())
+    start_blocks = np.array([100, 105, 120, 10])
+    end_blocks = np.array([140, 150, 130, 20])
+
+    averages = average_address_percents(matrix, start_blocks, end_blocks)
+    for row, (start_block, end_block) in enumerate(zip(start_blocks, end_blocks)):
+        assert averages[row].tolist() == pytest.approx(average_address_percents(matrix, start_block, end_block).tolist())
+    # Nothing covers a range before the first snapshot
+    assert averages[3].tolist() == [0.0, 0.0, 0.0]
+
+def test_user_averages_add_up_their_addresses():
+    matrix = build_percent_matrix(make_snapshots())
+    user_addresses = {'alice': ['5Alice', '5Carol'], 'bob': ['5Bob'], 'dave': ['5Dave']}
+
+    averages = average_user_percents(matrix, user_addresses, 100, 140)
+    assert averages == pytest.approx({'alice': (10 * 0.5 + 30 * 1.0 + 0.75) / 41, 'bob': (10 * 0.5 + 0.25) / 41, 'dave': 0.0})
@@ -0,0 +1,120 @@
+import pytest
+
+from src.blockchain import transfers
+from src.blockchain.mock_subtensor import MockSubtensor
+from src.blockchain.payout_math import allocate_rao, deduct_fees
+from src.blockchain.transfers import batch_transfer, concurrent_transfer, estimate_fee_schedule
+
+POOL = 'pool'
+POOL_BALANCE = 10 ** 12
+
+class Keypair:
+    def __init__(self, ss58_address):
+        self.ss58_address = ss58_address
+
+def make_transfers(count):
+    return [(f'user{i}', f'address{i}', 1000 + i) for i in range(count)]
+
+def make_chain(**kwargs):
+    return MockSubtensor(balances={POOL: POOL_BALANCE}, **kwargs)
+
+def paid(chain, address):
+    return chain.substrate.balances.get(address, 0)
+
+@pytest.fixture(autouse=True)
+def fresh_fee_cache(monkeypatch):
+    # Fee estimates are cached per process; every test prices its own chain
+    monkeypatch.setattr(transfers, '_fee_schedules', {})
+
+def test_batch_transfer_pays_every_recipient_in_batches():
+    chain = make_chain()
+    signed = []
+    results = batch_transfer(chain, Keypair(POOL), make_transfers(10), batch_size=4,
+                             on_signed=lambda keys, nonce, extrinsic_hash: signed.append((keys, nonce)))
+
+    assert all(result['success'] for result in results.values())
+    assert [paid(chain, f'address{i}') for i in range(10)] == [1000 + i for i in range(10)]
+    assert [len(keys) for keys, _ in signed] == [4, 4, 2]
+    assert [nonce for _, nonce in signed] == [0, 1, 2]
+
+def test_batch_transfer_fails_a_batch_with_a_rejected_recipient_as_a_whole():
+    chain = make_chain(fail_addresses={'address5'})
+    reported = {}
+    results = batch_transfer(chain, Keypair(POOL), make_transfers(10), batch_size=4,
+                             on_result=lambda key, result: reported.setdefault(key, result))
+
+    failed = {key for key, result in results.items() if not result['success']}
+    assert failed == {'user4', 'user5', 'user6', 'user7'}
+    assert 'address5 rejected' in results['user5']['error']
+    # Nothing of the failed batch was paid, and the other batches were
+    assert [paid(chain, f'address{i}') for i in range(4, 8)] == [0, 0, 0, 0]
+    assert paid(chain, 'address8') == 1008
+    # The failed batch was included, so its outcome is final and reported
+    assert set(reported) == set(results)
+
+@pytest.mark.parametrize('transfer_mode, batch_size', [('batch', 4), ('batch', 100), ('concurrent', 1)])
+def test_fees_and_payouts_add_up_to_the_pool(transfer_mode, batch_size):
+    chain = make_chain()
+    keypair = Keypair(POOL)
+    pool_rao = 10 ** 9
+    percents = {f'address{i}': (i + 1) / 55 for i in range(10)}
+
+    schedule = estimate_fee_schedule(chain, keypair, 'address9', pool_rao, batch_size)
+    payouts = deduct_fees(allocate_rao(percents, pool_rao), schedule)
+    payout_transfers = [(address, address, amount_rao) for address, amount_rao in payouts.items()]
+    if transfer_mode == 'concurrent':
+        results = concurrent_transfer(chain, keypair, payout_transfers, poll_interval=0)
+    else:
+        results = batch_transfer(chain, keypair, payout_transfers, batch_size)
+
+    assert all(result['success'] for result in results.values())
+    assert POOL_BALANCE - paid(chain, POOL) == pool_rao
+    assert sum(paid(chain, address) for address in percents) == sum(payouts.values())
+
+def test_concurrent_transfer_signs_consecutive_nonces_from_the_account_nonce():
+    chain = make_chain()
+    chain.substrate.nonces[POOL] = 7
+    signed = []
+    results = concurrent_transfer(chain, Keypair(POOL), make_transfers(40), window=16, poll_interval=0,
+                                  on_signed=lambda keys, nonce, extrinsic_hash: signed.append(nonce))
+
+    assert all(result['success'] for result in results.values())
+    assert signed == list(range(7, 47))
+    assert chain.substrate.get_account_nonce(POOL) == 47
+
+def test_concurrent_transfer_retries_a_rejected_transfer_with_fresh_nonces():
+    chain = make_chain(fail_addresses={'address3'})
+    signed = []
+    results = concurrent_transfer(chain, Keypair(POOL), make_transfers(10), max_attempts=3, poll_interval=0,
+                                  on_signed=lambda keys, nonce, extrinsic_hash: signed.append((keys[0], nonce)))
+
+    assert not results['user3']['success']
+    assert 'address3 rejected' in results['user3']['error']
+    assert paid(chain, 'address3') == 0
+    assert all(results[f'user{i}']['success'] for i in range(10) if i != 3)
+    # Three attempts, none of them reusing a nonce
+    assert [key for key, _ in signed].count('user3') == 3
+    assert len({nonce for _, nonce in signed}) == len(signed)
+
+def test_concurrent_transfer_pays_once_when_the_response_is_lost():
+    chain = make_chain(lost_response_addresses={'address2'})
+    results = concurrent_transfer(chain, Keypair(POOL), make_transfers(10), poll_interval=0)
+
+    # The submission raised but the extrinsic was pooled, so it is watched rather than re-signed
+    assert all(result['success'] for result in results.values())
+    assert paid(chain, 'address2') == 1002
+    submitted_to = [extrinsic.call['call_params']['dest'] for extrinsic in chain.substrate.submitted]
+    assert submitted_to.count('address2') == 1
+
+def test_concurrent_transfer_fills_the_nonce_of_a_dropped_transfer():
+    chain = make_chain(drop_addresses={'address3'})
+    results = concurrent_transfer(chain, Keypair(POOL), make_transfers(10), max_attempts=3, timeout_blocks=2,
+                                  poll_interval=0)
+
+    assert not results['user3']['success']
+    assert paid(chain, 'address3') == 0
+    assert all(results[f'user{i}']['success'] for i in range(10) if i != 3)
+    # Every nonce handed out was used by an included extrinsic, so later payouts aren't held up
+    included = sum(len(block['extrinsics']) for block in chain.substrate.blocks.values())
+    assert chain.substrate.get_account_nonce(POOL) == included
+    assert chain.substrate.pool == []